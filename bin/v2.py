@@ -23,6 +23,7 @@ sys.path.append(".")
 import vcontact2
 import vcontact2.protein_clusters
 import vcontact2.pcprofiles
+import vcontact2.refcache
 import vcontact2.contig_clusters
 import vcontact2.evaluations
 import vcontact2.cluster_refinements
@@ -320,6 +321,15 @@ inputs.add_argument(
     dest="vc_mode",
     help="Whether to use ClusterONE or MCL for Viral Cluster (VC) generation.",
 )
+inputs.add_argument(
+    "--mcl-backend",
+    type=str,
+    choices=["mcl", "native"],
+    default="mcl",
+    dest="mcl_backend",
+    help="MCL implementation used for the PCs, VCs and modules: the external mcl binary, or the native "
+    "implementation working on the in-memory networks.",
+)
 inputs.add_argument(
     "--c1-bin",
     default="cluster_one-1.0.jar",
@@ -494,6 +504,19 @@ network.add_argument(
     type=int,
     help="Significance threshold in the contig similarity network.",
 )
+network.add_argument(
+    "--max-memory",
+    dest="max_memory",
+    type=float,
+    help="Memory budget (in GB) for computing the shared PCs between contigs. The similarity networks are "
+    "then computed by blocks of contigs fitting in this budget, instead of all at once.",
+)
+network.add_argument(
+    "--ref-cache-dir",
+    dest="ref_cache_dir",
+    help="Directory where the pairs of reference genomes sharing PCs are cached, one file by --db. When the PCs "
+    "of the references are unchanged from a previous run, only the pairs involving user genomes are computed.",
+)
 network.add_argument(
     "--permissive",
     action="store_true",
@@ -536,6 +559,14 @@ network.add_argument(
     help="Proportion of a module's PC a contig must have to be considered as displaying this module.",
 )
 
+network.add_argument(
+    "--skip-modules",
+    dest="skip_modules",
+    action="store_true",
+    help="Do not compute the protein modules nor link them with the viral clusters. Use when only the viral "
+    "clusters and genome_by_genome_overview.csv are needed.",
+)
+
 outputs = parser.add_argument_group("Output Options")
 outputs.add_argument(
     "-e",
@@ -555,6 +586,12 @@ outputs.add_argument(
     default="predicted_family",
     help="Pooling criterion for cluster export (Cytoscape export only).",
 )
+outputs.add_argument(
+    "--save-networks",
+    dest="save_networks",
+    action="store_true",
+    help="Also save the networks streamed to MCL for the protein clusters (*.abc) and the modules (modules.ntwk).",
+)
 
 misc = parser.add_argument_group("Misc. Options")
 misc.add_argument(
@@ -857,7 +894,11 @@ def get_dfs(
         if pcs_mode == "MCL":
             pcs_fp = vcontact2.protein_clusters.make_protein_clusters_mcl(
                 # similarity_fp, output_dir, args.pc_inflation, threads=args.threads
-                similarity_fp, output_dir, args.pc_inflation
+                similarity_fp,
+                output_dir,
+                args.pc_inflation,
+                save_network=args.save_networks,
+                backend=args.mcl_backend,
             )
         elif pcs_mode == "ClusterONE":
             pcs_fp = vcontact2.protein_clusters.make_protein_clusters_one(
@@ -965,9 +1006,9 @@ def main(args):
     # Protein Cluster Profile
     # .contigs, .pcs, .matrix, .singletons, .ntw, .ntw_modules
     name = "vConTACT2"
-    pcp_fp = os.path.join(output_dir, name + ".pkle")
+    pcp_fp = os.path.join(output_dir, name + ".pcp")
 
-    if not os.path.exists(pcp_fp) or args.force_overwrite:
+    if not os.path.exists(os.path.join(pcp_fp, "manifest.json")) or args.force_overwrite:
         taxonomies = ["Organism/Name", "origin", "order", "family", "genus"]
         extended_taxonomies = [
             "Organism/Name",
@@ -1011,23 +1052,31 @@ def main(args):
             merged_df.to_csv(merged_fp)
 
         print("\n\n" + "{:-^80}".format("Calculating Similarity Networks"))
+        references = None
+        if args.db != "None" and args.ref_cache_dir:
+            references = vcontact2.refcache.ReferenceCache(
+                os.path.join(args.ref_cache_dir, "{}.npz".format(args.db)),
+                vcontact2.refcache.read_reference_ids(ref_g2c[args.db]),
+            )
+
         pcp = vcontact2.pcprofiles.PCProfiles(
             merged_df,
             pcs_csv_df,
             profiles_matrix_singletons,
-            # args.threads,
-            1,
+            args.threads,
             name,
             args.sig,  # 1.0
             args.max_sig,  # 300
             args.mod_sig,  # 1.0
             args.mod_shared_min,  # 3
+            max_memory=None if args.max_memory is None else int(args.max_memory * 1024**3),
+            references=references,
         )
         if not args.force_overwrite:
-            pcp.to_pickle(pcp_fp)
+            pcp.to_store(pcp_fp)
     else:
-        logger.info(f"Re-using existing pickle {pcp_fp}...")
-        pcp = vcontact2.pcprofiles.read_pickle(pcp_fp)
+        logger.info(f"Re-using existing PC-profiles {pcp_fp}...")
+        pcp = vcontact2.pcprofiles.read_store(pcp_fp)
 
     # ntw = sparse matrix (contig x contig, edge weights)
     # pcs = pos, pc_id, size, annotated, keys, nb_proteins
@@ -1059,8 +1108,10 @@ def main(args):
             # permissive -> use abundance (default)
             membership_simple=not args.permissive,
             mode=args.vc_mode,
-            # threads=args.threads,
-            threads=1
+            threads=args.threads,
+            # The final summaries read the network file
+            save_network=True,
+            mcl_backend=args.mcl_backend,
         )
 
         # gc.pcs = pos, pc_id, size, annotated, keys, nb_proteins
@@ -1079,52 +1130,58 @@ def main(args):
 
     try:
         vc = vcontact2.cluster_refinements.ViralClusters(
-            gc.contigs, profiles_df, optimize=args.optimize
+            gc.contigs, profiles_df, optimize=args.optimize, threads=args.threads
         )
     except Exception as e:
         logger.error("Error in viral clusters")
         raise e
 
-    print("\n\n" + "{:-^80}".format("Protein modules"))
+    if args.skip_modules:
+        logger.info("Skipping the protein modules and their link with the viral clusters.")
+        vm = link = None
+    else:
+        print("\n\n" + "{:-^80}".format("Protein modules"))
 
-    try:
-        vm = vcontact2.modules.Modules(
-            pcp,
-            output_dir,
-            # inflation=5.0, threshold=1.0, shared_min=3)
-            inflation=args.mod_inflation,
-            threshold=args.mod_sig,
-            shared_min=args.mod_shared_min,
-            # threads=args.threads,
-            threads=1
-        )
+        try:
+            vm = vcontact2.modules.Modules(
+                pcp,
+                output_dir,
+                # inflation=5.0, threshold=1.0, shared_min=3)
+                inflation=args.mod_inflation,
+                threshold=args.mod_sig,
+                shared_min=args.mod_shared_min,
+                # threads=args.threads,
+                threads=1,
+                save_network=args.save_networks,
+                mcl_backend=args.mcl_backend,
+            )
 
-        # modules has saved module df, both pcs and and modules (2 files)
-        # modules.matrix matrix
-        # modules.matrix_module csc matrix
+            # modules has saved module df, both pcs and and modules (2 files)
+            # modules.matrix matrix
+            # modules.matrix_module csc matrix
 
-    except Exception as e:
-        logger.error("Error in protein module computation")
-        raise e
+        except Exception as e:
+            logger.error("Error in protein module computation")
+            raise e
 
-    # by the time the linking happens, contigs are already forced into clusters that they could be sharing....
-    # VCs and PC modules are independent of each other, as each takes into account the totality of the other, yet isn't
-    # influenced by either's result
+        # by the time the linking happens, contigs are already forced into clusters that they could be sharing....
+        # VCs and PC modules are independent of each other, as each takes into account the totality of the other, yet isn't
+        # influenced by either's result
 
-    print("\n\n" + "{:-^80}".format("Link modules and clusters"))
+        print("\n\n" + "{:-^80}".format("Link modules and clusters"))
 
-    try:
-        link = vm.link_modules_and_clusters_df(
-            gc.clusters,
-            gc.contigs,
-            # thres=1.0, own_threshold=0.5)
-            thres=args.link_sig,
-            own_threshold=args.link_prop,
-        )
-    except Exception as e:
-        link = None
-        logger.error("Error in linking modules and clusters")
-        raise e
+        try:
+            link = vm.link_modules_and_clusters_df(
+                gc.clusters,
+                gc.contigs,
+                # thres=1.0, own_threshold=0.5)
+                thres=args.link_sig,
+                own_threshold=args.link_prop,
+            )
+        except Exception as e:
+            link = None
+            logger.error("Error in linking modules and clusters")
+            raise e
 
     print("\n\n" + "{:-^80}".format("Exporting results files"))
 
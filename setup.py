@@ -63,6 +63,7 @@ setup(name='vcontact2',
         'scikit-learn>=0.24.1',
         'biopython>=1.78',
         'tables>=3.4.0',
+        'pyarrow>=1.0.0',
         'pyparsing>=2.4.6',
         'clusterone',  # Bioconda=1.0 only, pip has a lot
         # 'diamond>=0.9.14', conda-forge has different diamond
@@ -1,6 +1,7 @@
 """ Functions to build the associations between the objects from the matrices. """
 import numpy as np
 import pandas as pd
+import scipy.sparse as sparse
 
 
 def cluster_taxonomy(clusters, taxonomy, level, P, R):
@@ -22,11 +23,15 @@ def cluster_taxonomy(clusters, taxonomy, level, P, R):
             "pos_cluster" and "recall".
     """
 
+    # The sparse argmax returns the first maximum, as numpy does.
+    P = sparse.csr_matrix(P)
+    R = sparse.csc_matrix(R)
+
     df = pd.DataFrame(
         {
             "pos": range(P.shape[0]),
-            "pos_" + level: np.squeeze(np.asarray(np.argmax(P, 1))),
-            "precision_" + level: np.squeeze(np.asarray(np.max(P, 1))),
+            "pos_" + level: np.asarray(P.argmax(axis=1)).ravel(),
+            "precision_" + level: P.max(axis=1).toarray().ravel(),
         }
     )
 
@@ -37,8 +42,8 @@ def cluster_taxonomy(clusters, taxonomy, level, P, R):
 
     df = dict()
     df["pos"] = range(R.shape[1])
-    df["recall"] = np.squeeze(np.asarray(np.max(R, 0)))
-    df["pos_cluster"] = np.squeeze(np.asarray(np.argmax(R, 0)))
+    df["recall"] = R.max(axis=0).toarray().ravel()
+    df["pos_cluster"] = np.asarray(R.argmax(axis=0)).ravel()
     df = pd.DataFrame(df)
 
     # If the max of recall is null, do not associate.
@@ -49,7 +54,7 @@ def cluster_taxonomy(clusters, taxonomy, level, P, R):
     return clusters, taxonomy
 
 
-def contig_cluster(contigs: pd.DataFrame, B: np.matrix):
+def contig_cluster(contigs: pd.DataFrame, B):
     """
     Associate each contig with its maximal-membership cluster.
     If the maximal-membership is null, the mbship cluster position
@@ -63,12 +68,16 @@ def contig_cluster(contigs: pd.DataFrame, B: np.matrix):
     Returns:
         dataframe: contigs with pos_cluster_mbship column added.
     """
+    B = sparse.csr_matrix(B)
+    # argmax returns the first maximum in the order of the columns
+    B.sum_duplicates()
+    B.sort_indices()
 
     cm = pd.DataFrame(
         {
             "pos": range(B.shape[0]),
-            "membership": np.squeeze(np.asarray(np.max(B, 1))),
-            "pos_cluster_mbship": np.squeeze(np.asarray(np.argmax(B, 1))),
+            "membership": B.max(axis=1).toarray().ravel(),
+            "pos_cluster_mbship": np.asarray(B.argmax(axis=1)).ravel(),
         }
     )
     cm.loc[cm["membership"] == 0, "pos_cluster_mbship"] = np.nan
@@ -95,12 +104,9 @@ def contig_taxonomy(
         dataframe: contigs with "predicted_level" column added.
     """
     cname = "predicted_{}".format(level)
-    taxonomy = taxonomy.set_index("pos")
-    clusters = clusters.set_index("pos")
-    for n, clust_pos in enumerate(contigs[cluster_choice]):
-        if not pd.isnull(clust_pos):
-            tax_pos = clusters.loc[clust_pos, "pos_{}".format(level)]
-            if not np.isnan(tax_pos):
-                contigs.loc[n, cname] = taxonomy.name[tax_pos]
-    contigs.fillna({cname: "Non affiliated"}, inplace=True)
+    # cluster pos -> taxonomic class pos -> class name
+    class_of_cluster = clusters.set_index("pos")["pos_{}".format(level)]
+    names = taxonomy.set_index("pos")["name"]
+    predicted = contigs[cluster_choice].map(class_of_cluster).map(names)
+    contigs[cname] = predicted.fillna("Non affiliated").to_numpy(dtype=object)
     return contigs
@@ -1,6 +1,7 @@
 """Cluster Refinements : Refining contig clusters for optimal assignments"""
 
 import logging
+import multiprocessing as mp
 
 import numpy as np
 import pandas as pd
@@ -32,6 +33,123 @@ summary_headers = [
 ]
 
 
+def prevc_profiles(contigs: pd.DataFrame, profiles_df: pd.DataFrame):
+    """
+    PC profiles of the contigs of each preVC, as integer codes.
+
+    Args:
+        contigs (pd.DataFrame): contig_id and pos_cluster (the preVC).
+        profiles_df (pd.DataFrame): contig_id (with spaces instead of "~")
+            and pc_id.
+
+    Yields:
+        tuple: preVC, row positions of its contigs in contigs, and the
+            (row position of the contig, PC code) entries of its profiles,
+            sorted by contig id (the order of the rows of a crosstab).
+    """
+    keys = contigs["contig_id"].str.replace("~", " ", regex=False).values
+    prevc_codes, prevc_names = pd.factorize(contigs["pos_cluster"], sort=True)
+    rank = np.empty(len(keys), dtype=np.int64)
+    rank[np.argsort(keys, kind="stable")] = np.arange(len(keys))
+
+    profiles_df = profiles_df.loc[profiles_df["contig_id"].isin(keys)]
+    entry_rows = pd.Series(np.arange(len(keys)), index=keys)[profiles_df["contig_id"]].values
+    entry_pcs = pd.factorize(profiles_df["pc_id"])[0]
+    entry_prevcs = prevc_codes[entry_rows]
+
+    # Entries grouped by preVC (contigs in no preVC first, skipped), then
+    # sorted by contig id.
+    order = np.lexsort((rank[entry_rows], entry_prevcs))
+    entry_rows, entry_pcs = entry_rows[order], entry_pcs[order]
+    entry_bounds = np.searchsorted(
+        entry_prevcs[order], np.arange(len(prevc_names) + 1)
+    )
+
+    rows = np.argsort(prevc_codes, kind="stable")
+    row_bounds = np.searchsorted(prevc_codes[rows], np.arange(len(prevc_names) + 1))
+
+    for i, contig_cluster in enumerate(prevc_names):
+        entries = slice(entry_bounds[i], entry_bounds[i + 1])
+        yield (
+            contig_cluster,
+            rows[row_bounds[i]:row_bounds[i + 1]],
+            entry_rows[entries],
+            entry_pcs[entries],
+        )
+
+
+def _refine_worker(task):
+    """Multiprocessing helper function: subclusters of a preVC, from the
+    codes of its profiles."""
+    contig_cluster, entry_rows, entry_pcs, dists = task
+    # Contigs x PCs counts (the crosstab of the profiles)
+    new_row = np.r_[True, entry_rows[1:] != entry_rows[:-1]]
+    rows = entry_rows[new_row]
+    columns, entry_columns = np.unique(entry_pcs, return_inverse=True)
+    values = np.zeros((len(rows), len(columns)), dtype=np.int64)
+    np.add.at(values, (np.cumsum(new_row) - 1, entry_columns), 1)
+
+    row_linkage = linkage(distance.pdist(values), method="average")
+    labels = np.empty((len(dists), len(rows)), dtype=np.int64)
+    for i, dist in enumerate(dists):
+        fclusters = sclust.hierarchy.fcluster(row_linkage, dist, criterion="distance")
+        labels[i] = np.unique(fclusters.astype(str), return_inverse=True)[1]
+    return contig_cluster, rows, labels
+
+
+def refine_prevcs(contigs: pd.DataFrame, profiles_df: pd.DataFrame, dists, threads=1):
+    """
+    Split each preVC into subclusters, for each distance.
+
+    The profiles of each preVC are sent to the workers as codes, the
+    workers build the profile matrices and the linkages.
+
+    Args:
+        contigs (pd.DataFrame): contig_id and pos_cluster (the preVC).
+        profiles_df (pd.DataFrame): contig_id and pc_id.
+        dists (list): distances at which the linkages are cut.
+        threads (int): number of processes.
+
+    Returns:
+        tuple: row positions of the contigs in contigs, their preVC and
+            their subclusters (one row by distance). In a preVC that is
+            split, the contigs without profile are not in any subcluster.
+    """
+    positions, prevcs, labels = [], [], []
+
+    def add(contig_cluster, rows, subclusters):
+        positions.append(rows)
+        prevcs.append(np.full(len(rows), contig_cluster))
+        labels.append(subclusters)
+
+    tasks = []
+    for contig_cluster, rows, entry_rows, entry_pcs in prevc_profiles(
+        contigs, profiles_df
+    ):
+        # The entries are sorted by contig: less than two profiled contigs
+        # if the first and last entries are of the same contig.
+        if len(entry_rows) == 0 or entry_rows[0] == entry_rows[-1]:
+            # These are VCs whose OTHER MEMBERS are overlapping, meaning they're the ONLY remaining
+            # and you can't calculate a pdist with only 1 member
+            add(contig_cluster, rows, np.zeros((len(dists), len(rows)), dtype=np.int64))
+        else:
+            tasks.append((contig_cluster, entry_rows, entry_pcs, dists))
+    logger.debug("Splitting {} preVCs".format(len(tasks)))
+
+    if threads > 1 and len(tasks) > 1:
+        chunksize = max(1, len(tasks) // (threads * 4))
+        with mp.Pool(processes=threads) as pool:
+            for result in pool.imap_unordered(_refine_worker, tasks, chunksize):
+                add(*result)
+    else:
+        for task in tasks:
+            add(*_refine_worker(task))
+
+    if not positions:
+        return np.array([], dtype=np.int64), np.array([]), np.zeros((len(dists), 0))
+    return np.concatenate(positions), np.concatenate(prevcs), np.hstack(labels)
+
+
 class ViralClusters(object):
     """
     Collects series of functions related to analyzing the network.
@@ -41,10 +159,15 @@ class ViralClusters(object):
     """
 
     def __init__(
-        self, contigs: pd.DataFrame, profiles_df: pd.DataFrame, optimize=False
+        self,
+        contigs: pd.DataFrame,
+        profiles_df: pd.DataFrame,
+        optimize=False,
+        threads=1,
     ):
         """
         :param contigs: (dataframe)
+        :param threads: (int) number of processes splitting the preVCs
         """
         self.name = "ViralClusters"
 
@@ -74,70 +197,20 @@ class ViralClusters(object):
         else:
             # By defining dists here, don't need to repeat performance metrics after the loop
             dists = [9]
-        for dist in dists:
+        # The linkage of each preVC does not depend on the distance: it is
+        # built once and cut at every distance.
+        positions, prevcs, labels = refine_prevcs(
+            contigs, profiles_df, dists, threads=threads
+        )
+        prefixes = pd.Series(prevcs, dtype=object).astype(str) + "_"
+
+        for i, dist in enumerate(dists):
             logger.info("Optimizing on distance: {}".format(dist))
 
             adj_contigs = contigs.copy()
-
-            for contig_cluster, contig_cluster_group in adj_contigs.groupby(
-                by="pos_cluster"
-            ):
-                vc_pc_df = profiles_df.loc[
-                    profiles_df["contig_id"].isin(
-                        [
-                            contig.replace("~", " ")
-                            for contig in contig_cluster_group["contig_id"]
-                        ]
-                    )
-                ].copy()
-
-                crosstab = pd.crosstab(vc_pc_df["contig_id"], vc_pc_df["pc_id"])
-
-                # Need to set up appropriate clusters
-                for n, label in enumerate(crosstab.index.tolist()):
-                    vc_pc_df.loc[vc_pc_df["contig_id"] == label, "unique_id"] = str(n)
-
-                try:
-                    row_linkage = linkage(
-                        distance.pdist(crosstab.values), method="average"
-                    )
-                except ValueError:
-                    # These are VCs whose OTHER MEMBERS are overlapping, meaning they're the ONLY remaining
-                    # and you can't calculate a pdist with only 1 member
-                    adj_contigs.loc[
-                        contigs["pos_cluster"] == contig_cluster, "rev_pos_cluster"
-                    ] = "{}_0".format(contig_cluster)
-                    continue
-
-                # Get clusters
-                for n, fcluster in enumerate(
-                    sclust.hierarchy.fcluster(row_linkage, dist, criterion="distance")
-                ):
-                    vc_pc_df.loc[vc_pc_df["unique_id"] == str(n), "fcluster"] = str(
-                        fcluster
-                    )
-
-                # Previously got number of subclusters prior, then assigned them,
-                # but if starting from 0 everytime, there's no point
-                for n, (fcluster, fcluster_df) in enumerate(
-                    vc_pc_df.groupby(by="fcluster")
-                ):
-                    vc_pc_df.loc[
-                        fcluster_df.index, "rev_pos_cluster"
-                    ] = f"{contig_cluster}_{n}"
-
-                    contigs_items = [
-                        item.replace(" ", "~")
-                        for item in fcluster_df["contig_id"].unique().tolist()
-                    ]
-                    adj_contigs.loc[
-                        adj_contigs["contig_id"].isin(contigs_items), "rev_pos_cluster"
-                    ] = f"{contig_cluster}_{n}"
-
-                    # No need to get subdistance, as it's already < threshold
-                    # subtab = pd.crosstab(fcluster_df['contig_id'], fcluster_df['pc_id'])
-                    # subdist = distance.pdist(subtab.values, metric='euclidean')
-                    # subdist_avg = subdist.mean()
+            rev_pos_cluster = np.full(len(adj_contigs), np.nan, dtype=object)
+            rev_pos_cluster[positions] = (prefixes + labels[i].astype(str)).values
+            adj_contigs["rev_pos_cluster"] = rev_pos_cluster
 
             self.results[dist] = adj_contigs
 
@@ -176,9 +249,11 @@ class ViralClusters(object):
             best_index = self.best_df["Distance"].tolist()
             logger.info(
                 "Identified the best composite scores among two distances, "
-                "selecting the larger distance: {}".format(",".join(best_index))
+                "selecting the larger distance: {}".format(
+                    ",".join([str(i) for i in best_index])
+                )
             )
-            self.dist = self.best_df.iloc[best_index[-1]]["Distance"]
+            self.dist = best_index[-1]
         elif len(self.best_df) > 2:
             best_index = self.best_df["Distance"].tolist()
             logger.warning(
@@ -188,7 +263,7 @@ class ViralClusters(object):
                     ",".join([str(i) for i in best_index])
                 )
             )
-            self.dist = self.best_df.iloc[best_index[-1]]["Distance"]
+            self.dist = best_index[-1]
 
         logger.info("Merging optimal distance determined from performance evaluations.")
 
@@ -0,0 +1,441 @@
+""" ClusterONE: overlapping clustering of weighted networks.
+
+Native implementation of ClusterONE (Nepusz, Yu & Paccanaro, 2012), working
+on the scipy.sparse networks held in memory instead of exporting them to the
+java tool. Clusters are grown greedily from seeds to maximize their
+cohesiveness:
+
+    f(V) = w_in(V) / (w_in(V) + w_bound(V) + p|V|)
+
+    w_in: total weight of the edges inside V.
+    w_bound: total weight of the edges between V and the rest of the network.
+    p: penalty of each node, modelling its uncharted connections.
+
+The clusters are then trimmed (haircut), the highly overlapping ones merged,
+and the too small or too sparse ones dropped. The results are written in the
+csv format of the java tool.
+"""
+import logging
+import multiprocessing as mp
+
+import networkx
+import numpy as np
+import pandas as pd
+import scipy.sparse as sparse
+import scipy.stats as stats
+
+from .pcprofiles import SharedArrays, attach_arrays
+
+logger = logging.getLogger(__name__)
+
+SEED_METHODS = ("nodes", "unused_nodes", "edges", "cliques")
+MERGE_METHODS = ("single", "multi")
+SIMILARITIES = ("match", "simpson", "jaccard", "dice")
+
+# Number of seeds grown by a task of the process pool
+SEEDS_BY_TASK = 200
+
+
+class Network(object):
+    """Read-only view of a symmetric network for the cluster growth.
+
+    Attributes:
+        indptr, indices, data (numpy.ndarray): CSR arrays of the network.
+        strength (numpy.ndarray): Total weight of the edges of each node.
+    """
+
+    def __init__(self, indptr, indices, data):
+        self.indptr = indptr
+        self.indices = indices
+        self.data = data
+        n = len(indptr) - 1
+        self.strength = np.bincount(
+            np.repeat(np.arange(n), np.diff(indptr)), weights=data, minlength=n
+        )
+
+    def neighbors(self, node):
+        start, end = self.indptr[node], self.indptr[node + 1]
+        return self.indices[start:end], self.data[start:end]
+
+
+class Cluster(object):
+    """A set of nodes with the running sums needed by the growth.
+
+    Attributes:
+        nodes (set): Members.
+        connection (dict): node -> weight of its edges to the members, for
+            the members and the boundary nodes.
+        w_in (float): Total weight of the internal edges.
+        w_bound (float): Total weight of the boundary edges.
+    """
+
+    def __init__(self, network: Network, penalty):
+        self.network = network
+        self.penalty = penalty
+        self.nodes: set = set()
+        self.connection: dict = {}
+        self.w_in = 0.0
+        self.w_bound = 0.0
+
+    def cohesiveness(self, w_in=None, w_bound=None, size=None):
+        w_in = self.w_in if w_in is None else w_in
+        w_bound = self.w_bound if w_bound is None else w_bound
+        size = len(self.nodes) if size is None else size
+        denominator = w_in + w_bound + self.penalty * size
+        return w_in / denominator if denominator > 0 else 0.0
+
+    def add(self, node):
+        inside = self.connection.get(node, 0.0)
+        self.w_in += inside
+        self.w_bound += self.network.strength[node] - 2 * inside
+        self.nodes.add(node)
+        for neighbor, weight in zip(*self.network.neighbors(node)):
+            self.connection[neighbor] = self.connection.get(neighbor, 0.0) + weight
+
+    def remove(self, node):
+        inside = self.connection.get(node, 0.0)
+        self.w_in -= inside
+        self.w_bound -= self.network.strength[node] - 2 * inside
+        self.nodes.discard(node)
+        for neighbor, weight in zip(*self.network.neighbors(node)):
+            left = self.connection[neighbor] - weight
+            if left > 1e-12 or neighbor in self.nodes:
+                self.connection[neighbor] = left
+            else:
+                del self.connection[neighbor]
+
+    def best_move(self):
+        """Best addition or removal of a node.
+
+        Returns:
+            tuple: (cohesiveness after the move, node, True if addition).
+        """
+        if not self.connection:
+            return self.cohesiveness(), None, True
+
+        candidates = np.fromiter(self.connection.keys(), dtype=np.int64)
+        inside = np.fromiter(self.connection.values(), dtype=float)
+        strength = self.network.strength[candidates]
+        member = np.fromiter((x in self.nodes for x in candidates.tolist()), dtype=bool)
+        size = len(self.nodes)
+
+        # Adding a boundary node, or removing a member (keeping at least one)
+        sign = np.where(member, -1.0, 1.0)
+        w_in = self.w_in + sign * inside
+        w_bound = self.w_bound + sign * (strength - 2 * inside)
+        denominator = w_in + w_bound + self.penalty * (size + sign)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            quality = np.where(denominator > 0, w_in / denominator, 0.0)
+        if size <= 1:
+            quality[member] = -np.inf
+
+        best = int(np.argmax(quality))
+        return quality[best], int(candidates[best]), not member[best]
+
+
+def grow(network: Network, seed, penalty, haircut, max_steps=None):
+    """Greedy growth of a cluster from seed nodes, then haircut.
+
+    Args:
+        network (Network): The network.
+        seed (iterable): Seed nodes.
+        penalty (float): Penalty of each node.
+        haircut (float): Members whose internal weight is below haircut
+            times the average internal weight of the members are removed.
+        max_steps (int): Maximal number of moves (number of nodes if None).
+
+    Returns:
+        Cluster: the grown cluster.
+    """
+    cluster = Cluster(network, penalty)
+    for node in seed:
+        cluster.add(node)
+
+    max_steps = len(network.strength) if max_steps is None else max_steps
+    quality = cluster.cohesiveness()
+    for _ in range(max_steps):
+        new_quality, node, addition = cluster.best_move()
+        if node is None or new_quality <= quality + 1e-12:
+            break
+        if addition:
+            cluster.add(node)
+        else:
+            cluster.remove(node)
+        quality = new_quality
+
+    if haircut > 0:
+        while len(cluster.nodes) > 1:
+            members = np.fromiter(cluster.nodes, dtype=np.int64)
+            inside = np.array([cluster.connection.get(x, 0.0) for x in members.tolist()])
+            dangling = members[inside < haircut * inside.mean()]
+            if not len(dangling):
+                break
+            for node in dangling.tolist():
+                cluster.remove(node)
+
+    return cluster
+
+
+def seeds(network: Network, method, matrix=None):
+    """Seeds of the growth.
+
+    Args:
+        network (Network): The network.
+        method (str): "nodes" (each node), "edges" (each edge) or "cliques"
+            (each maximal clique). "unused_nodes" is handled by cluster_one.
+        matrix (scipy.sparse): The network, for the cliques.
+
+    Returns:
+        list: the seeds, tuples of nodes.
+    """
+    nodes = np.flatnonzero(network.strength > 0)
+    # Heaviest nodes first
+    nodes = nodes[np.argsort(-network.strength[nodes], kind="stable")]
+    if method == "nodes":
+        return [(x,) for x in nodes.tolist()]
+    if method == "edges":
+        upper = sparse.triu(matrix, k=1).tocoo()
+        return list(zip(upper.row.tolist(), upper.col.tolist()))
+    if method == "cliques":
+        graph = networkx.from_scipy_sparse_array(sparse.csr_matrix(matrix))
+        return [tuple(x) for x in networkx.find_cliques(graph)]
+    raise ValueError(
+        "Unknown seed method {} (expected one of {})".format(method, ", ".join(SEED_METHODS))
+    )
+
+
+def overlap_score(intersection, a, b, method="match"):
+    """Overlap score of clusters of sizes a and b sharing intersection nodes."""
+    if method == "match":
+        return intersection**2 / (a * b)
+    if method == "simpson":
+        return intersection / np.minimum(a, b)
+    if method == "jaccard":
+        return intersection / (a + b - intersection)
+    if method == "dice":
+        return 2 * intersection / (a + b)
+    raise ValueError(
+        "Unknown similarity {} (expected one of {})".format(method, ", ".join(SIMILARITIES))
+    )
+
+
+def merge(clusters, n, max_overlap, method="single", sim="match"):
+    """Merge the clusters overlapping more than max_overlap.
+
+    With "single", the groups of clusters connected by an overlap are merged
+    at once; with "multi" this is repeated until no overlap is left.
+
+    Args:
+        clusters (list): Clusters (arrays of nodes).
+        n (int): Number of nodes of the network.
+        max_overlap (float): Maximal similarity of two clusters.
+        method (str): "single" or "multi".
+        sim (str): Similarity function, see overlap_score.
+
+    Returns:
+        list: merged clusters (sorted arrays of nodes).
+    """
+    if method not in MERGE_METHODS:
+        raise ValueError(
+            "Unknown merge method {} (expected one of {})".format(
+                method, ", ".join(MERGE_METHODS)
+            )
+        )
+
+    while len(clusters) > 1:
+        sizes = np.array([len(x) for x in clusters], dtype=float)
+        indicator = sparse.csr_matrix(
+            (
+                np.ones(int(sizes.sum())),
+                np.concatenate(clusters),
+                np.concatenate([[0], np.cumsum(sizes).astype(np.int64)]),
+            ),
+            shape=(len(clusters), n),
+        )
+        shared = sparse.triu(indicator.dot(indicator.T), k=1).tocoo()
+        score = overlap_score(shared.data, sizes[shared.row], sizes[shared.col], sim)
+        overlapping = score > max_overlap
+        if not overlapping.any():
+            break
+
+        groups = sparse.coo_matrix(
+            (np.ones(overlapping.sum()), (shared.row[overlapping], shared.col[overlapping])),
+            shape=(len(clusters), len(clusters)),
+        )
+        n_groups, labels = sparse.csgraph.connected_components(groups, directed=False)
+        merged = [[] for _ in range(n_groups)]
+        for cluster, label in zip(clusters, labels.tolist()):
+            merged[label].append(cluster)
+        clusters = [np.unique(np.concatenate(x)) for x in merged]
+        logger.debug("{} overlapping pairs merged".format(overlapping.sum()))
+
+        if method == "single":
+            break
+
+    return clusters
+
+
+def describe(matrix, clusters, penalty):
+    """Statistics of each cluster, as reported by the java tool.
+
+    Returns:
+        pandas.DataFrame: Size, Density, Internal weight, External weight,
+            Quality and P-value of each cluster.
+    """
+    strength = np.asarray(matrix.sum(axis=1)).ravel()
+    rows = []
+    for cluster in clusters:
+        inside = np.asarray(matrix[cluster][:, cluster].sum(axis=1)).ravel()
+        outside = strength[cluster] - inside
+        w_in = inside.sum() / 2
+        w_bound = outside.sum()
+        size = len(cluster)
+        denominator = w_in + w_bound + penalty * size
+        if outside.any():
+            pvalue = stats.mannwhitneyu(inside, outside, alternative="greater").pvalue
+        else:
+            pvalue = 0.0
+        rows.append(
+            (
+                size,
+                w_in / (size * (size - 1) / 2) if size > 1 else 0.0,
+                w_in,
+                w_bound,
+                w_in / denominator if denominator > 0 else 0.0,
+                pvalue,
+            )
+        )
+    return pd.DataFrame(
+        rows,
+        columns=["Size", "Density", "Internal weight", "External weight", "Quality", "P-value"],
+    )
+
+
+# State of a worker of cluster_one, set once by _init_worker.
+_worker: dict = {}
+
+
+def _init_worker(specs, penalty, haircut):
+    arrays, blocks = attach_arrays(specs)
+    _worker["blocks"] = blocks
+    _worker["network"] = Network(arrays["indptr"], arrays["indices"], arrays["data"])
+    _worker["params"] = (penalty, haircut)
+
+
+def _grow_worker(seeds):
+    """Multiprocessing helper function: grow a chunk of seeds."""
+    network = _worker["network"]
+    return [
+        tuple(sorted(grow(network, seed, *_worker["params"]).nodes)) for seed in seeds
+    ]
+
+
+def cluster_one(
+    matrix,
+    min_density=0.3,
+    min_size=3,
+    max_overlap=0.8,
+    penalty=2.0,
+    haircut=0.0,
+    merge_method="single",
+    similarity="match",
+    seed_method="nodes",
+    threads=1,
+):
+    """
+    Overlapping clusters of a weighted network.
+
+    Args:
+        matrix (scipy.sparse): Symmetric network, weights > 0.
+        min_density (float): Minimal density of the clusters.
+        min_size (int): Minimal size of the clusters.
+        max_overlap (float): Maximal overlap between two clusters.
+        penalty (float): Penalty of each node.
+        haircut (float): Haircut threshold, 0 to disable.
+        merge_method (str): "single" or "multi".
+        similarity (str): "match", "simpson", "jaccard" or "dice".
+        seed_method (str): "nodes", "unused_nodes", "edges" or "cliques".
+        threads (int): Number of processes growing the seeds.
+
+    Returns:
+        tuple: clusters (list of arrays of nodes, by decreasing size) and
+            their statistics (pandas.DataFrame, see describe).
+    """
+    matrix = sparse.csr_matrix(matrix, dtype=np.float64)
+    matrix.setdiag(0)
+    matrix.eliminate_zeros()
+    matrix.sort_indices()
+    network = Network(matrix.indptr, matrix.indices, matrix.data)
+    n = matrix.shape[0]
+
+    grown = set()
+    if seed_method == "unused_nodes":
+        # Each seed depends on the previous clusters: grown in sequence.
+        used = np.zeros(n, dtype=bool)
+        for (seed,) in seeds(network, "nodes"):
+            if used[seed]:
+                continue
+            cluster = grow(network, (seed,), penalty, haircut)
+            grown.add(tuple(sorted(cluster.nodes)))
+            used[list(cluster.nodes)] = True
+            used[seed] = True
+    else:
+        todo = seeds(network, seed_method, matrix)
+        logger.debug("Growing {} clusters from {}".format(len(todo), seed_method))
+        if threads > 1 and len(todo) > SEEDS_BY_TASK:
+            arrays = SharedArrays(
+                indptr=matrix.indptr, indices=matrix.indices, data=matrix.data
+            )
+            chunks = [todo[x : x + SEEDS_BY_TASK] for x in range(0, len(todo), SEEDS_BY_TASK)]
+            try:
+                with mp.Pool(
+                    processes=threads,
+                    initializer=_init_worker,
+                    initargs=(arrays.specs, penalty, haircut),
+                ) as pool:
+                    for chunk in pool.imap_unordered(_grow_worker, chunks):
+                        grown.update(chunk)
+            finally:
+                arrays.close()
+        else:
+            for seed in todo:
+                grown.add(tuple(sorted(grow(network, seed, penalty, haircut).nodes)))
+
+    clusters = [np.array(x, dtype=np.int64) for x in sorted(grown) if len(x) >= min_size]
+    logger.debug("{} distinct clusters of at least {} nodes".format(len(clusters), min_size))
+
+    clusters = merge(clusters, n, max_overlap, merge_method, similarity)
+
+    stats_df = describe(matrix, clusters, penalty)
+    keep = ((stats_df["Size"] >= min_size) & (stats_df["Density"] >= min_density)).values
+    clusters = [x for x, k in zip(clusters, keep) if k]
+    stats_df = stats_df[keep]
+
+    clusters, stats_df = sort_clusters(clusters, stats_df)
+    logger.info("ClusterONE found {} clusters".format(len(clusters)))
+    return clusters, stats_df
+
+
+def sort_clusters(clusters, stats_df):
+    """Order clusters and their statistics (see describe) as the java tool:
+    largest and most cohesive clusters first."""
+    order = np.lexsort((-stats_df["Quality"].values, -stats_df["Size"].values))
+    clusters = [clusters[x] for x in order]
+    return clusters, stats_df.iloc[order].reset_index(drop=True)
+
+
+def to_csv(clusters, stats_df, names, fi):
+    """Write clusters in the csv format of the java ClusterONE.
+
+    Args:
+        clusters (list): Clusters (arrays of nodes).
+        stats_df (pandas.DataFrame): Their statistics, see describe.
+        names (pandas.Series): name of the nodes, indexed by their position
+            in the network.
+        fi (str): filename.
+    """
+    names = names.reindex(np.arange(names.index.max() + 1)).to_numpy(dtype=object)
+    df = stats_df.copy()
+    df.insert(0, "Cluster", np.arange(1, len(df) + 1))
+    df["Members"] = [" ".join(names.take(x)) for x in clusters]
+    df.to_csv(fi, index=False)
@@ -0,0 +1,186 @@
+""" Clustering of the similarity networks by connected component.
+
+The contig similarity network is mostly made of disconnected components, and
+neither MCL nor ClusterONE ever groups nodes of two components: each
+component is clustered on its own, in a process pool. The wall time then
+scales with the largest component rather than with the whole network, and a
+failed component is retried without redoing the others. The isolated nodes
+and the pairs are not clustered at all.
+"""
+import logging
+import multiprocessing as mp
+
+import numpy as np
+import pandas as pd
+import scipy.sparse as sparse
+from scipy.sparse import csgraph
+
+from . import clusterone
+from . import mcl
+
+logger = logging.getLogger(__name__)
+
+METHODS = ("MCL", "ClusterONE")
+
+# Smallest component that is actually clustered
+MIN_CLUSTERED = 3
+# Number of times a failed component is clustered again
+RETRIES = 2
+
+
+def components(matrix):
+    """Connected components of a symmetric network.
+
+    Args:
+        matrix (scipy.sparse): Symmetric network.
+
+    Returns:
+        list: Nodes (numpy.ndarray) of each component, by decreasing size.
+    """
+    nb_components, labels = csgraph.connected_components(matrix, directed=False)
+    sizes = np.bincount(labels, minlength=nb_components)
+    nodes = np.split(np.argsort(labels, kind="stable"), np.cumsum(sizes)[:-1])
+    return [nodes[x] for x in np.argsort(-sizes, kind="stable")]
+
+
+def pass_through(matrix, nodes, method, params):
+    """Clusters of a component too small to be clustered.
+
+    An isolated node is never a cluster (mcl --abc does not see it and
+    ClusterONE drops it). A pair is a cluster for MCL, and for ClusterONE if
+    it passes the size and density filters, the density of a pair being the
+    weight of its edge.
+
+    Returns:
+        list: Clusters (numpy.ndarray of nodes).
+    """
+    if len(nodes) < 2:
+        return []
+    if method == "ClusterONE":
+        # Defaults of clusterone.cluster_one
+        if params.get("min_size", 3) > 2:
+            return []
+        if matrix[nodes[0], nodes[1]] < params.get("min_density", 0.3):
+            return []
+    return [np.sort(nodes)]
+
+
+def cluster_component(matrix, method, params, threads=1):
+    """Cluster one connected component.
+
+    Args:
+        matrix (scipy.sparse): Symmetric network of the component.
+        method (str): "MCL" or "ClusterONE".
+        params (dict): MCL: inflation and backend (see mcl.cluster).
+            ClusterONE: keyword arguments of clusterone.cluster_one.
+        threads (int): Number of threads/processes of the clustering.
+
+    Returns:
+        list: Clusters (numpy.ndarray of positions in the matrix).
+    """
+    if method == "MCL":
+        names = pd.Series(np.arange(matrix.shape[0]).astype(str))
+        clusters = mcl.cluster(
+            matrix,
+            names,
+            params["inflation"],
+            backend=params.get("backend", "mcl"),
+            threads=threads,
+        )
+        return [np.array(x, dtype=np.int64) for x in clusters]
+    if method == "ClusterONE":
+        return clusterone.cluster_one(matrix, threads=threads, **params)[0]
+    raise ValueError(
+        "Unknown clustering method {} (expected one of {})".format(method, ", ".join(METHODS))
+    )
+
+
+def _cluster_worker(task):
+    """Multiprocessing helper function: cluster a component, the error being
+    returned so that the component can be retried by the parent."""
+    index, matrix, method, params, threads = task
+    try:
+        return index, cluster_component(matrix, method, params, threads), None
+    except Exception as e:
+        return index, None, "{}: {}".format(type(e).__name__, e)
+
+
+def cluster_components(matrix, method, params, threads=1, retries=RETRIES):
+    """Cluster each connected component of a network independently.
+
+    Args:
+        matrix (scipy.sparse): Symmetric network.
+        method (str): "MCL" or "ClusterONE".
+        params (dict): See cluster_component.
+        threads (int): Number of processes.
+        retries (int): Number of times a failed component is clustered again.
+
+    Returns:
+        list: Clusters (numpy.ndarray of positions in the matrix), by
+            decreasing size.
+
+    Raises:
+        RuntimeError: If a component still fails after the retries.
+    """
+    matrix = sparse.csr_matrix(matrix)
+    matrix.eliminate_zeros()
+    parts = components(matrix)
+
+    results = {}
+    todo = []
+    for index, nodes in enumerate(parts):
+        if len(nodes) < MIN_CLUSTERED:
+            results[index] = pass_through(matrix, nodes, method, params)
+        else:
+            todo.append(index)
+    logger.info(
+        "{} connected components, {} clustered with {} (largest: {} nodes)".format(
+            len(parts), len(todo), method, len(parts[0]) if parts else 0
+        )
+    )
+
+    threads = max(1, threads)
+    for attempt in range(retries + 1):
+        if not todo:
+            break
+        if attempt:
+            logger.warning(
+                "Clustering again {} failed components (attempt {} of {})".format(
+                    len(todo), attempt + 1, retries + 1
+                )
+            )
+        # Largest components first, for a better balance of the pool
+        tasks = [
+            (index, matrix[parts[index]][:, parts[index]], method, params, 1)
+            for index in todo
+        ]
+        if threads == 1 or len(tasks) == 1:
+            # A single component gets all the threads.
+            done = [_cluster_worker(task[:-1] + (threads,)) for task in tasks]
+        else:
+            with mp.Pool(processes=min(threads, len(tasks))) as pool:
+                done = list(pool.imap_unordered(_cluster_worker, tasks))
+
+        failed = []
+        for index, clusters, error in done:
+            if error is None:
+                # Back to the positions in the network
+                results[index] = [parts[index][x] for x in clusters]
+            else:
+                logger.warning(
+                    "Component {} ({} nodes) failed: {}".format(
+                        index, len(parts[index]), error
+                    )
+                )
+                failed.append(index)
+        todo = sorted(failed)
+
+    if todo:
+        raise RuntimeError(
+            "{} components failed to be clustered with {}".format(len(todo), method)
+        )
+
+    clusters = [x for index in range(len(parts)) for x in results[index]]
+    # By decreasing size, the components coming in the same order
+    order = np.argsort([-len(x) for x in clusters], kind="stable")
+    return [clusters[x] for x in order]
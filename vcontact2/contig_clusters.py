@@ -2,6 +2,7 @@
 make the affiliations"""
 
 import os
+import multiprocessing as mp
 import subprocess
 import _pickle as pickle
 import logging
@@ -17,6 +18,10 @@ from . import pcprofiles
 from . import matrices
 from . import ml_functions
 from . import associations
+from . import clusterone
+from . import components
+from . import mcl
+from . import tools
 
 logger = logging.getLogger(__name__)
 
@@ -32,6 +37,7 @@ class ContigCluster(object):
             taxonomy: (pandas df) Taxonomic class
             clusters: (pandas df) Contig clusters
             mcl_results: (list of list) mcl_result[cluster][prot]
+            members: (sparse matrix) contigs x clusters indicator
     """
 
     def __init__(
@@ -46,6 +52,10 @@ class ContigCluster(object):
         membership_simple=False,
         mode="MCL",
         threads=0,
+        save_network=False,
+        mcl_backend="mcl",
+        cluster_one_backend="java",
+        by_component=None,
     ):
         """
         Init the object with a pc-profile object and perform the clustering
@@ -58,6 +68,18 @@ class ContigCluster(object):
             threshold (float): minimal significativity.
             name (str): A name to identify the object.
             membership_simple (bool): if false use non boolean membership.
+            threads (int): number of threads/processes of the clustering,
+                also the default of the affiliation evaluations.
+            save_network (bool): save the network streamed to MCL.
+            mcl_backend (str): "mcl" (external binary) or "native".
+            cluster_one_backend (str): "java" (cluster_one_fp) or "native".
+                The native backend is not offered by the command line until
+                its clusters are checked against the java tool, see
+                tests/test_clusterone.py.
+            by_component (bool): cluster each connected component of the
+                network independently (MCL and native ClusterONE). None:
+                only with the native backends, as the mcl binary would be
+                started once per component.
         """
         self.mode = mode
         if self.mode not in ["ClusterONE", "MCL"]:
@@ -75,7 +97,11 @@ class ContigCluster(object):
         self.folder = output_dir
         self.one_opts = one_args
         self.cluster_one = cluster_one_fp
-        self.df = None  # Keep copy of contig dataframe to identify singletons, outliers and overlaps later
+        self.by_component = by_component
+        self.threads = threads
+        # Sparse contigs x clusters indicator, the overlaps (ClusterONE) are
+        # identified from it later, see self.df
+        self.members = None
 
         if isinstance(pcp, pcprofiles.PCProfiles):
             self.pcs = pcp.pcs.copy()
@@ -86,7 +112,7 @@ class ContigCluster(object):
             self.pcs, self.contigs, self.network = (
                 pcp[0].copy(),
                 pcp[1].copy(),
-                pcp.network,
+                pcp[2],
             )
 
         if threshold is not None:
@@ -116,12 +142,21 @@ class ContigCluster(object):
         # Export to MCL, run MCL, return clusters
         if mode == "ClusterONE":
             self.clusters, self.cluster_results = self.one_cluster(
-                os.path.join(self.folder, self.name), self.cluster_one, self.one_opts
+                os.path.join(self.folder, self.name),
+                self.cluster_one,
+                self.one_opts,
+                threads=threads,
+                save_network=save_network,
+                backend=cluster_one_backend,
             )
 
         if mode == "MCL":
             self.clusters, self.cluster_results = self.mcl_cluster(
-                os.path.join(self.folder, self.name), self.inflation, threads=threads
+                os.path.join(self.folder, self.name),
+                self.inflation,
+                threads=threads,
+                save_network=save_network,
+                backend=mcl_backend,
             )
 
         self.matrix = {}
@@ -171,19 +206,23 @@ class ContigCluster(object):
 
         return tax
 
-    def mcl_cluster(self, basename, I, force=False, threads=0):
-        """Export the matrix, Run MCL and load the results
+    def mcl_cluster(
+        self, basename, I, force=False, threads=0, save_network=False, backend="mcl"
+    ):
+        """Cluster the matrix with MCL and load the results
 
         Args:
             basename: (str) Path for the exported files
             I: (float) inflation for mcl
             force: (bool) overwrite existing file
+            save_network: (bool) also save the network file
+            backend: (str) "mcl" (external binary) or "native", see mcl.cluster
 
         Returns:
             See self.load_clusters.
 
         Side-Effects:
-           Save basename.ntw the network file
+           Save basename.ntw the network file (if save_network)
            Save basename.clusters the clustering results
            self.contig: add "cluster" column
         """
@@ -191,35 +230,63 @@ class ContigCluster(object):
         fi_ntw = basename + ".ntw"
         fi_clusters = basename + ".clusters"
 
-        # Export for MCL
-        logger.info("Exporting for MCL")
-        if not os.path.exists(fi_ntw) or force:
-            self.to_clusterer(self.network, fi_ntw)
-        else:
-            logger.debug("Network file already exist.")
-
         # MCL
-        logger.info("Clustering the pc similarity-network")
-
-        if not os.path.exists(fi_clusters or force):
-            subprocess.call(
-                f"mcl {fi_ntw} -o {fi_clusters} --abc -I {I} -te {threads}",
-                shell=True,
+        by_component = self.by_component
+        if by_component is None:
+            by_component = backend == "native"
+        if (not os.path.exists(fi_clusters) or force) and by_component:
+            logger.info("Clustering the contig similarity-network by component")
+            if save_network:
+                self.to_clusterer(self.network, fi_ntw)
+            names = self.contigs.set_index("pos").contig_id
+            names = names.reindex(np.arange(self.network.shape[0])).to_numpy(dtype=object)
+            clusters = components.cluster_components(
+                self.network,
+                "MCL",
+                {"inflation": I, "backend": backend},
+                threads=threads,
+            )
+            clusters = [list(names[x]) for x in clusters]
+            mcl.write_clusters(clusters, fi_clusters)
+            logger.debug("MCL({}) results are saved in {}.".format(I, fi_clusters))
+        elif not os.path.exists(fi_clusters) or force:
+            logger.info("Clustering the contig similarity-network")
+            clusters = mcl.cluster(
+                self.network,
+                self.contigs.set_index("pos").contig_id,
+                I,
+                backend=backend,
+                threads=threads,
+                network_fp=fi_ntw if save_network else None,
+                clusters_fp=fi_clusters,
             )
             logger.debug("MCL({}) results are saved in {}.".format(I, fi_clusters))
         else:
             logger.debug(f"MCL({I}) file already exist.")
+            clusters = fi_clusters
 
         # Load clusters
-        return self.load_mcl_clusters(fi_clusters)
+        return self.load_mcl_clusters(clusters)
 
-    def one_cluster(self, basename, cluster_one, options, force=False):
+    def one_cluster(
+        self,
+        basename,
+        cluster_one,
+        options,
+        force=False,
+        threads=1,
+        save_network=True,
+        backend="java",
+    ):
         """Export the matrix, Run ClusterONE and load the results
 
         Args:
             basename: (str) Path for the exported files
-            options: (float) inflation for mcl
+            options: (dict) ClusterONE command line options
             force: (bool) overwrite existing file
+            threads: (int) number of processes (native backend)
+            save_network: (bool) save the network file (always done for java)
+            backend: (str) "java" (cluster_one) or "native", see clusterone
 
         Returns:
             See self.load_clusters.
@@ -234,16 +301,45 @@ class ContigCluster(object):
         fi_clusters = basename + ".clusters"
 
         # Export for ClusterONE
-        logger.info("Exporting for ClusterONE")
-        if not os.path.exists(fi_ntw) or force:
-            self.to_clusterer(self.network, fi_ntw)
-        else:
-            logger.debug("Network file already exist.")
+        if backend == "java" or save_network:
+            logger.info("Exporting for ClusterONE")
+            if not os.path.exists(fi_ntw) or force:
+                self.to_clusterer(self.network, fi_ntw)
+            else:
+                logger.debug("Network file already exist.")
 
         # ClusterONE
         logger.info("Clustering the PC Similarity-Network using ClusterONE")
 
-        if not os.path.exists(fi_clusters) or force:
+        if backend == "native" and (not os.path.exists(fi_clusters) or force):
+            logger.warning(
+                "The native ClusterONE backend is not validated against "
+                "cluster_one-1.0.jar yet, its clusters may differ."
+            )
+            # --min-size -> min_size, ...
+            kwargs = {
+                opt.lstrip("-").replace("-", "_"): val for opt, val in options.items()
+            }
+            if self.by_component is not False:
+                clusters = components.cluster_components(
+                    self.network, "ClusterONE", kwargs, threads=threads
+                )
+                stats_df = clusterone.describe(
+                    self.network, clusters, kwargs.get("penalty", 2.0)
+                )
+                clusters, stats_df = clusterone.sort_clusters(clusters, stats_df)
+            else:
+                clusters, stats_df = clusterone.cluster_one(
+                    self.network, threads=threads, **kwargs
+                )
+            clusterone.to_csv(
+                clusters, stats_df, self.contigs.set_index("pos").contig_id, fi_clusters
+            )
+            logger.debug(
+                "ClusterONE results are being saved to {}.".format(fi_clusters)
+            )
+
+        elif not os.path.exists(fi_clusters) or force:
             # Disable --fluff as it's not in published algorithm or used in published manuscript
             if "jar" in cluster_one:
                 cluster_one_cmd = "java -jar {} {} --input-format edge_list --output-format csv".format(
@@ -273,7 +369,7 @@ class ContigCluster(object):
         # Load clusters
         return self.load_one_clusters(fi_clusters)
 
-    def to_clusterer(self, matrix, fi, names=None):
+    def to_clusterer(self, matrix, fi, names=None, upper=False):
         """Save a network in a file ready for MCL and/or ClusterONE
 
         Args:
@@ -283,29 +379,67 @@ class ContigCluster(object):
                 "pos":  (int) is the position in the matrix.
                 "id": (str) column contain the id of the node.
                 If None, self.contigs is used.
+            upper (bool): Only write the upper triangle of the matrix.
 
         Returns:
             str: filename
         """
 
         names = self.contigs if names is None else names
-        names = names.set_index("pos").contig_id
-        with open(fi, "wt") as f:
-            matrix = sparse.dok_matrix(matrix)
-            for r, c in zip(*matrix.nonzero()):
-                f.write(" ".join([str(x) for x in (names[r], names[c], matrix[r, c])]))
-                f.write("\n")
-
-        logger.debug(
-            "Saving network in file {0} ({1} lines).".format(fi, matrix.getnnz())
-        )
+        tools.write_edges(fi, matrix, names.set_index("pos").contig_id, upper=upper)
         return fi
 
+    def cluster_indicator(self, clusters):
+        """Sparse membership of the contigs to the clusters.
+
+        Args:
+            clusters (list): Clusters (lists of contig ids).
+
+        Returns:
+            scipy.sparse.csr_matrix: contigs (pos) x clusters, True if the
+                contig is in the cluster.
+        """
+        return matrices.cluster_indicator(clusters, self.contigs, self.network.shape[0])
+
+    def first_cluster(self):
+        """First cluster (lowest position) of each contig (pos), as a
+        nullable integer array (<NA> if none)."""
+        first = pd.array(np.full(self.members.shape[0], pd.NA), dtype="Int64")
+        members, clusters = self.members.nonzero()
+        order = np.lexsort((clusters, members))
+        rows, index = np.unique(members[order], return_index=True)
+        first[rows] = clusters[order][index]
+        return first
+
+    @property
+    def df(self):
+        """Contigs (indexed by contig_id) with the first cluster of each
+        contig (pos_cluster) and, for the contigs in several ClusterONE
+        clusters, all of them (pos_clusters, "i;j;...").
+
+        Used to identify the singletons, outliers and overlaps; None for MCL.
+        """
+        if self.mode != "ClusterONE" or self.members is None:
+            return None
+        contigs = self.contigs.set_index("contig_id")
+        contigs["pos_cluster"] = self.first_cluster()[contigs["pos"].values]
+
+        overlaps = self.members[contigs["pos"].values].tocsr()
+        overlaps.sort_indices()
+        counts = np.diff(overlaps.indptr)
+        strings = np.full(len(contigs), np.nan, dtype=object)
+        clusters = np.split(overlaps.indices.astype(str), overlaps.indptr[1:-1])
+        for i in np.flatnonzero(counts > 1):
+            strings[i] = ";".join(clusters[i])
+        contigs["pos_clusters"] = strings
+        return contigs
+
     def load_mcl_clusters(self, mcl_fi):
         """Load clusters from the mcl results
 
         Args:
-            mcl_fi (str): path to the MCL result file.
+            mcl_fi (str or list): path to the MCL result file, or the
+                clusters as returned by mcl.run_mcl.
 
         Returns:
             df (pandas.DataFrame): give for each contig cluster
@@ -320,9 +454,12 @@ class ContigCluster(object):
         """
 
         # Read the files
-        with open(mcl_fi) as f:
-            c = [line.rstrip("\n").split("\t") for line in f]
-        c = [x for x in c if len(c) > 1]
+        if isinstance(mcl_fi, str):
+            with open(mcl_fi) as f:
+                c = [line.rstrip("\n").split("\t") for line in f]
+        else:
+            c = mcl_fi
+        c = [x for x in c if len(x) > 1]
         nb_clusters = len(c)
         formatter = "CC_{{:>0{}}}".format(int(round(np.log10(nb_clusters)) + 1))
         name = [formatter.format(str(i)) for i in range(nb_clusters)]
@@ -336,17 +473,12 @@ class ContigCluster(object):
         )
 
         # Update self.contigs (To refactor)
-        self.contigs.reset_index(inplace=True)
-        self.contigs.set_index("contig_id", inplace=True)
-        self.contigs["pos_cluster"] = np.nan
-
-        for i, cluster in enumerate(c):
-            for n in cluster:
-                self.contigs.loc[n, "pos_cluster"] = i
-
-        self.contigs.reset_index(
-            inplace=True
-        )  # self.contigs = id, index, pos, proteins, pos_cluster
+        self.contigs = self.contigs.reset_index()
+        self.members = self.cluster_indicator(c)
+        self.contigs["pos_cluster"] = self.first_cluster()[self.contigs["pos"].values]
+        self.contigs = self.contigs[
+            ["contig_id"] + [x for x in self.contigs.columns if x != "contig_id"]
+        ]  # self.contigs = id, index, pos, proteins, pos_cluster
 
         return pd.DataFrame({"id": name, "size": size, "pos": pos}), c
 
@@ -383,36 +515,17 @@ class ContigCluster(object):
         )
 
         # Update self.contigs (To refactor)
-        contigs = self.contigs.reset_index().set_index("contig_id")
-        contigs["pos_cluster"] = np.nan
-        contigs["pos_clusters"] = np.nan
-
-        for i, cluster in enumerate(c):
-            for n in cluster:
-                if pd.isnull(contigs.loc[n, "pos_cluster"]):  # If never seen before
-                    contigs.loc[n, "pos_cluster"] = str(i)
-                elif pd.isnull(
-                    contigs.loc[n, "pos_clusters"]
-                ):  # If has been seen, check if others have been seen
-                    contigs.loc[n, "pos_clusters"] = ";".join(
-                        [str(contigs.loc[n, "pos_cluster"]), str(i)]
-                    )
-                else:  # If has been seen, along with others (NOTE the (s) at suffix)
-                    contigs.loc[n, "pos_clusters"] = ";".join(
-                        [str(contigs.loc[n, "pos_clusters"]), str(i)]
-                    )
-
-        self.df = contigs.copy()
-
-        # Remove overlapping contigs
-        contigs.loc[pd.notnull(contigs["pos_clusters"]), "pos_cluster"] = np.nan
-
-        # Side-effect of casting multiple pos as string (above), still need to process non-overlapping members
-        contigs.loc[contigs["pos_cluster"].notnull(), "pos_cluster"] = contigs.loc[
-            contigs["pos_cluster"].notnull(), "pos_cluster"
-        ].astype(int)
-
-        self.contigs = contigs.reset_index()
+        self.contigs = self.contigs.reset_index()
+        self.members = self.cluster_indicator(c)
+
+        # The overlapping contigs are removed
+        nb_memberships = np.asarray(self.members.sum(axis=1)).ravel()
+        first = self.first_cluster()
+        first[nb_memberships > 1] = pd.NA
+        self.contigs["pos_cluster"] = first[self.contigs["pos"].values]
+        self.contigs = self.contigs[
+            ["contig_id"] + [x for x in self.contigs.columns if x != "contig_id"]
+        ]
 
         formatter = "CC_{{:>0{}}}".format(int(round(np.log10(nb_clusters)) + 1))
         return (
@@ -463,7 +576,7 @@ class ContigCluster(object):
                 self.matrix[level]["F"],
             ) = matrices.correspondence(
                 self.matrix[level]["K"], self.matrix["B"]  # sparse matrix, (#,#) bool
-            )  # 0, 1 matrix
+            )  # sparse, nnz of Q
 
             # Associate clusters and taxonomic classes.
             self.clusters, self.taxonomy[level] = associations.cluster_taxonomy(
@@ -490,7 +603,7 @@ class ContigCluster(object):
             )
         return pd.DataFrame(results, levels)
 
-    def cross_validation_affiliation(self, level="family", folds=10):
+    def cross_validation_affiliation(self, level="family", folds=10, threads=None):
         """Cross validation affiliation.
 
         Cut the dataset (where a reference taxonomy exist) into <fold> equal parts
@@ -506,65 +619,31 @@ class ContigCluster(object):
         Args:
             level (str): Taxonomic level to consider.
             folds (int): number of folds for the cross-validation.
+            threads (int): number of processes, one fold by task (default:
+                the threads of the clustering).
 
         Returns:
             dict: Dict of dataframes, one entry by set (learning,cv,test).
                 In the dataframes are the classification metrics, one row by
                 selected cv-set.
         """
-        results: dict[str, list[dict]] = {"train_set": [], "cv_set": [], "test_set": []}
-        conditions = {}
-        contigs = self.contigs
-        taxonomy = self.taxonomy[level]
-        clusters = self.clusters
-
         # Stratified split according to the taxonomic level.
-        contigs = ml_functions.split_dataset(contigs, level, folds)
+        contigs = ml_functions.split_dataset(self.contigs.copy(), level, folds)
         logger.info("{} folds cross-validation".format(folds))
-        all_sets = frozenset(range(folds))
 
-        for cv_set, test_set in zip(range(folds), list(range(1, folds)) + [0]):
-            logger.info(
-                "Cross-validation fold {:2} ({:.0%})".format(
-                    cv_set, cv_set / float(folds)
-                )
-            )
-
-            # Filtering conditions:
-            train_set = list(all_sets - frozenset([cv_set, test_set]))
-            conditions["cv_set"] = "cvset_{}=={}".format(level, cv_set)
-            conditions["test_set"] = "cvset_{}=={}".format(level, test_set)
-            conditions["train_set"] = "cvset_{} in {}".format(level, train_set)
-
-            # Affiliation:
-            K = matrices.reference_membership(
-                level, contigs, taxonomy, conditions["train_set"]
-            )
-            _, R, P, _ = matrices.correspondence(K, self.matrix["B"])
-            clusters, taxonomy = associations.cluster_taxonomy(
-                clusters, taxonomy, level, P, R
-            )
-            contigs = associations.contig_taxonomy(contigs, taxonomy, clusters, level)
-
-            # Computing metrics:
-            for set_ in conditions.keys():
-                df = contigs.query(conditions[set_]).loc[
-                    :, [level, "predicted_" + level]
-                ]
-                results[set_].append(
-                    ml_functions.classification_metrics(
-                        df, ref_col=level, pred_col="predicted_" + level
-                    )
-                )
-
-            # Cleaning the dataset for next step:
-            contigs = contigs.drop("predicted_" + level, 1)
-            taxonomy = taxonomy.drop(["pos_cluster", "recall"], 1)
-            clusters = clusters.drop(["pos_" + level, "precision_" + level], 1)
+        # (cv set, test set) of each fold, the training set being all the others
+        tasks = [(cv_set, (cv_set + 1) % folds) for cv_set in range(folds)]
+        done = self._map_folds(
+            _cross_validation_fold, tasks, contigs, level, folds, threads
+        )
 
-        return {set_: pd.DataFrame(results[set_], [range(folds)]) for set_ in results}
+        results: dict[str, list[dict]] = {"train_set": [], "cv_set": [], "test_set": []}
+        for metrics in done:
+            for set_ in results:
+                results[set_].append(metrics[set_])
+        return {set_: pd.DataFrame(results[set_], index=range(folds)) for set_ in results}
 
-    def learning_curve_affiliation(self, level="family", folds=10):
+    def learning_curve_affiliation(self, level="family", folds=10, threads=None):
         """Learning curve affiliation.
 
         Cut the dataset (where a reference taxonomy exist) into <fold> equal parts
@@ -579,74 +658,83 @@ class ContigCluster(object):
         Args:
             levels (str): Taxonomic level to consider.
             folds (int): number of folds for the cross-validation.
+            threads (int): number of processes, one cv-set by task (default:
+                the threads of the clustering).
 
         Returns:
             dict: Dict of dict of dataframes, one entrie by level then one entry
                 by set (learning,cv). In the dataframes are the classification
                 metrics), one row by learning set size .
         """
-
-        results: dict[str, list[dict]] = {"train_set": [], "cv_set": []}
-        conditions = {}
-        contigs = self.contigs
-        taxonomy = self.taxonomy[level]
-        clusters = self.clusters
-
         # Stratified split according to the taxonomic level.
-        contigs = ml_functions.split_dataset(contigs, level, folds)
+        contigs = ml_functions.split_dataset(self.contigs.copy(), level, folds)
         logger.info("{} folds cross-validation".format(folds))
 
-        for cv_set in range(folds):
-            logger.info(
-                "Cross-validation set {:2} ({:.0%})".format(
-                    cv_set, cv_set / float(folds)
-                )
-            )
-
-            remaining_sets = list(range(folds))
-            remaining_sets.pop(cv_set)
-            train_sets = [
-                [remaining_sets[y] for y in range(x)] for x in range(1, folds)
-            ]
-            for train_set in train_sets:
-                logger.info("Training set of size {:2}".format(len(train_set)))
-
-                # Filtering conditions:
-                conditions["cv_set"] = "cvset_{}=={}".format(level, cv_set)
-                conditions["train_set"] = "cvset_{} in {}".format(level, train_set)
-
-                # Affiliation:
-                K = matrices.reference_membership(
-                    level, contigs, taxonomy, conditions["train_set"]
-                )
-                _, R, P, _ = matrices.correspondence(K, self.matrix["B"])
-                clusters, taxonomy = associations.cluster_taxonomy(
-                    clusters, taxonomy, level, P, R
-                )
-                contigs = associations.contig_taxonomy(
-                    contigs, taxonomy, clusters, level
-                )
+        tasks = list(range(folds))
+        done = self._map_folds(
+            _learning_curve_fold, tasks, contigs, level, folds, threads
+        )
 
-                # Computing metrics:
-                for set_ in results:
-                    df = contigs.query(conditions[set_]).loc[
-                        :, [level, "predicted_" + level]
-                    ]
-                    metrics = ml_functions.classification_metrics(
-                        df, ref_col=level, pred_col="predicted_" + level
-                    )
-                    metrics["train_size"] = len(train_set)
-                    metrics["cv_set"] = cv_set
-                    results[set_].append(metrics)
-
-                # Cleaning the dataset for next step:
-                contigs = contigs.drop("predicted_" + level, 1)
-                taxonomy = taxonomy.drop(["pos_cluster", "recall"], 1)
-                clusters = clusters.drop(["pos_" + level, "precision_" + level], 1)
+        results: dict[str, list[dict]] = {"train_set": [], "cv_set": []}
+        for metrics in done:
+            for set_ in results:
+                results[set_].extend(metrics[set_])
         for set_ in results.keys():
             results[set_] = pd.DataFrame(results[set_])
         return results
 
+    def _map_folds(self, function, tasks, contigs, level, folds, threads=None):
+        """Run the evaluation tasks of the folds, in a process pool if threads > 1.
+
+        The membership matrix B is shared read-only with the workers, which
+        also receive the reference membership matrix K of each fold once.
+
+        Args:
+            function (callable): Evaluation of a task.
+            tasks (list): Tasks of the folds.
+            contigs (dataframe): self.contigs split in folds (column
+                cvset_<level>, see ml_functions.split_dataset).
+            level (str): Taxonomic level to consider.
+            folds (int): number of folds.
+            threads (int): number of processes (default: self.threads).
+
+        Returns:
+            list: results of function for each task, in order.
+        """
+        threads = self.threads if threads is None else threads
+        cvset = "cvset_{}".format(level)
+        # Affiliations of a previous run are recomputed for each fold.
+        state = {
+            "level": level,
+            "K": matrices.fold_memberships(level, contigs, self.taxonomy[level], folds),
+            "contigs": contigs.loc[:, ["pos", level, cvset, "pos_cluster_mbship"]],
+            "taxonomy": self.taxonomy[level].drop(
+                columns=["pos_cluster", "recall"], errors="ignore"
+            ),
+            "clusters": self.clusters.drop(
+                columns=["pos_" + level, "precision_" + level], errors="ignore"
+            ),
+        }
+
+        B = sparse.csr_matrix(self.matrix["B"], dtype=float)
+        if threads <= 1 or len(tasks) == 1:
+            _worker.update(state, B=B)
+            try:
+                return [function(task) for task in tasks]
+            finally:
+                _worker.clear()
+
+        arrays = pcprofiles.SharedArrays(data=B.data, indices=B.indices, indptr=B.indptr)
+        try:
+            with mp.Pool(
+                processes=min(threads, len(tasks)),
+                initializer=_init_fold_worker,
+                initargs=(arrays.specs, B.shape, state),
+            ) as pool:
+                return pool.map(function, tasks)
+        finally:
+            arrays.close()
+
     # --------------------------------------------------------------------------#
     # PART 4: Pickle-save
     # --------------------------------------------------------------------------#
@@ -658,6 +746,88 @@ class ContigCluster(object):
             pickle.dump(self, f)
 
 
+# State of a worker of the affiliation evaluations, set by _init_fold_worker.
+_worker: dict = {}
+
+
+def _init_fold_worker(specs, shape, state):
+    arrays, blocks = pcprofiles.attach_arrays(specs)
+    _worker["blocks"] = blocks
+    _worker["B"] = sparse.csr_matrix(
+        (arrays["data"], arrays["indices"], arrays["indptr"]), shape=shape, copy=False
+    )
+    _worker.update(state)
+
+
+def _affiliate(K, sets):
+    """Affiliation with the reference membership K, and classification
+    metrics of the contigs in each set of folds.
+
+    Args:
+        K (sparse_matrix): Reference membership of the training set.
+        sets (dict): name -> list of folds on which to compute the metrics.
+
+    Returns:
+        dict: name -> classification metrics (see ml_functions).
+    """
+    level = _worker["level"]
+    predicted = "predicted_" + level
+    _, R, P, _ = matrices.correspondence(K, _worker["B"], full=False)
+    clusters, taxonomy = associations.cluster_taxonomy(
+        _worker["clusters"], _worker["taxonomy"], level, P, R
+    )
+    contigs = associations.contig_taxonomy(
+        _worker["contigs"].copy(), taxonomy, clusters, level
+    )
+    fold = contigs["cvset_{}".format(level)]
+    return {
+        name: ml_functions.classification_metrics(
+            contigs.loc[fold.isin(folds).values, [level, predicted]],
+            ref_col=level,
+            pred_col=predicted,
+        )
+        for name, folds in sets.items()
+    }
+
+
+def _cross_validation_fold(task):
+    """Multiprocessing helper function: one fold of the cross-validation."""
+    cv_set, test_set = task
+    folds = len(_worker["K"])
+    logger.info(
+        "Cross-validation fold {:2} ({:.0%})".format(cv_set, cv_set / float(folds))
+    )
+    train_set = sorted(frozenset(range(folds)) - frozenset([cv_set, test_set]))
+    K = sum(_worker["K"][x] for x in train_set)
+    return _affiliate(
+        K, {"train_set": train_set, "cv_set": [cv_set], "test_set": [test_set]}
+    )
+
+
+def _learning_curve_fold(task):
+    """Multiprocessing helper function: the learning curve of one cv-set, the
+    training set growing by one fold at a time."""
+    cv_set = task
+    folds = len(_worker["K"])
+    logger.info(
+        "Cross-validation set {:2} ({:.0%})".format(cv_set, cv_set / float(folds))
+    )
+    remaining_sets = [x for x in range(folds) if x != cv_set]
+    results: dict[str, list[dict]] = {"train_set": [], "cv_set": []}
+    K = None
+    for size in range(1, folds):
+        logger.info("Training set of size {:2}".format(size))
+        train_set = remaining_sets[:size]
+        block = _worker["K"][train_set[-1]]
+        K = block if K is None else K + block
+        metrics = _affiliate(K, {"train_set": train_set, "cv_set": [cv_set]})
+        for set_ in results:
+            metrics[set_]["train_size"] = size
+            metrics[set_]["cv_set"] = cv_set
+            results[set_].append(metrics[set_])
+    return results
+
+
 def read_pickle(path):
     """Read pickled object in file path."""
     with open(path, "rb") as fh:
@@ -20,8 +20,8 @@ def complete(
     Args:
         pcm (vcontact.pcprofiles.PCProfiles): Profiles
         gc (vcontact2.genome_clusters.GenomeClusters): Contigs
-        mod (vcontact2.modules.Modules object): Modules
-        link (pandas.DataFrame): Link between contig clusters and modules
+        mod (vcontact2.modules.Modules object): Modules (None if skipped)
+        link (pandas.DataFrame): Link between contig clusters and modules (None if skipped)
     """
 
     permissive = "_permissive" if gc.permissive else ""
@@ -30,9 +30,16 @@ def complete(
     gc.contigs.to_csv(os.path.join(folder, "{}_contigs.csv".format(fn)), index=False)
     gc.clusters.to_csv(os.path.join(folder, "{}_clusters.csv".format(fn)), index=False)
 
+    # Modules are not computed with --skip-modules
+    if vm is None:
+        return
+
     fn = "sig{}_mcl{}_minshared{}".format(vm.thres, vm.inflation, vm.shared_min)
     vm.modules.to_csv(os.path.join(folder, "{}_modules.csv".format(fn)), index=False)
 
+    if link is None:
+        return
+
     fn = "sig{}_mcl{}_modsig{}_modmcl{}_minshared{}".format(
         gc.thres, gc.inflation, vm.thres, vm.inflation, vm.shared_min
     )
@@ -22,6 +22,39 @@ import scipy.sparse as sparse
 logger = logging.getLogger(__name__)
 
 
+def cluster_indicator(clusters, nodes, nb_nodes=None):
+    """Indicator matrix of the nodes in the clusters.
+
+    Args:
+        clusters: (list of list) a list of nodes name by cluster.
+        nodes: (dataframe) with a column "contig_id" corresponding to the
+            entries in clusters and a column "pos" corresponding to
+            the position in the matrix.
+        nb_nodes: (int) number of rows, default to len(nodes).
+
+    Returns:
+        sparse_matrix: #node X #clusters (csr, bool),
+            bool(Z[g,c]) == node g is in cluster c.
+    """
+    nb_nodes = len(nodes) if nb_nodes is None else nb_nodes
+    sizes = np.array([len(x) for x in clusters], dtype=np.int64)
+    members = np.array([n for cluster in clusters for n in cluster], dtype=object)
+    rows = nodes.set_index("contig_id")["pos"].reindex(members).values
+    known = pd.notnull(rows)
+    if not known.all():
+        logger.warning(
+            "{} clustered nodes are not in the network, ignored.".format((~known).sum())
+        )
+    cols = np.repeat(np.arange(len(clusters)), sizes)
+    return sparse.csr_matrix(
+        (
+            np.ones(known.sum(), dtype=bool),
+            (rows[known].astype(np.int64), cols[known]),
+        ),
+        shape=(nb_nodes, len(clusters)),
+    )
+
+
 def membership(mcl_results, network, nodes):
     """Membership matrix of the node to the clusters.
 
@@ -29,7 +62,7 @@ def membership(mcl_results, network, nodes):
         mcl_results: (list of list) a list of nodes name by cluster.
             Extracted from the lines of the mcl output.
         network: (sparse matrix) similarity network.
-        nodes: (dataframe) with a column "name" corresponding to the
+        nodes: (dataframe) with a column "contig_id" corresponding to the
             entries in mcl_results and a column "pos" corresponding to
             the position in the matrix.
 
@@ -38,23 +71,20 @@ def membership(mcl_results, network, nodes):
             B(g,c) is the proportion of edges weight linking the
             node g to the cluster C
     """
+    network = sparse.csr_matrix(network, dtype=float)
 
-    network = network.todense()
-    network = (network - network.min()) / (network.max() - network.min())
-
-    # Sum of weights linking to a given target.
-    B_sum = np.hstack([network.sum(1)] * len(mcl_results))
+    # The min-max scaling of the weights cancels out in the proportions (the
+    # minimum of the network being the null weight of the unlinked pairs).
+    Z = cluster_indicator(mcl_results, nodes, network.shape[1]).astype(float)
 
-    # A list giving the columns of the i-th cluster members :
-    clusters = [
-        np.int_(nodes.query("name in members").ix[:, "pos"].values)
-        for members in mcl_results
-    ]
-
-    B_clust = np.hstack([network[:, cols].sum(1) for cols in clusters])
+    # B_clust[g,c]: weights linking g to the members of c
+    B = network.dot(Z).tocsr()
 
-    B = B_clust / B_sum
-    B = np.nan_to_num(B)
+    # Divided by the sum of weights linking to g (no link: null membership)
+    B_sum = np.asarray(network.sum(1)).ravel()
+    B_sum[B_sum == 0] = 1
+    B = sparse.diags(1 / B_sum).dot(B).tocsr()
+    B.eliminate_zeros()
     return B
 
 
@@ -69,16 +99,15 @@ def bool_membership(nodes: pd.DataFrame):
             B(g,c) = bool(g \in c)
     """
     nb_contigs = len(nodes)
-    nb_clusters = nodes["pos_cluster"].max() + 1
-    xy = (
-        nodes.reset_index()
-        .loc[:, ["pos", "pos_cluster"]]
-        .dropna(subset=["pos_cluster"])
-        .values
-    )  # pos?, # membership
-    B = sparse.coo_matrix(
-        ([1.0] * len(xy), list(zip(*xy))), shape=(nb_contigs, nb_clusters)
-    ).todense()
+    xy = nodes.loc[:, ["pos", "pos_cluster"]].dropna(subset=["pos_cluster"])
+    nb_clusters = int(xy["pos_cluster"].max()) + 1 if len(xy) else 0
+    B = sparse.csr_matrix(
+        (
+            np.ones(len(xy)),
+            (xy["pos"].values.astype(np.int64), xy["pos_cluster"].values.astype(np.int64)),
+        ),
+        shape=(nb_contigs, nb_clusters),
+    )
 
     return B
 
@@ -103,25 +132,65 @@ def reference_membership(
         sparse_matrix: K, Bool(K[c,t]) == Contig c is of class t.
     """
 
-    taxonomy = taxonomy.set_index("name")
-    K = sparse.lil_matrix((len(contigs), len(taxonomy)), dtype=bool)
-    contigs = contigs.query(condition).loc[:, ("pos", level)].dropna().values
+    shape = (len(contigs), len(taxonomy))
+    contigs = contigs.query(condition).loc[:, ("pos", level)].dropna()
+    return _class_indicator(contigs["pos"], contigs[level], taxonomy, shape)
+
 
-    for pos, tax in contigs:
-        K[pos, taxonomy.pos.loc[tax]] = 1
+def fold_memberships(level, contigs, taxonomy, folds):
+    """
+    Reference membership matrices of the cross-validation folds.
+
+    The K matrix of a set of folds is the sum of their matrices.
 
-    K = sparse.csc_matrix(K)
+    Args:
+        level: (str) column name of ref. taxonomy.
+        contigs: (dataframe) with columns pos, "level" and
+            "cvset_level" (fold of the contig, see ml_functions.split_dataset).
+        taxonomy: (dataframe) with columns name and pos.
+        folds: (int) number of folds.
 
-    return K
+    Returns:
+        list: K of each fold (sparse_matrix, float).
+    """
+    shape = (len(contigs), len(taxonomy))
+    fold = "cvset_{}".format(level)
+    contigs = contigs.loc[:, ("pos", level, fold)].dropna()
+    return [
+        _class_indicator(data["pos"], data[level], taxonomy, shape).astype(float)
+        for data in (contigs[contigs[fold] == n] for n in range(folds))
+    ]
 
 
-def correspondence(K, B):
+def _class_indicator(pos, classes, taxonomy, shape):
+    """Bool(K[pos, class]) from the class names, through their categorical
+    codes in the taxonomy names (the unknown classes are ignored)."""
+    codes = pd.Categorical(classes, categories=taxonomy["name"]).codes
+    known = codes >= 0
+    K = sparse.coo_matrix(
+        (
+            np.ones(known.sum(), dtype=bool),
+            (
+                np.asarray(pos)[known].astype(np.int64),
+                taxonomy["pos"].values[codes[known]].astype(np.int64),
+            ),
+        ),
+        shape=shape,
+    )
+    return sparse.csc_matrix(K)
+
+
+def correspondence(K, B, full=True):
     """
     Build the (cluster X taxonomic class) correspondances matrix.
 
+    All the matrices share the sparsity of Q: the row and column sums are
+    applied as diagonal scalings of its stored entries.
+
     Args:
         K (sparse matrix): Reference membership matrix.
         B (sparse matrix): Membership matrix.
+        full (bool): If False, Q and F are not returned (None).
 
     Returns:
         (tuple of sparse_matrix): including
@@ -131,24 +200,37 @@ def correspondence(K, B):
             F: F-measure 2PR/(P+R)
     """
 
-    Q = np.dot(np.transpose(B), K.todense())
+    Q = sparse.csr_matrix(B, dtype=float).T.dot(sparse.csr_matrix(K, dtype=float)).tocsr()
+    Q.eliminate_zeros()
+    Q.sort_indices()
+
+    rows = np.repeat(np.arange(Q.shape[0]), np.diff(Q.indptr))
 
-    # Precision
-    Q_hsum = np.hstack([Q.sum(1)] * Q.shape[1])
-    P = Q / Q_hsum
-    P = np.nan_to_num(P)
+    # Precision: rows scaled by 1 / sum of the row
+    P = Q.copy()
+    P.data *= _inverse(Q.sum(1))[rows]
 
-    # Recall
-    Q_vsum = np.vstack([Q.sum(0)] * Q.shape[0])
-    R = Q / Q_vsum
-    R = np.nan_to_num(R)
+    # Recall: columns scaled by 1 / sum of the column
+    R = Q.copy()
+    R.data *= _inverse(Q.sum(0))[Q.indices]
 
-    # F1-measure
-    F = 2 * np.divide(np.multiply(P, R), P + R)
-    F = np.nan_to_num(F)
+    if not full:
+        return None, R, P, None
+
+    # F1-measure, P + R > 0 on the entries of Q
+    F = P.copy()
+    F.data = 2 * P.data * R.data / (P.data + R.data)
     return Q, R, P, F
 
 
+def _inverse(sums):
+    """1 / sums, 0 where the sum is null."""
+    sums = np.asarray(sums, dtype=float).ravel()
+    inverse = np.zeros_like(sums)
+    np.divide(1, sums, out=inverse, where=sums != 0)
+    return inverse
+
+
 def clustering_wise_metrics(P, R, B, K):
     """Compute the clustering wise recall, precision and f-measure.
 
@@ -165,10 +247,12 @@ def clustering_wise_metrics(P, R, B, K):
             int: Clustering wise f-measure
     """
 
-    cwise_P = float(np.dot(B.sum(0), np.max(P, 1)))
+    max_P = sparse.csr_matrix(P).max(axis=1).toarray().ravel()
+    cwise_P = float(np.asarray(B.sum(0)).ravel().dot(max_P))
     cwise_P /= B.sum()
 
-    cwise_R = float(np.dot(np.max(R, 0), np.transpose(K.sum(0))))
+    max_R = sparse.csr_matrix(R).max(axis=0).toarray().ravel()
+    cwise_R = float(max_R.dot(np.asarray(K.sum(0)).ravel()))
     cwise_R /= K.sum()
 
     cwise_F = 2 * (cwise_P * cwise_R) / (cwise_P + cwise_R)
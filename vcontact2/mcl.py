@@ -0,0 +1,398 @@
+""" Markov clustering (MCL) of the similarity networks.
+
+Two backends:
+    mcl: the external mcl binary, the network being streamed through pipes.
+        The edges are written to the stdin of mcl by a feeder thread while
+        the main thread reads the clusters from its stdout, so that no
+        intermediate network or clusters file is needed (both can still be
+        saved on the way). The blast hits are streamed to mcxload instead,
+        which mirrors and transforms them into a matrix file for mcl.
+    native: an implementation on scipy.sparse matrices, for the networks
+        already held in memory.
+"""
+import logging
+import os
+import subprocess
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import scipy.sparse as sparse
+from scipy.sparse import csgraph
+
+from . import tools
+
+logger = logging.getLogger(__name__)
+
+BACKENDS = ("mcl", "native")
+
+# Buffer of the pipes to and from mcl (bytes)
+PIPE_BUFFER_SIZE = 16 * 1024**2
+
+# Resource limits of the native backend, the defaults of mcl (-P, -S, -R, -pct)
+PRUNE = 4000
+SELECT = 500
+RECOVER = 600
+RECOVER_PCT = 90
+# Number of rows expanded at once by a task of the native backend
+BLOCK_ROWS = 2000
+
+
+def cluster(
+    matrix, names, inflation, backend="mcl", threads=0, network_fp=None, clusters_fp=None
+):
+    """Cluster a symmetric network with one of the MCL backends.
+
+    Args:
+        matrix (scipy.sparse): Symmetric network.
+        names (pandas.Series): name of the nodes, indexed by their position
+            in the matrix.
+        inflation (float): Inflation.
+        backend (str): "mcl" (external binary) or "native".
+        threads (int): Number of threads.
+        network_fp (str): If given, the network is also saved in this file.
+        clusters_fp (str): If given, the clusters are also saved in this file.
+
+    Returns:
+        list: The clusters, each a list of node names.
+    """
+    if backend == "native":
+        if network_fp is not None:
+            tools.write_edges(network_fp, matrix, names)
+        return run_native(
+            matrix, names, inflation, threads=max(1, threads), clusters_fp=clusters_fp
+        )
+    if backend == "mcl":
+        # Both directions of each edge, as in the saved networks
+        return run_mcl(
+            tools.format_edges(matrix, names),
+            inflation,
+            threads=threads,
+            network_fp=network_fp,
+            clusters_fp=clusters_fp,
+        )
+    raise ValueError(
+        "Unknown MCL backend {} (expected one of {})".format(backend, ", ".join(BACKENDS))
+    )
+
+
+def run_mcl(edges, inflation, threads=0, options=None, network_fp=None, clusters_fp=None):
+    """Cluster an edge list (abc format) with mcl.
+
+    Args:
+        edges (iterable): Chunks of "name name weight" lines (str).
+        inflation (float): Inflation for mcl.
+        threads (int): Number of threads of mcl (-te).
+        options (list): Additional arguments of mcl (e.g. ["--abc-neg-log10"]).
+        network_fp (str): If given, the edges are also saved in this file.
+        clusters_fp (str): If given, the mcl output is also saved in this file.
+
+    Returns:
+        list: The clusters, each a list of node names (one line of mcl output).
+
+    Raises:
+        subprocess.CalledProcessError: If mcl fails.
+    """
+    cmd = ["mcl", "-", "--abc", "-I", str(inflation), "-o", "-"]
+    if threads:
+        cmd += ["-te", str(threads)]
+    cmd += [str(x) for x in options or []]
+    clusters = _run_clustering(cmd, edges, network_fp, clusters_fp)
+    logger.debug("MCL({}) returned {} clusters.".format(inflation, len(clusters)))
+    return clusters
+
+
+def run_mcxload(edges, mci_fp, tab_fp, options=None, network_fp=None):
+    """Load an edge list (abc format) streamed to mcxload into a matrix file
+    of mcl and its label tab.
+
+    Args:
+        edges (iterable): Chunks of "name name weight" lines (str).
+        mci_fp (str): Matrix file written by mcxload.
+        tab_fp (str): Tab file (node labels) written by mcxload.
+        options (list): Additional arguments of mcxload
+            (e.g. ["--stream-mirror"]).
+        network_fp (str): If given, the edges are also saved in this file.
+
+    Raises:
+        subprocess.CalledProcessError: If mcxload fails.
+    """
+    cmd = ["mcxload", "-abc", "-", "-o", mci_fp, "-write-tab", tab_fp]
+    cmd += [str(x) for x in options or []]
+    logger.debug("Running {}".format(" ".join(cmd)))
+
+    process = subprocess.Popen(
+        cmd, stdin=subprocess.PIPE, text=True, bufsize=PIPE_BUFFER_SIZE
+    )
+    errors = []
+    try:
+        _feed(edges, process.stdin, network_fp, errors)
+    finally:
+        process.wait()
+
+    if errors or process.returncode != 0:
+        # Do not leave truncated results to be re-used by a later run.
+        for fp in (mci_fp, tab_fp):
+            if os.path.exists(fp):
+                os.remove(fp)
+        if errors:
+            raise errors[0]
+        raise subprocess.CalledProcessError(process.returncode, cmd)
+
+
+def run_mcl_matrix(mci_fp, tab_fp, inflation, threads=0, clusters_fp=None):
+    """Cluster a matrix file written by mcxload (see run_mcxload) with mcl.
+
+    Args:
+        mci_fp (str): Matrix file.
+        tab_fp (str): Tab file of the node labels.
+        inflation (float): Inflation for mcl.
+        threads (int): Number of threads of mcl (-te).
+        clusters_fp (str): If given, the mcl output is also saved in this file.
+
+    Returns:
+        list: The clusters, each a list of node names (one line of mcl output).
+
+    Raises:
+        subprocess.CalledProcessError: If mcl fails.
+    """
+    cmd = ["mcl", mci_fp, "-I", str(inflation), "-use-tab", tab_fp, "-o", "-"]
+    if threads:
+        cmd += ["-te", str(threads)]
+    clusters = _run_clustering(cmd, None, None, clusters_fp)
+    logger.debug("MCL({}) returned {} clusters.".format(inflation, len(clusters)))
+    return clusters
+
+
+def _run_clustering(cmd, edges, network_fp, clusters_fp):
+    """Run mcl writing its clusters on stdout, the edges (if any) being fed
+    to its stdin by a thread while the clusters are read."""
+    logger.debug("Running {}".format(" ".join(cmd)))
+
+    process = subprocess.Popen(
+        cmd,
+        stdin=subprocess.PIPE if edges is not None else None,
+        stdout=subprocess.PIPE,
+        text=True,
+        bufsize=PIPE_BUFFER_SIZE,
+    )
+
+    # The edges are generated and fed while mcl loads them.
+    errors = []
+    feeder = None
+    if edges is not None:
+        feeder = threading.Thread(
+            target=_feed, args=(edges, process.stdin, network_fp, errors), daemon=True
+        )
+        feeder.start()
+
+    clusters = []
+    out = open(clusters_fp, "wt") if clusters_fp is not None else None
+    try:
+        for line in process.stdout:
+            if out is not None:
+                out.write(line)
+            clusters.append(line.rstrip("\n").split("\t"))
+    finally:
+        if out is not None:
+            out.close()
+        process.stdout.close()
+        if feeder is not None:
+            feeder.join()
+        process.wait()
+
+    if errors or process.returncode != 0:
+        # Do not leave truncated results to be re-used by a later run.
+        if clusters_fp is not None and os.path.exists(clusters_fp):
+            os.remove(clusters_fp)
+        if errors:
+            raise errors[0]
+        raise subprocess.CalledProcessError(process.returncode, cmd)
+
+    return clusters
+
+
+def _feed(edges, stdin, network_fp, errors):
+    """Feeder thread of run_mcl: write the edges to mcl (and to network_fp)."""
+    out = open(network_fp, "wt") if network_fp is not None else None
+    try:
+        for chunk in edges:
+            stdin.write(chunk)
+            if out is not None:
+                out.write(chunk)
+    except BrokenPipeError:
+        # mcl exited early, its return code tells why.
+        pass
+    except Exception as e:
+        errors.append(e)
+    finally:
+        if out is not None:
+            out.close()
+        try:
+            stdin.close()
+        except BrokenPipeError:
+            pass
+
+
+def markov_clustering(
+    matrix,
+    inflation=2.0,
+    threads=1,
+    prune=PRUNE,
+    select=SELECT,
+    recover=RECOVER,
+    recover_pct=RECOVER_PCT,
+    max_iter=100,
+    tol=1e-6,
+    block_rows=BLOCK_ROWS,
+):
+    """
+    Markov clustering of a symmetric network.
+
+    The matrix is kept row-stochastic (the transpose of the column-stochastic
+    matrix of mcl, which is the same for a symmetric network). Each iteration
+    expands the matrix (M . M), prunes each row, inflates it and normalizes
+    it, until the rows are idempotent. The rows are processed by blocks in a
+    thread pool, scipy releasing the GIL in the sparse products.
+
+    Args:
+        matrix (scipy.sparse): Symmetric network, weights > 0.
+        inflation (float): Inflation.
+        threads (int): Number of threads.
+        prune (int): Entries below 1 / prune are removed (-P).
+        select (int): Maximal number of entries kept by row (-S).
+        recover (int): Number of entries kept by row when the kept mass
+            is below recover_pct (-R).
+        recover_pct (float): Percentage of the mass to keep (-pct).
+        max_iter (int): Maximal number of iterations.
+        tol (float): Convergence threshold on the chaos of the rows.
+        block_rows (int): Number of rows of each task.
+
+    Returns:
+        numpy.ndarray: Cluster of each node, the clusters being numbered by
+            decreasing size.
+    """
+    M = sparse.csr_matrix(matrix, dtype=np.float64)
+    n = M.shape[0]
+    M.eliminate_zeros()
+
+    # Loops weighted as the heaviest edge of each node (1 for isolated nodes).
+    loops = M.max(axis=1).toarray().ravel()
+    loops[loops == 0] = 1
+    M = (M + sparse.diags(loops)).tocsr()
+    M = _normalize(M)
+
+    limits = (inflation, 1.0 / prune, select, recover, recover_pct / 100.0)
+    blocks = [(start, min(start + block_rows, n)) for start in range(0, n, block_rows)]
+    with ThreadPoolExecutor(max_workers=max(1, threads)) as pool:
+        for iteration in range(max_iter):
+            parts = list(pool.map(lambda block: _iterate(M, block, limits), blocks))
+            M = sparse.vstack([part[0] for part in parts], format="csr")
+            chaos = max(part[1] for part in parts)
+            logger.debug(
+                "MCL iteration {}: chaos {:.2e}, {} entries".format(
+                    iteration + 1, chaos, M.nnz
+                )
+            )
+            if chaos < tol:
+                break
+        else:
+            logger.warning(
+                "MCL did not converge after {} iterations (chaos {:.2e})".format(max_iter, chaos)
+            )
+
+    # Clusters: the nodes attracted by the same attractors
+    _, labels = csgraph.connected_components(M, directed=True, connection="weak")
+
+    # Number the clusters by decreasing size, as mcl does
+    sizes = np.bincount(labels)
+    order = np.argsort(-sizes, kind="stable")
+    rank = np.empty_like(order)
+    rank[order] = np.arange(len(order))
+    return rank[labels]
+
+
+def _normalize(M):
+    """Scale the rows of a csr matrix to sum to 1."""
+    sums = np.asarray(M.sum(axis=1)).ravel()
+    sums[sums == 0] = 1
+    M.data /= np.repeat(sums, np.diff(M.indptr))
+    return M
+
+
+def _iterate(M, block, limits):
+    """One MCL iteration on a block of rows: expand, prune, inflate and
+    normalize. Returns the new rows and their maximal chaos."""
+    inflation, cutoff, select, recover, pct = limits
+    start, end = block
+    rows = M[start:end].dot(M).tocsr()
+    rows.sum_duplicates()
+    lengths = np.diff(rows.indptr)
+    row = np.repeat(np.arange(rows.shape[0]), lengths)
+
+    # Rank of each entry in its row, by decreasing value
+    order = np.lexsort((-rows.data, row))
+    rank = np.empty(len(order), dtype=np.int64)
+    rank[order] = np.arange(len(order)) - np.repeat(rows.indptr[:-1], lengths)
+
+    keep = (rows.data >= cutoff) & (rank < select)
+    kept = np.bincount(row[keep], weights=rows.data[keep], minlength=rows.shape[0])
+    # The rows losing too much mass recover their heaviest entries.
+    low = kept < pct
+    keep |= low[row] & (rank < recover)
+    # Never empty a row
+    keep |= rank == 0
+
+    indptr = np.zeros(rows.shape[0] + 1, dtype=np.int64)
+    np.cumsum(np.bincount(row[keep], minlength=rows.shape[0]), out=indptr[1:])
+    rows = sparse.csr_matrix(
+        (rows.data[keep] ** inflation, rows.indices[keep], indptr), shape=rows.shape
+    )
+    rows = _normalize(rows)
+
+    # Chaos: max - sum of squares of each (non empty) row, 0 once the row
+    # is idempotent
+    if rows.nnz == 0:
+        return rows, 0.0
+    maxima = np.maximum.reduceat(rows.data, rows.indptr[:-1])
+    squares = np.add.reduceat(rows.data**2, rows.indptr[:-1])
+    return rows, float((maxima - squares).max())
+
+
+def run_native(matrix, names, inflation, threads=1, clusters_fp=None, **kwargs):
+    """Cluster a network with the native backend, with the same output as
+    run_mcl.
+
+    Args:
+        matrix (scipy.sparse): Symmetric network.
+        names (pandas.Series): name of the nodes, indexed by their position
+            in the matrix.
+        inflation (float): Inflation.
+        threads (int): Number of threads.
+        clusters_fp (str): If given, the clusters are also saved in this file,
+            in the mcl output format.
+        kwargs: See markov_clustering.
+
+    Returns:
+        list: The clusters, each a list of node names, by decreasing size.
+    """
+    labels = markov_clustering(matrix, inflation, threads=threads, **kwargs)
+    names = names.reindex(np.arange(matrix.shape[0])).to_numpy(dtype=object)
+
+    order = np.argsort(labels, kind="stable")
+    bounds = np.cumsum(np.bincount(labels))[:-1]
+    clusters = [list(x) for x in np.split(names[order], bounds)]
+
+    if clusters_fp is not None:
+        write_clusters(clusters, clusters_fp)
+
+    logger.debug("MCL({}) returned {} clusters.".format(inflation, len(clusters)))
+    return clusters
+
+
+def write_clusters(clusters, fi):
+    """Write clusters (lists of node names) in the mcl output format."""
+    with open(fi, "wt") as f:
+        for cluster in clusters:
+            f.write("\t".join(cluster))
+            f.write("\n")
@@ -21,11 +21,12 @@ def split_dataset(dataset, criterion, fold):
     """
 
     cname = "cvset_{}".format(criterion)
-    cv = StratifiedKFold(dataset[criterion], fold)
-    for n, (training_set, validation_set) in enumerate(cv):
-        dataset.ix[validation_set, cname] = n
-
-    dataset.loc[pandas.isnull(dataset[criterion]), cname] = np.nan
+    dataset[cname] = np.nan
+    rows = np.flatnonzero(pandas.notnull(dataset[criterion]).values)
+    cv = StratifiedKFold(n_splits=fold)
+    labels = dataset[criterion].values[rows]
+    for n, (training_set, validation_set) in enumerate(cv.split(rows, labels)):
+        dataset.loc[dataset.index[rows[validation_set]], cname] = n
 
     return dataset
 
@@ -2,15 +2,15 @@
 Modules are groups of protein families
 """
 import logging
-import subprocess
 import os
 
 import pandas as pd
 import numpy as np
 import scipy.sparse as sparse
-import scipy.stats as stats
 
 from .pcprofiles import PCProfiles
+from . import mcl
+from . import significance
 
 # import pcprofiles
 
@@ -27,6 +27,8 @@ class Modules(object):
         shared_min=3,
         name=None,
         threads=0,
+        save_network=False,
+        mcl_backend="mcl",
     ):
         """
         Args:
@@ -41,6 +43,8 @@ class Modules(object):
             threshold: (int) Minimal sig value to take into account an edge.
             name: (str) A name to identify the object.
             folder (str): path where to save files to.
+            save_network (bool): save the pc network streamed to MCL.
+            mcl_backend (str): "mcl" (external binary) or "native".
         """
         self.thres = threshold
         self.name = (
@@ -56,7 +60,7 @@ class Modules(object):
         if isinstance(pcp, PCProfiles):
             self.pcs = pcp.pcs.copy()  # same
             self.contigs = pcp.contigs.copy()  # same
-            network = pcp.ntw_modules
+            network = pcp.get_ntw_modules()
             self.matrix: sparse.spmatrix = pcp.matrix
         else:
             logging.debug("Reading input from tuple")
@@ -83,7 +87,12 @@ class Modules(object):
         # Define the modules, runs MCL on PCs -> modules,
         # df w/ annotated_proteins, id, pos, position, size
         self.modules = self.define_modules(
-            self.network, self.folder, self.inflation, threads
+            self.network,
+            self.folder,
+            self.inflation,
+            threads,
+            save_network,
+            mcl_backend,
         )
         # Calls self.matrix, returns matrix w/ proportion of module's PCs in contig
         self.matrix_module = self.module_in_contigs()
@@ -93,16 +102,19 @@ class Modules(object):
             "Modules object {}, {} modules, (contigs, pc) : {}," "sig. threshold {} "
         ).format(self.name, len(self.modules), self.matrix.shape, self.thres)
 
-    def define_modules(self, matrix, folder, I, threads=0):
+    def define_modules(
+        self, matrix, folder, I, threads=0, save_network=False, backend="mcl"
+    ):
         """
-        Save the pc network in a file ready for MCL
-        Run MCL
+        Cluster the pc network with MCL
         Load clusters from the MCL results
 
         Args:
             matrix: (scipy.sparse matrix) network.
             folder: (str) folder.
             I: (float) Inflation for mcl.
+            save_network: (bool) also save the network file.
+            backend: (str) "mcl" (external binary) or "native", see mcl.cluster.
 
         Returns:
             A dataframe containing:
@@ -116,43 +128,31 @@ class Modules(object):
             self.pcs: Add the column "module".
 
         Saved Files:
-            name.ntwk: The pc similarity network.
+            name.ntwk: The pc similarity network (if save_network).
             name_mcl_I.clusters: mcl results.
-            name_mcl_I_modules.pandas: the module dataframe.
-            name_mcl_I_pcs.pandas: the pc dataframe.
+            name_mcl_I_modules.feather: the module dataframe.
+            name_mcl_I_pcs.feather: the pc dataframe.
         """
         basename = "modules"
         fi_in = os.path.join(folder, "{}.ntwk".format(basename))
         fi_out = os.path.join(folder, "{}_mcl_{}.clusters".format(basename, I))
         fi_dataframe = os.path.join(
-            folder, "{}_mcl_{}_modules.pandas".format(basename, I)
+            folder, "{}_mcl_{}_modules.feather".format(basename, I)
         )
-        fi_feat = os.path.join(folder, "{}_mcl_{}_pcs.pandas".format(basename, I))
-
-        # Save for MCL
-        logger.info("Exporting the PC-network for MCL")
-        if not os.path.exists(fi_in):
-            names = self.pcs.set_index("pos")["pc_id"]
-            with open(fi_in, "wt") as f:
-                matrix = sparse.dok_matrix(matrix)
-                for r, c in zip(*matrix.nonzero()):
-                    f.write(
-                        " ".join([str(x) for x in (names[r], names[c], matrix[r, c])])
-                    )
-                    f.write("\n")
-
-            logger.debug(
-                "Saving network in file {0} ({1} lines)".format(fi_in, matrix.getnnz())
-            )
-        else:
-            logger.debug("Network file {} already exist.".format(fi_in))
+        fi_feat = os.path.join(folder, "{}_mcl_{}_pcs.feather".format(basename, I))
 
         # Run MCL
         logger.info("Clustering the PC similarity-network")
+        results = None
         if not os.path.exists(fi_out):
-            subprocess.call(
-                f"mcl {fi_in} -o {fi_out} --abc -I {I} -te {threads}",
-                shell=True,
+            results = mcl.cluster(
+                matrix,
+                self.pcs.set_index("pos")["pc_id"],
+                I,
+                backend=backend,
+                threads=threads,
+                network_fp=fi_in if save_network else None,
+                clusters_fp=fi_out,
             )
             logger.debug("MCL({}) results are saved in {}.".format(I, fi_out))
         else:
@@ -161,41 +161,40 @@ class Modules(object):
         # Read MCL results
         logger.info("Loading the clustering results")
         if not os.path.exists(fi_dataframe) or not os.path.exists(fi_feat):
-            with open(fi_out) as f:
-                clusters = [
-                    x
-                    for x in (line.rstrip("\n").split("\t") for line in f)
-                    if len(x) > 1
-                ]  # Drop singletons
+            if results is None:
+                with open(fi_out) as f:
+                    results = [line.rstrip("\n").split("\t") for line in f]
+            clusters = [x for x in results if len(x) > 1]  # Drop singletons
             nb_modules = len(clusters)
             formatter = "MD_{{:>0{}}}".format(int(round(np.log10(nb_modules)) + 1))
             module_names = [formatter.format(i) for i in range(nb_modules)]  # MD_XXXX
             module_size = [len(i) for i in clusters]
             pos = range(nb_modules)
 
-            proteins = np.zeros(nb_modules)
-            annotated_proteins = np.zeros(nb_modules)
+            # Flat (pc_id, module) assignment of the PCs
+            assignment = pd.Series(
+                np.repeat(np.arange(nb_modules), module_size),
+                index=[n for cluster in clusters for n in cluster],
+                dtype=float,
+            )
 
             self.pcs = self.pcs.reset_index().set_index(
                 "pc_id"
             )  # index = PC_XXXX, index, pos, pc_id, nb_contigs, module
-            self.pcs["module"] = np.nan  # Setting NaN here allows for dropping later
-
-            # print(self.contigs)  # pos, id, proteins
-            # need the new gc.contigs, which = id, index, pos, proteins, pos_cluster, membership (T/F), pos_cluster_mbs
-
-            for i, cluster in enumerate(
-                clusters
-            ):  # Clusters is list-of-list of PCs, with module "groupings"
-                for n in cluster:  # For PC_xxxx in the PC group, i.e. in the module i
-                    self.pcs.loc[n, "module"] = i
-                    proteins[i] += self.pcs.loc[
-                        n, "nb_proteins"
-                    ]  # How many proteins in PC_XXXX?
-                    annotated_proteins[i] += self.pcs.loc[n, "annotated"]
+            # NaN for the PCs in no module, dropped below
+            self.pcs["module"] = assignment.reindex(self.pcs.index).values
 
             self.pcs.dropna(subset=["module"], inplace=True)
 
+            # Number of (annotated) proteins in each module
+            totals = (
+                self.pcs.groupby("module")[["nb_proteins", "annotated"]]
+                .sum()
+                .reindex(np.arange(nb_modules), fill_value=0)
+            )
+            proteins = totals["nb_proteins"].values.astype(float)
+            annotated_proteins = totals["annotated"].values.astype(float)
+
             dataframe = pd.DataFrame(
                 {
                     "id": module_names,
@@ -206,16 +205,16 @@ class Modules(object):
                 }
             )
 
-            dataframe.to_pickle(fi_dataframe)
-            self.pcs.to_pickle(fi_feat)
+            dataframe.to_feather(fi_dataframe)
+            self.pcs.reset_index().to_feather(fi_feat)
             logger.debug(
                 ("Saving {} modules containing {} " " protein clusters in {}.").format(
                     len(module_names), sum(module_size), fi_dataframe
                 )
             )
         else:
-            dataframe = pd.read_pickle(fi_dataframe)
-            self.pcs = pd.read_pickle(fi_feat)
+            dataframe = pd.read_feather(fi_dataframe)
+            self.pcs = pd.read_feather(fi_feat).set_index("pc_id")
             logger.debug(
                 "Read {} modules from {}.".format(len(dataframe), fi_dataframe)
             )
@@ -235,20 +234,26 @@ class Modules(object):
                 present in contig (in [0,1])
         """
 
-        matrix: sparse.csc_matrix = self.matrix.tocsc()
+        matrix = sparse.csr_matrix(self.matrix, dtype=float)
+        pcs = self.pcs.dropna(subset=["module"])
+
+        # Z[pc, module] = pc is in module
+        Z = sparse.csr_matrix(
+            (
+                np.ones(len(pcs)),
+                (pcs["pos"].values.astype(np.int64), pcs["module"].values.astype(np.int64)),
+            ),
+            shape=(matrix.shape[1], len(self.modules)),
+        )
+
         # Number of pcs of module m in each contig.
-        N = sparse.lil_matrix((len(self.contigs), len(self.modules)))
-        for m, data in self.pcs.reset_index().groupby("module"):
-            pos = data["pos"].values
-            N[:, int(m)] = matrix[:, pos].sum(1)
+        N = matrix.dot(Z)
 
-        # Number of pcs in each module
-        # sizes = np.matrix([self.modules.size.values]*N.shape[0])
-        sizes = np.matrix([self.modules["size"].values] * N.shape[0])
-        # Compute
-        S = sparse.csc_matrix(N.todense() / sizes)
+        # Divided by the number of pcs in each module
+        sizes = self.modules["size"].values.astype(float)
+        S = N.dot(sparse.diags(1 / np.where(sizes > 0, sizes, 1)))
 
-        return S
+        return sparse.csc_matrix(S)
 
     def link_modules_and_clusters(
         self,
@@ -272,7 +277,7 @@ class Modules(object):
             own_threshold: minimal proportion of PCs to "own" the module.
 
         Returns:
-            S (scipy.sparse) S[module,cluster] = sig.
+            S (scipy.sparse.csr_matrix) S[cluster,module] = sig.
 
         Formula:
             P(X>=c) ~ H(n,a,b)
@@ -308,33 +313,34 @@ class Modules(object):
         # Phage displaying a given module
         b_values = matrix_module.sum(0).A1
         # contig in cluster
-        xy = (
-            contigs.reset_index(drop=True)
-            .loc[:, ["pos_cluster", "pos"]]
-            .dropna(subset=["pos_cluster"])
-            .sort_values(by="pos")
-            .values
-        )
+        xy = contigs.loc[:, ["pos_cluster", "pos"]].dropna(subset=["pos_cluster"])
         pa_matrix = sparse.coo_matrix(
-            ([1] * len(xy), list(zip(*xy))), shape=(nb_clusters, nb_contigs)
-        )
+            (
+                np.ones(len(xy), dtype=np.int64),
+                (
+                    xy["pos_cluster"].values.astype(np.int64),
+                    xy["pos"].values.astype(np.int64),
+                ),
+            ),
+            shape=(nb_clusters, nb_contigs),
+        ).tocsr()
         # Phage in a given cluster displaying a given module
         c_values: sparse.csr_matrix = pa_matrix.dot(matrix_module)
 
         # Number of comparisons
         logT = np.log10(nb_clusters * nb_modules)
 
-        S = sparse.lil_matrix((nb_clusters, nb_modules))
-        for A, B in zip(*c_values.nonzero()):
-            # choose(a, k) * choose(C - a, b - k) / choose(C, b)
-            # sf(k) = survival function = 1 -cdf(k) = 1 - P(x<k) = P(x>k)
-            # sf(k-1)= P(x>k-1) = P(x>=k)
-            pval = stats.hypergeom.sf(
-                c_values[A, B] - 1, nb_contigs, a_values[A], b_values[B]
-            )
-            sig = np.nan_to_num(-np.log10(pval) - logT)
-            if sig > thres:
-                S[A, B] = min(300, sig)
+        c_values = c_values.tocoo()
+        sigs = significance.pairwise_sig(
+            c_values.data, a_values[c_values.row], b_values[c_values.col], nb_contigs, logT
+        )
+        logger.debug(significance.CACHE)
+
+        keep = sigs > thres
+        S = sparse.coo_matrix(
+            (np.minimum(300, sigs[keep]), (c_values.row[keep], c_values.col[keep])),
+            shape=(nb_clusters, nb_modules),
+        ).tocsr()
 
         logger.info(
             "Network done {0[0]} clusters, {0[1]} modules and {1} edges.".format(
@@ -370,19 +376,15 @@ class Modules(object):
         modules: pd.DataFrame = self.modules
         matrix_module: sparse.csc_matrix = self.matrix_module  # Module is in contig
 
-        matrix = (
-            self.link_modules_and_clusters(
-                clusters, contigs, matrix_module, thres, own_threshold
-            )
-            .todok()
-            .items()
-        )
+        matrix = self.link_modules_and_clusters(
+            clusters, contigs, matrix_module, thres, own_threshold
+        ).tocoo()
         data = (
             pd.DataFrame(
                 {
-                    "pos_module": [x[0][1] for x in matrix],
-                    "pos_cluster": [x[0][0] for x in matrix],
-                    "sig": [x[1] for x in matrix],
+                    "pos_module": matrix.col,
+                    "pos_cluster": matrix.row,
+                    "sig": matrix.data,
                 }
             )
             .merge(modules, left_on="pos_module", right_on="pos", how="left")
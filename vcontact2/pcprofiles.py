@@ -1,23 +1,59 @@
 """ Object containing the pc-profiles of the contigs and able to
     compute the similarity network on the contigs and the pcs. """
 import logging
-import sys
+import os
+import time
+import json
 import pandas as pd
 import numpy as np
-import scipy.stats as stats
 import scipy.sparse as sparse
 import networkx
 import _pickle as pickle
 
 import multiprocessing as mp
-from itertools import zip_longest, chain
-import math
+from multiprocessing import shared_memory
+
+from . import significance
 
 logger = logging.getLogger(__name__)
 
 # Divide by zero for singletons
 np.seterr(divide="ignore")
 
+# Estimated bytes held for each pair of a block of the shared features matrix
+# (product, upper triangle copy and scoring arrays)
+BYTES_PER_PAIR = 48
+# Number of blocks of rows by worker, so that idle workers can take over
+TASKS_BY_WORKER = 16
+
+# Layout of the directory written by PCProfiles.to_store
+STORE_VERSION = 1
+STORE_MATRICES = ("matrix", "singletons", "ntw", "ntw_modules")
+STORE_TABLES = ("contigs", "pcs")
+STORE_PARAMETERS = ("name", "threads", "sig", "sig_mod", "mod_shared_min", "max_memory")
+
+
+class _StoredMatrix(object):
+    """Matrix attribute of PCProfiles. The matrices of an object read from a
+    store (see read_store) are memory-mapped the first time they are
+    accessed. Accessing a matrix that was neither set nor stored raises
+    AttributeError, it is never computed on the way."""
+
+    def __set_name__(self, owner, name):
+        self.name = name
+
+    def __get__(self, obj, owner=None):
+        if obj is None:
+            return self
+        lazy = obj.__dict__.get("_lazy", {})
+        if self.name not in lazy:
+            raise AttributeError(
+                "'{}' object has no attribute '{}'".format(owner.__name__, self.name)
+            )
+        # Cached in the instance, which takes precedence from now on.
+        value = obj.__dict__[self.name] = read_csr(*lazy.pop(self.name))
+        return value
+
 
 class PCProfiles(object):
     """
@@ -31,9 +67,14 @@ class PCProfiles(object):
         profiles (sparse.matrix):
         singletons (sparse.matrix):
         contig_ntw (sparse.matrix):
-        modules_ntw (sparse.matrix):
+        modules_ntw (sparse.matrix): computed by get_ntw_modules.
     """
 
+    matrix = _StoredMatrix()
+    singletons = _StoredMatrix()
+    ntw = _StoredMatrix()
+    ntw_modules = _StoredMatrix()
+
     def __init__(
         self,
         contigs: pd.DataFrame,
@@ -45,6 +86,8 @@ class PCProfiles(object):
         max_sig=300,
         sig_mod=1.0,
         mod_shared_min=3,
+        max_memory=None,
+        references=None,
     ):
         """
         Args:
@@ -59,10 +102,15 @@ class PCProfiles(object):
             sig_mod (float): Sig. threshold in the pc similarity network.
             mod_shared_min (float): Minimal number of contigs a pc must appear into
                 to be taken into account in the modules computing.
+            max_memory (int): Memory budget (bytes) of a block of the shared
+                features matrix. If None, the matrix is computed at once.
+            references (refcache.ReferenceCache): Cached pairs of the
+                reference contigs, None to compute all the pairs.
             name (str): name the object (useful in interactive mode)
         """
         self.name = name or "PCprofiles"
         self.threads = threads
+        self.max_memory = max_memory
 
         # Get the data
         self.contigs = contigs  # pos, id, proteins
@@ -81,13 +129,11 @@ class PCProfiles(object):
             thres=sig,
             max_sig=max_sig,
             threads=self.threads,
+            max_memory=self.max_memory,
+            references=references,
         )
-        self.ntw_modules = self.network_modules(
-            self.matrix,
-            thres=sig_mod,
-            mod_shared_min=mod_shared_min,
-            threads=self.threads,
-        )
+        # The pc network (self.ntw_modules) is only computed when needed, see
+        # get_ntw_modules.
 
     def __repr__(self):
         return (
@@ -110,6 +156,8 @@ class PCProfiles(object):
         thres=1,
         max_sig=1000,
         threads=1,
+        max_memory=None,
+        references=None,
     ):
         """
         Compute the hypergeometric-similarity contig network.
@@ -119,9 +167,14 @@ class PCProfiles(object):
                 M(c,p) == True <-> PC p is in Contig c.
             thres (float): Minimal significativity to store an edge value.
             max_sig (int): Maximum significance score
+            max_memory (int): Memory budget (bytes) of a block of the
+                contigs x contigs shared PCs matrix.
+            references (refcache.ReferenceCache): Cached pairs of reference
+                contigs. If given, only the pairs with a user contig are
+                computed, the reference pairs are rescored from the cache.
 
         Return
-            scipy.sparse: S symmetric lil matrix, contigs x contigs.
+            scipy.sparse: S symmetric csr matrix, contigs x contigs.
             S(c, c) = sig(link)
         """
 
@@ -136,70 +189,24 @@ class PCProfiles(object):
         # = # shared pcs + #singletons
         # Transform into a flat array
         number_of_pc: np.ndarray = (matrix.sum(1) + singletons).A1
-        # Number of common protein clusters between two contigs, tuple + commons
-        commons_pc: sparse.csr_matrix = matrix.dot(
-            sparse.csr_matrix(matrix.transpose(), dtype=int)
-        )
-        total_c = float(commons_pc.getnnz())
-
-        S = sparse.lil_matrix((contigs_n, contigs_n))
 
-        if threads == 1:
-            i = 0  # Display
-            for A, B in zip(*commons_pc.nonzero()):  # For A & B sharing contigs
-                if A < B:
-                    # choose(a, k) * choose(C - a, b - k) / choose(C, b)
-                    # sf(k) = survival function = 1 - cdf(k) = 1 - P(x<k) = P(x>k)
-                    # sf(k-1) = P(x>k-1) = P(x>=k)
-                    # It is symmetric but I put the smallest before to avoid numerical bias.
-                    a, b = sorted([number_of_pc[A], number_of_pc[B]])
-                    pval: float = stats.hypergeom.sf(commons_pc[A, B] - 1, pcs_n, a, b)
-                    sig = np.nan_to_num(-np.log10(pval) - logT)
-                    if sig > thres:
-                        S[A, B] = min(max_sig, sig)
-                    # Display
-                    i += 1
-                    if i % 1000 == 0:
-                        sys.stdout.write(".")
-                    if i % 10000 == 0:
-                        sys.stdout.write(
-                            "{:6.2%} {}/{}\n".format(i / total_c, i, total_c)
-                        )
+        # Number of common protein clusters between two contigs, by blocks of contigs
+        if references is None:
+            edges = self.hypergeom_blocks(
+                matrix, number_of_pc, pcs_n, logT, thres, threads, max_memory
+            )
         else:
-            pool = mp.Pool(processes=threads)
-
-            results = []
-            # https://stackoverflow.com/questions/26104512/how-to-obtain-the-results-from-a-pool-of-threads-in-python
-            commons_contigs = [(a, b) for (a, b) in zip(*commons_pc.nonzero()) if a < b]
-            sys.stdout.write("-" * (len(commons_contigs) // 10000) + "\n")
-
-            for partition in self.grouper(
-                commons_contigs, math.ceil(len(commons_contigs) / threads)
-            ):
-                non_null_part = [
-                    item for item in partition if item
-                ]  # Remove None from grouper
-                results.append(
-                    pool.apply_async(
-                        self.hypergeom,
-                        args=(
-                            number_of_pc,
-                            commons_pc,
-                            pcs_n,
-                            logT,
-                            thres,
-                            non_null_part,
-                        ),
-                    )
-                )
-
-            pool.close()
-            pool.join()
-
-            final_results = list(chain.from_iterable([r.get() for r in results]))
-
-            for A, B, sig in final_results:
-                S[A, B] = min(max_sig, sig)
+            edges = self.reference_blocks(
+                matrix,
+                number_of_pc,
+                pcs_n,
+                logT,
+                thres,
+                references,
+                threads,
+                max_memory,
+            )
+        S = assemble_network(edges, contigs_n, max_sig)
 
         S_at: sparse.csr_matrix = (S + S.T).tocsr()  # Symmetry
         if len(S_at.data) != 0:
@@ -214,7 +221,7 @@ class PCProfiles(object):
         return S_at
 
     def network_modules(
-        self, matrix=None, thres=1, mod_shared_min=3, threads=1
+        self, matrix=None, thres=1, mod_shared_min=3, threads=1, max_memory=None
     ) -> sparse.csr_matrix:
         """
         Compute the hypergeometric-similarity pc network.
@@ -228,9 +235,11 @@ class PCProfiles(object):
             thres (float): Minimal significativity to store an edge value.
             mod_shared_min (float): Minimal number of contigs a pc must appear into
                 to be taken into account in the modules computing.
+            max_memory (int): Memory budget (bytes) of a block of the
+                pcs x pcs shared contigs matrix.
 
         Returns:
-            scipy.sparse: Symmetric lil_matrix, PCs x PCs
+            scipy.sparse: Symmetric csr_matrix, PCs x PCs
                 S(c,c) = sig(link)
         """
 
@@ -253,83 +262,175 @@ class PCProfiles(object):
 
         # Filtering the matrix to only include pcs with >= 3 contigs
         matrix = matrix[:, pos_pcs_in_modules]
+        number_of_contigs = number_of_contigs[pos_pcs_in_modules]
 
         # Number of comparisons
         T = 0.5 * pcs_in_modules * (pcs_in_modules - 1)
         logT = np.log10(T)
 
-        # Number of common contigs between two pcs
-        commons_contigs = sparse.csr_matrix(matrix, dtype=int).transpose().dot(matrix)
+        # Number of common contigs between two pcs, by blocks of pcs
+        S = assemble_network(
+            self.hypergeom_blocks(
+                sparse.csr_matrix(matrix.transpose()),
+                number_of_contigs,
+                contigs,
+                logT,
+                thres,
+                threads,
+                max_memory,
+            ),
+            pcs_in_modules,
+            300,
+        )
 
-        # Initiate empty matrix
-        S = sparse.lil_matrix((pcs_in_modules, pcs_in_modules))
+        logger.debug(
+            "Hypergeometric PCs-similarity network : {0} pcs, {1} edges".format(
+                pcs_in_modules, S.getnnz()
+            )
+        )
 
-        total_c = float(commons_contigs.getnnz())
+        return (S + S.T).tocsr()
 
-        if threads == 1:
-            i = 0
-            for A, B in zip(*commons_contigs.nonzero()):
-                if A < B:
-                    # choose(a, k) * choose(C - a, b - k) / choose(C, b)
-                    # sf(k) = survival function = 1 -cdf(k) = 1 - P(x<k) = P(x>k)
-                    # sf(k-1)= P(x>k-1) = P(x>=k)
-                    # It is symmetric but I put the smallest before to avoid numerical biases.
-
-                    a, b = sorted([number_of_contigs[A], number_of_contigs[B]])
-                    pval = stats.hypergeom.sf(commons_contigs[A, B] - 1, contigs, a, b)
-                    sig = np.nan_to_num(-np.log10(pval) - logT)
-
-                    if sig > thres:
-                        S[A, B] = min(300, sig)
-
-                    i += 1
-                    if i % 1000 == 0:
-                        sys.stdout.write(".")
-                    if i % 10000 == 0:
-                        sys.stdout.write(
-                            "{:6.2%} {}/{}\n".format(i / total_c, i, total_c)
-                        )
-        else:
-            pool = mp.Pool(processes=threads)
+    def hypergeom_blocks(
+        self, profiles, sizes, total, logT, thres, threads=1, max_memory=None, rows=None
+    ):
+        """
+        Score the pairs of rows of a profile matrix sharing features, block
+        of rows by block of rows.
 
-            results = []
+        With threads > 1, the CSR arrays of the profiles and the sizes are
+        placed in shared memory once, and each worker computes and scores
+        its own blocks of rows.
 
-            commons_modules = [
-                (a, b) for (a, b) in zip(*commons_contigs.nonzero()) if a < b
-            ]
-            sys.stdout.write("-" * (len(commons_modules) // 10000) + "\n")
+        Args:
+            profiles (scipy.sparse): objects x features, bool.
+            sizes (numpy.ndarray): Number of features of each object
+            total (int): Total number of features
+            logT (float): Log transform of total comparisons
+            thres (float): Minimum significance score to be retained
+            threads (int): Number of CPUs
+            max_memory (int): Memory budget (bytes) of the blocks held at
+                the same time.
+            rows (int): Only score the pairs with a member in the first rows
+                (all if None).
+
+        Yields:
+            tuple: A, B and sig of the pairs (A < B) passing threshold,
+                one tuple by block.
+        """
+        profiles = sparse.csr_matrix(profiles, dtype=np.int32)
 
-            for partition in self.grouper(
-                commons_modules, math.ceil(commons_contigs.shape[0] / threads)
+        if threads == 1:
+            table = significance.ThresholdTable(sizes, total, logT, thres)
+            for start, end in row_blocks(profiles, max_memory, rows=rows):
+                yield hypergeom_rows(
+                    profiles, sizes, table, total, logT, thres, start, end
+                )[:3]
+
+            logger.debug(table)
+            logger.debug(significance.CACHE)
+            return
+
+        # Many small tasks of similar cost, taken by the workers as they
+        # become idle. Each worker holds a block at the same time.
+        blocks = row_blocks(
+            profiles,
+            None if max_memory is None else max_memory // threads,
+            min_blocks=threads * TASKS_BY_WORKER,
+            rows=rows,
+        )
+        arrays = SharedArrays(
+            data=profiles.data,
+            indices=profiles.indices,
+            indptr=profiles.indptr,
+            sizes=np.asarray(sizes),
+        )
+        pool = mp.Pool(
+            processes=threads,
+            initializer=_init_worker,
+            initargs=(arrays.specs, profiles.shape, total, logT, thres),
+        )
+        workers: dict[int, list] = {}
+        try:
+            for A, B, sig, (pid, task_rows, pairs, seconds, cache) in pool.imap_unordered(
+                _hypergeom_rows_worker, blocks, chunksize=1
             ):
-                non_null_part = [item for item in partition if item]
-                results.append(
-                    pool.apply_async(
-                        self.hypergeom,
-                        args=(
-                            number_of_contigs,
-                            commons_contigs,
-                            contigs,
-                            logT,
-                            thres,
-                            non_null_part,
-                        ),
-                    )
-                )
-
+                stats = workers.setdefault(pid, [0, 0, 0, 0.0, (0, 0)])
+                stats[0] += 1
+                stats[1] += task_rows
+                stats[2] += pairs
+                stats[3] += seconds
+                # The counters of the worker cache are cumulative
+                stats[4] = cache
+                yield A, B, sig
+        finally:
             pool.close()
             pool.join()
+            arrays.close()
+
+        for pid, (tasks, task_rows, pairs, seconds, cache) in sorted(workers.items()):
+            logger.debug(
+                "Worker {}: {} tasks, {} rows, {} pairs in {:.1f}s ({:.0f} pairs/s), "
+                "significance cache: {} hits, {} misses".format(
+                    pid, tasks, task_rows, pairs, seconds, pairs / seconds if seconds else 0, *cache
+                )
+            )
 
-            for A, B, sig in chain.from_iterable((r.get() for r in results)):
-                S[A, B] = min(300, sig)
+    def reference_blocks(
+        self, matrix, sizes, total, logT, thres, references, threads=1, max_memory=None
+    ):
+        """
+        Score the pairs of contigs sharing PCs, the pairs of references
+        being read from a cache.
 
+        The user contigs are moved to the first rows so that the blocks of
+        rows cover the user-user and user-reference pairs only.
+
+        Args:
+            matrix (scipy.sparse): contigs x PCs, bool.
+            sizes (numpy.ndarray): Number of PCs of each contig
+            total (int): Total number of PCs
+            logT (float): Log transform of total comparisons
+            thres (float): Minimum significance score to be retained
+            references (refcache.ReferenceCache): Cached reference pairs.
+            threads (int): Number of CPUs
+            max_memory (int): Memory budget (bytes) of the blocks held at
+                the same time.
+
+        Yields:
+            tuple: A, B and sig of the pairs (A < B) passing threshold.
+        """
+        contig_ids = self.contigs.sort_values("pos")["contig_id"].values
+        A, B, shared = references.pairs(matrix, contig_ids, max_memory)
+
+        # Rescore the cached pairs with the totals of this run.
+        sig = significance.pairwise_sig(shared, sizes[A], sizes[B], total, logT)
+        keep = sig > thres
         logger.debug(
-            "Hypergeometric PCs-similarity network : {0} pcs, {1} edges".format(
-                pcs_in_modules, S.getnnz()
+            "{} of {} cached reference pairs pass the threshold".format(
+                keep.sum(), len(keep)
             )
         )
+        yield A[keep], B[keep], sig[keep]
 
-        return S + S.T
+        positions = references.positions(contig_ids)
+        is_reference = np.zeros(matrix.shape[0], dtype=bool)
+        is_reference[positions[positions >= 0]] = True
+        order = np.concatenate(
+            [np.flatnonzero(~is_reference), np.flatnonzero(is_reference)]
+        )
+        for A, B, sig in self.hypergeom_blocks(
+            sparse.csr_matrix(matrix)[order],
+            sizes[order],
+            total,
+            logT,
+            thres,
+            threads,
+            max_memory,
+            rows=(~is_reference).sum(),
+        ):
+            A, B = order[A], order[B]
+            yield np.minimum(A, B), np.maximum(A, B), sig
 
     def nodes_properties(self, matrix):
         """Compute several node specific statistics.
@@ -355,52 +456,30 @@ class PCProfiles(object):
         df = pd.concat([bc, degr, clcoef], axis=1)
         self.contigs = pd.merge(self.contigs, df, left_on="pos", right_index=True)
 
-    def hypergeom(
-        self, num_pcs, common_pcs, total_pcs, total_comparisons, thres, shard
-    ):
-        """
-        Multithreader helper function
-
-        Args:
-            num_pcs (numpy.ndarray):
-            common_pcs (scipy.sparse.csr.csr_matrix): Number of common protein clusters between two contigs
-            total_pcs (int): Total PCs
-            total_comparisons (float): Log transform of total comparisons between contigs x contigs
-            thres (float): Minimum significance score to be retained
-            max_thres (float): Maximum significance score allowed
-            shard (list): List of contig x contig tuples of contig positions to be evaluated
+    def get_ntw_modules(self):
+        """The pc similarity network, computed with the parameters of the
+        object (see network_modules) the first time it is needed.
 
         Returns:
-            list: contig contig significance scores passing threshold
+            scipy.sparse: self.ntw_modules.
         """
-        results = []
-        i = j = 0
-
-        for A, B in shard:
-            if A < B:
-                a, b = sorted([num_pcs[A], num_pcs[B]])
-                pval = stats.hypergeom.sf(common_pcs[A, B] - 1, total_pcs, a, b)
-                sig = np.nan_to_num(-np.log10(pval) - total_comparisons)
-
-                if sig > thres:
-                    results.append([A, B, sig])
-                    i += 1
-                    # if i % 10000 == 0:
-                    #     sys.stdout.write(".")
-                else:
-                    j += 1
-                    # if i % 10000 == 0:
-                    #     sys.stdout.write(" ")
-
-        # sys.stdout.write("!")
-        # sys.stdout.flush()
-        return results
-
-    def grouper(self, iterable, n, fillvalue=None):
-        "Collect data into fixed-length chunks or blocks"
-        # grouper('ABCDEFG', 3, 'x') --> ABC DEF Gxx"
-        args = [iter(iterable)] * n
-        return zip_longest(*args, fillvalue=fillvalue)
+        try:
+            return self.ntw_modules
+        except AttributeError:
+            pass
+        self.ntw_modules = self.network_modules(
+            self.matrix,
+            thres=self.sig_mod,
+            mod_shared_min=self.mod_shared_min,
+            threads=self.threads,
+            # Objects pickled before the memory budget have no max_memory.
+            max_memory=getattr(self, "max_memory", None),
+        )
+        # Saved along the other matrices, so that the next runs on the same
+        # store read it instead of computing it again.
+        if "_store" in self.__dict__:
+            self.add_to_store("ntw_modules")
+        return self.ntw_modules
 
     def to_pickle(self, path=None):
         """Pickle (serialize) object to file path."""
@@ -408,6 +487,55 @@ class PCProfiles(object):
         with open(path, "wb") as f:
             pickle.dump(self, f)
 
+    def to_store(self, path=None):
+        """Save the object in a directory (see read_store).
+
+        The arrays of the sparse matrices are saved as .npy files, the
+        contigs and pcs tables in the columnar feather format, and the
+        whole is described by a manifest.json file.
+        """
+        path = self.name + ".pcp" if path is None else path
+        os.makedirs(path, exist_ok=True)
+
+        manifest: dict = {
+            "version": STORE_VERSION,
+            "parameters": {key: getattr(self, key, None) for key in STORE_PARAMETERS},
+            "matrices": {},
+            "tables": {},
+        }
+        for name in STORE_MATRICES:
+            # Skip the pc network if it was never computed.
+            if name in self.__dict__ or name in self.__dict__.get("_lazy", {}):
+                manifest["matrices"][name] = write_csr(getattr(self, name), path, name)
+
+        for name in STORE_TABLES:
+            df: pd.DataFrame = getattr(self, name)
+            index = [x for x in df.index.names if x is not None]
+            df.reset_index(drop=not index).to_feather(
+                os.path.join(path, "{}.feather".format(name))
+            )
+            manifest["tables"][name] = {"index": index}
+
+        with open(os.path.join(path, "manifest.json"), "w") as f:
+            json.dump(manifest, f, indent=2)
+        self._store = path
+        logger.debug("PC-profiles saved in {}".format(path))
+
+    def add_to_store(self, name):
+        """Save a matrix computed after the object was saved (or read) in a
+        store, and add it to the manifest of the store.
+
+        Args:
+            name (str): One of STORE_MATRICES.
+        """
+        manifest_fp = os.path.join(self._store, "manifest.json")
+        with open(manifest_fp) as f:
+            manifest = json.load(f)
+        manifest["matrices"][name] = write_csr(getattr(self, name), self._store, name)
+        with open(manifest_fp, "w") as f:
+            json.dump(manifest, f, indent=2)
+        logger.debug("{} added to the PC-profiles in {}".format(name, self._store))
+
 
 def build_pc_matrices(profiles: pd.DataFrame, contigs: pd.DataFrame, pcs: pd.DataFrame):
     """
@@ -477,6 +605,269 @@ def build_pc_matrices(profiles: pd.DataFrame, contigs: pd.DataFrame, pcs: pd.Dat
     return matrix.tocsr(), singletons.tocsr()
 
 
+def row_blocks(matrix: sparse.csr_matrix, max_memory=None, min_blocks=1, rows=None):
+    """
+    Cut the rows of a profile matrix into blocks whose share of the
+    matrix . matrix.T product fits in a memory budget.
+
+    Args:
+        matrix (scipy.sparse): objects x features.
+        max_memory (int): Memory budget (bytes) of a block.
+        min_blocks (int): Minimal number of blocks, of similar cost.
+        rows (int): Only cut the first rows (all if None).
+
+    Returns:
+        list: (start, end) of each block of rows.
+    """
+    n = matrix.shape[0]
+    rows = n if rows is None else rows
+    if (max_memory is None and min_blocks == 1) or rows == 0:
+        return [(0, rows)] if rows else []
+
+    # Number of co-occurrences of each row with the later rows: cost of
+    # its share of the upper triangle and upper bound of its pairs.
+    csc = sparse.csc_matrix(matrix)
+    csc.sort_indices()
+    objects_by_feature = np.diff(csc.indptr)
+    rank = np.arange(csc.nnz) - np.repeat(csc.indptr[:-1], objects_by_feature)
+    later = np.repeat(objects_by_feature, objects_by_feature) - 1 - rank
+    nnz = np.minimum(
+        np.bincount(csc.indices, weights=later, minlength=n), n - 1 - np.arange(n)
+    )
+    cost = np.cumsum(nnz[:rows] * BYTES_PER_PAIR)
+
+    budget = cost[-1] / min_blocks
+    if max_memory is not None:
+        budget = min(budget, max_memory)
+
+    blocks = []
+    start = 0
+    while start < rows:
+        spent = cost[start - 1] if start else 0
+        end = max(int(np.searchsorted(cost, spent + budget, side="right")), start + 1)
+        blocks.append((start, end))
+        start = end
+
+    logger.debug(
+        "{} blocks of rows of at most {:.1f} MB".format(len(blocks), budget / 1024**2)
+    )
+    return blocks
+
+
+def shared_features(matrix: sparse.csr_matrix, start, end):
+    """
+    Number of features shared by the pairs of rows of a profile matrix:
+    upper triangle of matrix . matrix.T, for the rows start to end.
+
+    Args:
+        matrix (scipy.sparse): objects x features.
+        start (int): First row of the block.
+        end (int): Last row (excluded) of the block.
+
+    Returns:
+        tuple: A, B and shared of the pairs (A < B) sharing features.
+    """
+    # Only the columns >= start are in the upper triangle of the block.
+    block = matrix[start:end].dot(matrix[start:].transpose()).tocoo()
+    upper = block.col > block.row
+    return block.row[upper] + start, block.col[upper] + start, block.data[upper]
+
+
+def hypergeom_rows(matrix, sizes, table, total, logT, thres, start, end):
+    """
+    Score the pairs sharing features of a block of rows.
+
+    Args:
+        matrix (scipy.sparse): objects x features.
+        sizes (numpy.ndarray): Number of features of each object
+        table (significance.ThresholdTable): Minimal shared features
+        total (int): Total number of features
+        logT (float): Log transform of total comparisons
+        thres (float): Minimum significance score to be retained
+        start (int): First row of the block.
+        end (int): Last row (excluded) of the block.
+
+    Returns:
+        tuple: A, B and sig of the pairs (A < B) passing threshold, and the
+            number of pairs sharing features.
+    """
+    A, B, shared = shared_features(matrix, start, end)
+    pairs = len(A)
+
+    # Drop the pairs that share too few features to reach the threshold.
+    keep = table.passes(shared, sizes[A], sizes[B])
+    logger.debug(
+        "Rows {}-{}: {} of {} pairs share enough features to reach the threshold".format(
+            start, end, keep.sum(), len(keep)
+        )
+    )
+    A, B, shared = A[keep], B[keep], shared[keep]
+
+    sig = significance.pairwise_sig(shared, sizes[A], sizes[B], total, logT)
+    keep = sig > thres
+    return A[keep], B[keep], sig[keep], pairs
+
+
+def assemble_network(edges, n, max_sig):
+    """
+    Build the upper triangle of a similarity network from chunks of edges.
+
+    Args:
+        edges (iterable): (A, B, sig) arrays of each chunk, A < B.
+        n (int): Number of nodes.
+        max_sig (float): Maximum significance score.
+
+    Returns:
+        scipy.sparse.csr_matrix: S, S[A, B] = min(max_sig, sig), A < B.
+    """
+    rows, cols, weights = [], [], []
+    for A, B, sig in edges:
+        rows.append(A.astype(np.int32))
+        cols.append(B.astype(np.int32))
+        weights.append(np.minimum(max_sig, sig))
+
+    if not rows:
+        return sparse.csr_matrix((n, n))
+
+    return sparse.coo_matrix(
+        (np.concatenate(weights), (np.concatenate(rows), np.concatenate(cols))),
+        shape=(n, n),
+    ).tocsr()
+
+
+class SharedArrays(object):
+    """
+    Numpy arrays copied once in shared memory, for the workers to attach.
+
+    Attributes:
+        specs (dict): name -> (shared memory name, shape, dtype) of each array.
+    """
+
+    def __init__(self, **arrays):
+        self.blocks = {}
+        self.specs = {}
+        for name, array in arrays.items():
+            array = np.ascontiguousarray(array)
+            block = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+            np.ndarray(array.shape, array.dtype, buffer=block.buf)[:] = array
+            self.blocks[name] = block
+            self.specs[name] = (block.name, array.shape, array.dtype.str)
+
+    def close(self):
+        """Release the shared memory."""
+        for block in self.blocks.values():
+            block.close()
+            block.unlink()
+        self.blocks = {}
+
+
+def attach_arrays(specs):
+    """
+    Attach the arrays of a SharedArrays object from another process.
+
+    Returns:
+        tuple: dict of the arrays and list of the shared memory blocks
+            (to keep alive as long as the arrays are used).
+    """
+    blocks = []
+    arrays = {}
+    for name, (block_name, shape, dtype) in specs.items():
+        block = shared_memory.SharedMemory(name=block_name)
+        blocks.append(block)
+        arrays[name] = np.ndarray(shape, dtype, buffer=block.buf)
+    return arrays, blocks
+
+
+# State of a worker of hypergeom_blocks, set once by _init_worker.
+_worker: dict = {}
+
+
+def _init_worker(specs, shape, total, logT, thres):
+    arrays, blocks = attach_arrays(specs)
+    _worker["blocks"] = blocks
+    _worker["matrix"] = sparse.csr_matrix(
+        (arrays["data"], arrays["indices"], arrays["indptr"]), shape=shape, copy=False
+    )
+    _worker["sizes"] = arrays["sizes"]
+    _worker["table"] = significance.ThresholdTable(arrays["sizes"], total, logT, thres)
+    _worker["params"] = (total, logT, thres)
+    # Each worker fills its own significance cache (a forked worker starts
+    # with the entries of the parent), only its own hits are counted.
+    significance.CACHE.hits = significance.CACHE.misses = 0
+
+
+def _hypergeom_rows_worker(block):
+    """
+    Multithreader helper function: score a block of rows from the shared
+    profiles and return its compact edge arrays, with the worker pid, the
+    number of rows and pairs, the time spent and the hits and misses of the
+    worker significance cache so far (for throughput reports).
+    """
+    start, end = block
+    tic = time.perf_counter()
+    A, B, sig, pairs = hypergeom_rows(
+        _worker["matrix"], _worker["sizes"], _worker["table"], *_worker["params"], start, end
+    )
+    cache = (significance.CACHE.hits, significance.CACHE.misses)
+    return A, B, sig, (os.getpid(), end - start, pairs, time.perf_counter() - tic, cache)
+
+
+def write_csr(matrix: sparse.spmatrix, path, name):
+    """Save the arrays of a sparse matrix as <name>.<array>.npy files.
+
+    Returns:
+        dict: shape and format of the matrix, for the manifest.
+    """
+    matrix = sparse.csr_matrix(matrix)
+    for array in ("data", "indices", "indptr"):
+        np.save(os.path.join(path, "{}.{}.npy".format(name, array)), getattr(matrix, array))
+    return {"shape": list(matrix.shape), "format": "csr"}
+
+
+def read_csr(path, name, shape):
+    """Load a sparse matrix saved by write_csr, its arrays being memory-mapped.
+
+    The arrays are mapped copy-on-write: the in-place operations of scipy
+    (sort_indices, sum_duplicates, eliminate_zeros...) work on private
+    copies of the pages they modify, and the files are never written.
+    """
+    data, indices, indptr = (
+        np.load(os.path.join(path, "{}.{}.npy".format(name, array)), mmap_mode="c")
+        for array in ("data", "indices", "indptr")
+    )
+    return sparse.csr_matrix((data, indices, indptr), shape=tuple(shape), copy=False)
+
+
+def read_store(path):
+    """Read an object saved with PCProfiles.to_store.
+
+    The tables are read at once, the matrices (matrix, singletons, ntw,
+    ntw_modules) are memory-mapped when they are first accessed. If the pc
+    network was not saved, get_ntw_modules computes it and adds it to the
+    store.
+    """
+    with open(os.path.join(path, "manifest.json")) as f:
+        manifest = json.load(f)
+    if manifest["version"] != STORE_VERSION:
+        raise ValueError(
+            "Unsupported PC-profiles store version {} in {}".format(manifest["version"], path)
+        )
+
+    pcp = PCProfiles.__new__(PCProfiles)
+    pcp.__dict__.update(manifest["parameters"])
+    for name, table in manifest["tables"].items():
+        df = pd.read_feather(os.path.join(path, "{}.feather".format(name)))
+        setattr(pcp, name, df.set_index(table["index"]) if table["index"] else df)
+    pcp._lazy = {
+        name: (path, name, matrix["shape"])
+        for name, matrix in manifest["matrices"].items()
+    }
+    pcp._store = path
+
+    logger.debug("PC-profiles read from {}".format(path))
+    return pcp
+
+
 def read_pickle(path):
     """Read pickled object in file path."""
     with open(path, "rb") as fh:
@@ -1,12 +1,16 @@
 """Protein_clusters.py"""
 
 import os
+import csv
 import gzip
 from Bio import SeqIO
 import pandas as pd
 import logging
 import subprocess
 import numpy as np
+import scipy.sparse as sparse
+
+from . import mcl
 
 logger = logging.getLogger(__name__)
 
@@ -126,44 +130,118 @@ def run_diamond(aa_fp, db_fp, cpu: int, evalue: float, alignments: int, diamond_
     return diamond_out_fn
 
 
-def make_protein_clusters_mcl(blast_fp, out_p, inflation=2, threads=0):
+def blast_edges(blast_fp, chunk_size=1000000):
+    """
+    Stream the hits of a blast (tabular) results file as abc lines
+    (query, hit, evalue), the self-hits being dropped.
+
+    Args:
+        blast_fp (str): Path to blast results file
+        chunk_size (int): Number of hits read at once
+    Yields:
+        str: chunks of lines
+    """
+    for hits in pd.read_csv(
+        blast_fp, sep="\t", header=None, usecols=[0, 1, 10], dtype=str, chunksize=chunk_size
+    ):
+        hits = hits[hits[0] != hits[1]]
+        yield hits.to_csv(sep=" ", header=False, index=False, quoting=csv.QUOTE_NONE)
+
+
+def blast_network(blast_fp, max_weight=200, chunk_size=1000000):
+    """
+    Build the protein similarity network of a blast (tabular) results file,
+    for the native backend: the weight of a hit is -log10(evalue), capped at
+    max_weight (mcxload --stream-neg-log10 -stream-tf 'ceil(200)'), and the
+    network is made symmetric (--stream-mirror) with the heaviest of the two
+    directions.
+
+    Args:
+        blast_fp (str): Path to blast results file
+        max_weight (float): Maximal weight of an edge
+        chunk_size (int): Number of hits read at once
+    Returns:
+        tuple: network (scipy.sparse.csr_matrix) and name of the proteins
+            (pandas.Series indexed by their position in the network)
+    """
+    queries, hits, weights = [], [], []
+    for chunk in pd.read_csv(
+        blast_fp, sep="\t", header=None, usecols=[0, 1, 10], chunksize=chunk_size
+    ):
+        chunk = chunk[chunk[0] != chunk[1]]
+        queries.append(chunk[0].astype(str).values)
+        hits.append(chunk[1].astype(str).values)
+        with np.errstate(divide="ignore"):
+            weights.append(np.minimum(-np.log10(chunk[10].values.astype(float)), max_weight))
+
+    codes, names = pd.factorize(np.concatenate(queries + hits))
+    n_hits = len(codes) // 2
+
+    # Heaviest of the duplicated hits, then of the two directions
+    edges = (
+        pd.DataFrame(
+            {"query": codes[:n_hits], "hit": codes[n_hits:], "weight": np.concatenate(weights)}
+        )
+        .groupby(["query", "hit"])["weight"]
+        .max()
+        .reset_index()
+    )
+    network = sparse.csr_matrix(
+        (edges["weight"].values, (edges["query"].values, edges["hit"].values)),
+        shape=(len(names), len(names)),
+    )
+    network = network.maximum(network.transpose().tocsr())
+    network.eliminate_zeros()
+    return network, pd.Series(names)
+
+
+def make_protein_clusters_mcl(
+    blast_fp, out_p, inflation=2, threads=0, save_network=False, backend="mcl"
+):
     """
     Args:
         blast_fp (str): Path to blast results file
         inflation (float): MCL inflation value
         out_p (str): Output directory path
+        threads (int): Number of threads of mcl
+        save_network (bool): Also save the abc file streamed to mcl
+        backend (str): "mcl" (external binary) or "native", see mcl.cluster
     Returns:
         str: fp for MCL clustering file
     """
 
-    logger.debug("Generating abc file...")
-
     blast_fn = os.path.basename(blast_fp)
     abc_fn = "{}.abc".format(blast_fn)
     abc_fp = os.path.join(out_p, abc_fn)
-    # query, hit, evalue
-    subprocess.check_call(
-        f"awk '$1!=$2 {{print $1,$2,$11}}' {blast_fp} > {abc_fp}", shell=True
-    )
-
-    logger.debug("Running MCL...")
-
-    mci_fn = "{}.mci".format(blast_fn)
-    mci_fp = os.path.join(out_p, mci_fn)
-    mcxload_fn = "{}_mcxload.tab".format(blast_fn)
-    mcxload_fp = os.path.join(out_p, mcxload_fn)
-    subprocess.check_call(
-        "mcxload -abc {0} --stream-mirror --stream-neg-log10 -stream-tf 'ceil(200)' -o {1}"
-        " -write-tab {2}".format(abc_fp, mci_fp, mcxload_fp),
-        shell=True,
-    )
 
     mcl_clstr_fn = "{0}_mcl{1}.clusters".format(blast_fn, int(inflation * 10))
     mcl_clstr_fp = os.path.join(out_p, mcl_clstr_fn)
 
-    subprocess.check_call(
-        f"mcl {mci_fp} -I {inflation} -use-tab {mcxload_fp} -o {mcl_clstr_fp} -te {threads}",
-        shell=True,
+    logger.debug("Running MCL...")
+
+    if backend == "native":
+        if save_network:
+            with open(abc_fp, "wt") as f:
+                f.writelines(blast_edges(blast_fp))
+        network, names = blast_network(blast_fp)
+        mcl.run_native(
+            network, names, inflation, threads=max(1, threads), clusters_fp=mcl_clstr_fp
+        )
+        return mcl_clstr_fp
+
+    # query, hit, evalue streamed to mcxload, which mirrors the edges and
+    # takes the -log10 of the evalues, capped at 200.
+    mci_fp = os.path.join(out_p, "{}.mci".format(blast_fn))
+    mcxload_fp = os.path.join(out_p, "{}_mcxload.tab".format(blast_fn))
+    mcl.run_mcxload(
+        blast_edges(blast_fp),
+        mci_fp,
+        mcxload_fp,
+        options=["--stream-mirror", "--stream-neg-log10", "-stream-tf", "ceil(200)"],
+        network_fp=abc_fp if save_network else None,
+    )
+    mcl.run_mcl_matrix(
+        mci_fp, mcxload_fp, inflation, threads=threads, clusters_fp=mcl_clstr_fp
     )
 
     return mcl_clstr_fp
@@ -0,0 +1,195 @@
+""" Shared-PC counts of the reference genome pairs, cached across runs.
+
+The reference genomes of a --db release are the same in every run: as long as
+the protein clustering leaves their PC profiles unchanged, the number of PCs
+shared by two references does not change either. Only the total number of PCs
+and the number of comparisons (logT) move with the user genomes, so the cached
+pairs are rescored with array arithmetic instead of being recomputed.
+"""
+import hashlib
+import logging
+import os
+
+import numpy as np
+import pandas as pd
+import scipy.sparse as sparse
+
+from .pcprofiles import row_blocks, shared_features
+
+logger = logging.getLogger(__name__)
+
+CACHE_VERSION = 1
+
+
+class ReferenceCache(object):
+    """
+    Pairs of references sharing PCs, for a fixed PC assignment.
+
+    The cache is saved as a .npz file and is only used if the digest of the
+    reference profiles of the current run matches the stored one; otherwise
+    it is recomputed and overwritten.
+
+    Attributes:
+        path (str): .npz file of the cache.
+        contig_ids (numpy.ndarray): Ids of the reference contigs (sorted).
+        digest (str): Digest of the reference profiles, see profiles_digest.
+        A, B (numpy.ndarray): Pairs (A < B) of references sharing PCs,
+            positions in contig_ids.
+        shared (numpy.ndarray): Number of PCs shared by each pair.
+    """
+
+    def __init__(self, path, contig_ids):
+        """
+        Args:
+            path (str): .npz file of the cache (created if missing).
+            contig_ids (iterable): Ids of the reference contigs.
+        """
+        self.path = path
+        self.contig_ids = np.unique(np.asarray(contig_ids, dtype=str))
+        self.digest = None
+        self.A = self.B = self.shared = None
+
+    def __repr__(self):
+        return "ReferenceCache {} ({} references, {})".format(
+            self.path,
+            len(self.contig_ids),
+            "not loaded" if self.shared is None else "{} pairs".format(len(self.shared)),
+        )
+
+    def positions(self, contig_ids):
+        """Rows of the references in a matrix whose rows are contig_ids.
+
+        Returns:
+            numpy.ndarray: Position of each reference, -1 if absent.
+        """
+        return pd.Index(np.asarray(contig_ids, dtype=str)).get_indexer(self.contig_ids)
+
+    def pairs(self, matrix, contig_ids, max_memory=None):
+        """
+        Reference pairs sharing PCs in a profile matrix, from the cache if it
+        matches the reference profiles, else computed and saved.
+
+        Args:
+            matrix (scipy.sparse): contigs x PCs.
+            contig_ids (iterable): Id of each row of the matrix.
+            max_memory (int): Memory budget (bytes) of a block of the shared
+                PCs matrix, if the pairs are computed.
+
+        Returns:
+            tuple: A, B (rows of the matrix, A < B) and shared of the pairs.
+        """
+        rows = self.positions(contig_ids)
+        present = rows >= 0
+        if not present.all():
+            logger.warning(
+                "{} of {} references are not in the profiles".format(
+                    (~present).sum(), len(rows)
+                )
+            )
+        profiles = sparse.csr_matrix(matrix)[rows[present]]
+        digest = profiles_digest(profiles, self.contig_ids[present])
+
+        if self.shared is None and os.path.exists(self.path):
+            self.load()
+        if self.digest != digest:
+            if self.digest is not None:
+                logger.info(
+                    "The reference PC profiles changed, rebuilding {}".format(self.path)
+                )
+            self.compute(profiles, max_memory)
+            self.digest = digest
+            self.save()
+        else:
+            logger.info(
+                "Re-using {} cached reference pairs from {}".format(len(self.shared), self.path)
+            )
+
+        # Cache positions -> matrix rows
+        rows = rows[present]
+        A, B = rows[self.A], rows[self.B]
+        return np.minimum(A, B), np.maximum(A, B), self.shared
+
+    def compute(self, profiles, max_memory=None):
+        """Compute the pairs of rows of the reference profiles sharing PCs."""
+        profiles = sparse.csr_matrix(profiles, dtype=np.int32)
+        A, B, shared = [], [], []
+        for start, end in row_blocks(profiles, max_memory):
+            a, b, s = shared_features(profiles, start, end)
+            A.append(a.astype(np.int32))
+            B.append(b.astype(np.int32))
+            shared.append(s.astype(np.int32))
+
+        empty = np.array([], dtype=np.int32)
+        self.A = np.concatenate(A) if A else empty
+        self.B = np.concatenate(B) if B else empty
+        self.shared = np.concatenate(shared) if shared else empty
+        logger.debug("{} reference pairs share PCs".format(len(self.shared)))
+
+    def load(self):
+        """Read the cache file."""
+        with np.load(self.path) as data:
+            if int(data["version"]) != CACHE_VERSION:
+                logger.info("Ignoring {}: unsupported version".format(self.path))
+                return
+            self.digest = str(data["digest"])
+            self.A, self.B, self.shared = data["A"], data["B"], data["shared"]
+
+    def save(self):
+        """Write the cache file."""
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        # np.savez appends .npz to the paths without it
+        with open(self.path, "wb") as f:
+            np.savez(
+                f,
+                version=CACHE_VERSION,
+                digest=self.digest,
+                A=self.A,
+                B=self.B,
+                shared=self.shared,
+            )
+        logger.debug("Reference pairs saved in {}".format(self.path))
+
+
+def read_reference_ids(path):
+    """
+    Ids of the reference contigs of a --db release, written as in the
+    tables of a run: the spaces are replaced by ~ (see read_dfs), as
+    ClusterONE can't handle them.
+
+    Args:
+        path (str): protein2contig .csv file of the release.
+
+    Returns:
+        numpy.ndarray: Unique ids of the reference contigs.
+    """
+    contig_ids = pd.read_csv(path, usecols=["contig_id"])["contig_id"]
+    return contig_ids.str.replace(" ", "~").unique()
+
+
+def profiles_digest(profiles, contig_ids):
+    """
+    Digest of reference profiles that does not depend on the PC names and
+    order, only on the sets of references sharing each PC.
+
+    Args:
+        profiles (scipy.sparse): references x PCs.
+        contig_ids (numpy.ndarray): Id of each reference (row).
+
+    Returns:
+        str: sha1 hex digest.
+    """
+    csc = sparse.csc_matrix(profiles)
+    csc.sort_indices()
+    indices = csc.indices.astype(np.int32)
+    columns = sorted(
+        indices[start:end].tobytes()
+        for start, end in zip(csc.indptr[:-1], csc.indptr[1:])
+        if end > start
+    )
+
+    digest = hashlib.sha1()
+    digest.update("\n".join(contig_ids).encode())
+    for column in columns:
+        digest.update(len(column).to_bytes(8, "little"))
+        digest.update(column)
+    return digest.hexdigest()
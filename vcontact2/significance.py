@@ -0,0 +1,279 @@
+"""Hypergeometric significance of the features shared by two objects.
+
+The similarity networks (contigs sharing PCs, PCs sharing contigs) all score
+a pair with the same formula:
+
+    sig = -log10(P(X >= k)) - log10(T), X ~ H(M, a, b)
+
+    k: number of shared features.
+    M: total number of features.
+    a, b: number of features of each object.
+    T: number of comparisons.
+"""
+import logging
+from collections import OrderedDict
+
+import numpy as np
+import scipy.stats as stats
+
+logger = logging.getLogger(__name__)
+
+# Number of pairs scored by a single array-level call
+CHUNK_SIZE = 1000000
+# Number of (total, shared, a, b) entries kept by the significance cache
+CACHE_SIZE = 500000
+
+
+def neg_log10_sf(shared, total, a, b):
+    """Elementwise -log10(P(X >= shared)) with X ~ H(total, a, b).
+
+    Args:
+        shared (numpy.ndarray): Number of shared features.
+        total (int): Total number of features.
+        a (numpy.ndarray): Number of features of the first object.
+        b (numpy.ndarray): Number of features of the second object.
+
+    Returns:
+        numpy.ndarray: -log10 of the p-values (float).
+    """
+    shared = np.asarray(shared, dtype=float)
+    # It is symmetric but the smallest goes first to avoid numerical biases.
+    a, b = np.minimum(a, b), np.maximum(a, b)
+
+    # sf(k) = survival function = 1 - cdf(k) = 1 - P(x<k) = P(x>k)
+    # sf(k-1) = P(x>k-1) = P(x>=k)
+    with np.errstate(divide="ignore"):
+        res = -np.log10(stats.hypergeom.sf(shared - 1, total, a, b))
+
+    # The p-values below the double precision are recomputed in log space.
+    underflow = np.isinf(res)
+    if underflow.any():
+        res[underflow] = -stats.hypergeom.logsf(
+            shared[underflow] - 1, total, a[underflow], b[underflow]
+        ) / np.log(10)
+    return res
+
+
+class SignificanceCache(object):
+    """Memoize -log10(P(X >= shared)) on the (total, shared, a, b) quadruplets.
+
+    Profile sizes have a narrow spread, so the same quadruplets come back
+    across the millions of pairs of the similarity networks. Each unique one
+    is computed once; the least recently used entries are evicted when the
+    cache holds more than maxsize entries.
+
+    Attributes:
+        maxsize (int): Maximal number of entries.
+        hits (int): Number of pairs served from the cache.
+        misses (int): Number of pairs that needed a computation.
+    """
+
+    def __init__(self, maxsize=CACHE_SIZE):
+        self.maxsize = maxsize
+        self.values: OrderedDict[tuple, float] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __repr__(self):
+        return "Significance cache: {} hits, {} misses, {} entries (max {})".format(
+            self.hits, self.misses, len(self.values), self.maxsize
+        )
+
+    def __len__(self):
+        return len(self.values)
+
+    def clear(self):
+        self.values.clear()
+        self.hits = self.misses = 0
+
+    def neg_log10_sf(self, shared, total, a, b):
+        """Cached version of neg_log10_sf (same arguments)."""
+        shared = np.asarray(shared, dtype=np.int64)
+        small = np.minimum(a, b).astype(np.int64)
+        large = np.maximum(a, b).astype(np.int64)
+
+        keys, inverse = np.unique(
+            np.column_stack((shared, small, large)), axis=0, return_inverse=True
+        )
+        values = np.empty(len(keys), dtype=float)
+
+        missing = []
+        for n, key in enumerate(keys.tolist()):
+            key = (total, *key)
+            if key in self.values:
+                values[n] = self.values[key]
+                self.values.move_to_end(key)
+            else:
+                missing.append(n)
+
+        if missing:
+            missing = np.asarray(missing)
+            values[missing] = neg_log10_sf(
+                keys[missing, 0], total, keys[missing, 1], keys[missing, 2]
+            )
+            for key, value in zip(keys[missing].tolist(), values[missing]):
+                self.values[(total, *key)] = value
+            while len(self.values) > self.maxsize:
+                self.values.popitem(last=False)
+
+        self.misses += len(missing)
+        self.hits += len(shared) - len(missing)
+        return values[inverse.ravel()]
+
+
+# Shared by the stages scored in this process: the networks computed with
+# threads=1, the cached reference pairs and the module-cluster links. The
+# workers of pcprofiles.hypergeom_blocks each fill their own copy and report
+# its counters to the parent.
+CACHE = SignificanceCache()
+
+
+def pairwise_sig(shared, a, b, total, logT, chunk_size=CHUNK_SIZE, cache=CACHE):
+    """Significance of a batch of pairs, computed by chunks.
+
+    Args:
+        shared (numpy.ndarray): Number of shared features of each pair.
+        a (numpy.ndarray): Number of features of the first member of each pair.
+        b (numpy.ndarray): Number of features of the second member of each pair.
+        total (int): Total number of features.
+        logT (float): Log10 of the number of comparisons.
+        chunk_size (int): Number of pairs scored at once.
+        cache (SignificanceCache): Memoized p-values, None to disable.
+
+    Returns:
+        numpy.ndarray: sig of each pair.
+    """
+    shared = np.asarray(shared)
+    a = np.asarray(a)
+    b = np.asarray(b)
+
+    sig = np.empty(len(shared), dtype=float)
+    for start in range(0, len(shared), chunk_size):
+        chunk = slice(start, start + chunk_size)
+        if cache is None:
+            sig[chunk] = neg_log10_sf(shared[chunk], total, a[chunk], b[chunk])
+        else:
+            sig[chunk] = cache.neg_log10_sf(shared[chunk], total, a[chunk], b[chunk])
+    sig -= logT
+
+    return np.nan_to_num(sig)
+
+
+def min_shared(a, b, total, logT, thres):
+    """Smallest number of shared features k* such that sig(k*, a, b) > thres.
+
+    The significance grows with the number of shared features, so k* is found
+    by a bisection run on all the (a, b) pairs at once. If no k can reach the
+    threshold, k* = min(a, b) + 1.
+
+    Args:
+        a (numpy.ndarray): Number of features of the first object.
+        b (numpy.ndarray): Number of features of the second object.
+        total (int): Total number of features.
+        logT (float): Log10 of the number of comparisons.
+        thres (float): Significance threshold.
+
+    Returns:
+        numpy.ndarray: k* of each pair (int).
+    """
+    a = np.asarray(a)
+    b = np.asarray(b)
+
+    # Invariant: lo <= k* <= hi
+    lo = np.ones(len(a), dtype=np.int64)
+    hi = np.minimum(a, b).astype(np.int64) + 1
+
+    active = np.flatnonzero(lo < hi)
+    while len(active):
+        mid = (lo[active] + hi[active]) // 2
+        # The mid-points are not queried again, they would only evict the
+        # useful entries of the cache.
+        passing = pairwise_sig(mid, a[active], b[active], total, logT, cache=None) > thres
+        hi[active] = np.where(passing, mid, hi[active])
+        lo[active] = np.where(passing, lo[active], mid + 1)
+        active = active[lo[active] < hi[active]]
+
+    return hi
+
+
+class ThresholdTable(object):
+    """Lookup table of the minimal number of shared features needed to
+    reach the significance threshold, for fixed total and logT.
+
+    k*(a, b) is computed the first time a pair of profile sizes (a, b) is
+    seen, and kept in sorted arrays of the pairs met so far, so the memory
+    grows with the number of distinct (a, b) pairs actually scored, not with
+    the square of the number of distinct sizes. Pairs sharing less than
+    k*(a, b) features can then be dropped with an integer comparison,
+    without computing a p-value.
+
+    Attributes:
+        sizes (numpy.ndarray): Distinct profile sizes (sorted).
+        keys (numpy.ndarray): i * len(sizes) + j of the pairs
+            (sizes[i], sizes[j]), i <= j, computed so far (sorted).
+        values (numpy.ndarray): k* of each key.
+    """
+
+    def __init__(self, sizes, total, logT, thres):
+        """
+        Args:
+            sizes (numpy.ndarray): Profile size of every object.
+            total (int): Total number of features.
+            logT (float): Log10 of the number of comparisons.
+            thres (float): Significance threshold.
+        """
+        self.total = total
+        self.logT = logT
+        self.thres = thres
+        self.sizes = np.unique(sizes)
+        self.keys = np.empty(0, dtype=np.int64)
+        self.values = np.empty(0, dtype=np.int64)
+
+    def __repr__(self):
+        return "ThresholdTable {} sizes, {} pairs computed, threshold {}".format(
+            len(self.sizes), len(self.keys), self.thres
+        )
+
+    def _lookup(self, keys):
+        """Position of keys in self.keys and whether they are there."""
+        pos = np.searchsorted(self.keys, keys)
+        found = pos < len(self.keys)
+        found[found] = self.keys[pos[found]] == keys[found]
+        return pos, found
+
+    def min_shared(self, a, b):
+        """k*(a, b) of each pair, computing the pairs not seen yet.
+
+        Args:
+            a (numpy.ndarray): Profile size of the first member of each pair.
+            b (numpy.ndarray): Profile size of the second member of each pair.
+
+        Returns:
+            numpy.ndarray: k* of each pair.
+        """
+        i = np.searchsorted(self.sizes, np.minimum(a, b)).astype(np.int64)
+        j = np.searchsorted(self.sizes, np.maximum(a, b)).astype(np.int64)
+        keys = i * len(self.sizes) + j
+
+        pos, found = self._lookup(keys)
+        if not found.all():
+            new = np.unique(keys[~found])
+            values = min_shared(
+                self.sizes[new // len(self.sizes)],
+                self.sizes[new % len(self.sizes)],
+                self.total,
+                self.logT,
+                self.thres,
+            )
+            self.keys = np.concatenate((self.keys, new))
+            self.values = np.concatenate((self.values, values))
+            order = np.argsort(self.keys, kind="stable")
+            self.keys, self.values = self.keys[order], self.values[order]
+            logger.debug("{} (a, b) pairs added to the threshold table".format(len(new)))
+            pos, found = self._lookup(keys)
+
+        return self.values[pos]
+
+    def passes(self, shared, a, b):
+        """Boolean mask of the pairs that can reach the threshold."""
+        return np.asarray(shared) >= self.min_shared(a, b)
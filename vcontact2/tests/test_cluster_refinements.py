@@ -0,0 +1,75 @@
+""" Unit test for the cluster_refinements module"""
+from .. import cluster_refinements
+from scipy.cluster.hierarchy import fcluster, linkage
+from scipy.spatial import distance
+import numpy as np
+import pandas as pd
+
+F = {} # Fixtures
+def setup_module():
+    # preVC 0: two pairs of identical profiles and a contig without profile
+    # preVC 1: a single profiled contig and a contig without profile
+    # preVC 2: no profiled contig
+    # preVC 3: eleven contigs with disjoint profiles (more than 9 subclusters)
+    # and a contig in no preVC
+    members = [(0, 5), (1, 2), (2, 2), (3, 11), (None, 1)]
+    prevcs = [x for x, n in members for _ in range(n)]
+    contig_ids = ["Phage~{}".format(i) for i in range(len(prevcs))]
+    F["contigs"] = pd.DataFrame({"contig_id": contig_ids,
+                                 "proteins": 10,
+                                 "pos": np.arange(len(prevcs)),
+                                 "pos_cluster": pd.array(prevcs, dtype="Int64"),
+                                 "genus": ["g0"] * 5 + ["g1"] * 4 + ["g2"] * 11 + [None]})
+    pcs = {0: range(3), 1: range(3), 2: range(10, 13), 3: range(10, 13), 5: range(20, 22)}
+    pcs.update({i: [100 + i, 200 + i] for i in range(9, 20)})
+    F["profiles"] = pd.DataFrame(
+        [(contig_ids[i].replace("~", " "), "PC_{}".format(pc)) for i, x in pcs.items() for pc in x],
+        columns=["contig_id", "pc_id"])
+    # A PC counted twice in a profile (crosstab counts)
+    F["profiles"] = pd.concat([F["profiles"], F["profiles"].iloc[[6]]], ignore_index=True)
+
+def reference_subclusters(contigs, profiles_df, dist):
+    """The subclusters of the preVCs, one preVC and one distance at a time."""
+    revised = pd.Series(np.nan, index=contigs.index, dtype=object)
+    for contig_cluster, group in contigs.groupby(by="pos_cluster"):
+        keys = [x.replace("~", " ") for x in group["contig_id"]]
+        vc_pc_df = profiles_df.loc[profiles_df["contig_id"].isin(keys)]
+        crosstab = pd.crosstab(vc_pc_df["contig_id"], vc_pc_df["pc_id"])
+        if len(crosstab) < 2:
+            revised[group.index] = "{}_0".format(contig_cluster)
+            continue
+        labels = fcluster(linkage(distance.pdist(crosstab.values), method="average"),
+                          dist, criterion="distance").astype(str)
+        for n, label in enumerate(sorted(set(labels))):
+            members = crosstab.index[labels == label].str.replace(" ", "~")
+            revised[contigs["contig_id"].isin(members)] = "{}_{}".format(contig_cluster, n)
+    return revised
+
+def test_refine_prevcs():
+    positions, prevcs, labels = cluster_refinements.refine_prevcs(
+        F["contigs"], F["profiles"], [1, 9])
+    assert sorted(positions.tolist()) == [0, 1, 2, 3] + list(range(5, 20))
+    assert labels.shape == (2, len(positions))
+    pooled = cluster_refinements.refine_prevcs(F["contigs"], F["profiles"], [1, 9], threads=2)
+    # The pool returns the preVCs in any order
+    order, pooled_order = np.argsort(positions), np.argsort(pooled[0])
+    assert (positions[order] == pooled[0][pooled_order]).all()
+    assert (prevcs[order] == pooled[1][pooled_order]).all()
+    assert (labels[:, order] == pooled[2][:, pooled_order]).all()
+
+def test_viral_clusters():
+    for threads in (1, 2):
+        vc = cluster_refinements.ViralClusters(
+            F["contigs"], F["profiles"], optimize=True, threads=threads)
+        for dist, contigs in vc.results.items():
+            expected = reference_subclusters(F["contigs"], F["profiles"], dist)
+            assert contigs["rev_pos_cluster"].fillna("").tolist() == expected.fillna("").tolist()
+    # Subclusters at the smallest distance
+    revised = vc.results[1.0]["rev_pos_cluster"].fillna("").tolist()
+    assert revised[:9] == ["0_0", "0_0", "0_1", "0_1", "", "1_0", "1_0", "2_0", "2_0"]
+    assert sorted(revised[9:20]) == sorted("3_{}".format(i) for i in range(11))
+    assert revised[20] == ""
+    # Ties are broken by the largest distance
+    assert len(vc.best_df) > 1
+    assert vc.dist == vc.best_df["Distance"].max()
+    assert vc.contigs is vc.results[vc.dist]
@@ -0,0 +1,87 @@
+""" Unit test for the native ClusterONE"""
+from .. import clusterone
+import io
+import os
+import shutil
+import subprocess
+import tempfile
+import pytest
+import numpy as np
+import pandas as pd
+import scipy.sparse as sparse
+
+F = {} # Fixtures
+def setup_module():
+    # Cliques of 5, 4 and 3 nodes linked by light edges, and a pendant node
+    network = np.zeros((13, 13))
+    for start, end in ((0, 5), (5, 9), (9, 12)):
+        network[start:end, start:end] = 5
+    network[4, 5] = network[5, 4] = 1
+    network[8, 9] = network[9, 8] = 1
+    network[11, 12] = network[12, 11] = 0.5
+    np.fill_diagonal(network, 0)
+    F["network"] = sparse.csr_matrix(network)
+    F["expected"] = [list(range(5)), list(range(5, 9)), list(range(9, 12))]
+
+def test_cluster_one():
+    for seed_method in clusterone.SEED_METHODS:
+        clusters, stats_df = clusterone.cluster_one(F["network"], min_size=3, haircut=0.55, seed_method=seed_method)
+        assert [x.tolist() for x in clusters] == F["expected"]
+    assert stats_df["Internal weight"].tolist() == [50, 30, 15]
+
+def test_merge():
+    clusters = [np.array([0, 1, 2, 3]), np.array([1, 2, 3, 4]), np.array([5, 6])]
+    # match score 9/16 between the two first clusters
+    assert len(clusterone.merge(clusters, 7, 0.6)) == 3
+    merged = clusterone.merge(clusters, 7, 0.5)
+    assert [x.tolist() for x in merged] == [[0, 1, 2, 3, 4], [5, 6]]
+
+def test_to_csv():
+    clusters, stats_df = clusterone.cluster_one(F["network"], min_size=3)
+    names = pd.Series(["n{}".format(i) for i in range(13)])
+    with tempfile.TemporaryDirectory() as folder:
+        fi = os.path.join(folder, "c1.csv")
+        clusterone.to_csv(clusters, stats_df, names, fi)
+        df = pd.read_csv(fi, header=0)
+    assert df["Members"].tolist()[-1] == "n9 n10 n11"
+
+# Options of the viral clusters (defaults of the command line)
+VC_OPTIONS = {"--min-density": 0.3, "--min-size": 2, "--max-overlap": 0.9, "--penalty": 2.0,
+              "--haircut": 0.55, "--merge-method": "single", "--similarity": "match",
+              "--seed-method": "nodes"}
+
+def test_java_reference(tmp_path):
+    # Same clusters as cluster_one-1.0.jar, run when the jar (CLUSTER_ONE_JAR
+    # or in the PATH) and java are available.
+    jar = os.environ.get("CLUSTER_ONE_JAR") or shutil.which("cluster_one-1.0.jar")
+    if not jar or not shutil.which("java"):
+        pytest.skip("cluster_one-1.0.jar or java not found")
+
+    # Overlapping communities of various densities, with noise
+    rng = np.random.RandomState(0)
+    n = 150
+    groups = [rng.choice(n, size, replace=False) for size in rng.randint(4, 20, 15)]
+    network = np.zeros((n, n))
+    for group in groups:
+        for x in group:
+            for y in group:
+                if rng.rand() < 0.7:
+                    network[x, y] = rng.uniform(1, 300)
+    noise = rng.rand(n, n) < 0.01
+    network[noise] = rng.uniform(1, 50, noise.sum())
+    network = np.triu(network, 1)
+    network = sparse.csr_matrix(network + network.T)
+    names = pd.Series(["n{}".format(i) for i in range(n)])
+
+    ntw = str(tmp_path / "c1.ntw")
+    with open(ntw, "w") as f:
+        for x, y, weight in zip(*sparse.triu(network).nonzero(), sparse.triu(network).data):
+            f.write("{} {} {}\n".format(names[x], names[y], weight))
+    cmd = ["java", "-jar", jar, ntw, "--input-format", "edge_list", "--output-format", "csv"]
+    cmd += [str(x) for option in VC_OPTIONS.items() for x in option]
+    expected = pd.read_csv(io.StringIO(subprocess.check_output(cmd, text=True)), header=0)
+
+    kwargs = {opt.lstrip("-").replace("-", "_"): val for opt, val in VC_OPTIONS.items()}
+    clusters, _ = clusterone.cluster_one(network, **kwargs)
+    obtained = sorted(" ".join(sorted(names[x])) for x in clusters)
+    assert obtained == sorted(" ".join(sorted(x.split())) for x in expected["Members"])
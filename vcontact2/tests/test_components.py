@@ -0,0 +1,63 @@
+""" Unit test for the components module"""
+from .. import clusterone
+from .. import components
+from .. import mcl
+import numpy as np
+import pandas as pd
+import scipy.sparse as sparse
+
+F = {} # Fixtures
+def setup_module():
+    # Two components of two cliques each, a triangle, a pair and an isolated node
+    network = np.zeros((25, 25))
+    for start, end in ((0, 6), (6, 11), (11, 15), (15, 19), (19, 22), (22, 24)):
+        network[start:end, start:end] = 5
+    network[5, 6] = network[6, 5] = 1
+    network[14, 15] = network[15, 14] = 1
+    np.fill_diagonal(network, 0)
+    F["network"] = sparse.csr_matrix(network)
+
+def as_sets(clusters):
+    return sorted(sorted(int(n) for n in x) for x in clusters)
+
+def test_components():
+    parts = components.components(F["network"])
+    assert [len(x) for x in parts] == [11, 8, 3, 2, 1]
+    assert parts[-1].tolist() == [24]
+
+def test_mcl():
+    names = pd.Series(np.arange(25).astype(str))
+    # The isolated node is dropped, as mcl --abc does
+    expected = as_sets(x for x in mcl.run_native(F["network"], names, 2.0) if len(x) > 1)
+    for threads in (1, 2):
+        clusters = components.cluster_components(
+            F["network"], "MCL", {"inflation": 2.0, "backend": "native"}, threads=threads
+        )
+        assert as_sets(clusters) == expected
+        assert [len(x) for x in clusters] == [6, 5, 4, 4, 3, 2]
+
+def test_cluster_one():
+    params = {"min_size": 2, "min_density": 0.3}
+    expected, _ = clusterone.cluster_one(F["network"], **params)
+    clusters = components.cluster_components(F["network"], "ClusterONE", params, threads=2)
+    assert as_sets(clusters) == as_sets(expected)
+    # The pair fails the default minimal size
+    clusters = components.cluster_components(F["network"], "ClusterONE", {})
+    assert min(len(x) for x in clusters) == 3
+
+def test_retry():
+    calls = []
+    cluster_component = components.cluster_component
+    def flaky(*args, **kwargs):
+        calls.append(1)
+        if len(calls) == 1:
+            raise OSError("interrupted")
+        return cluster_component(*args, **kwargs)
+    components.cluster_component = flaky
+    try:
+        clusters = components.cluster_components(
+            F["network"], "MCL", {"inflation": 2.0, "backend": "native"}
+        )
+    finally:
+        components.cluster_component = cluster_component
+    assert len(clusters) == 6
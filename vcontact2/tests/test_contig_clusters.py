@@ -0,0 +1,122 @@
+""" Unit test for the contig_clusters module"""
+from .. import components
+from .. import contig_clusters
+from .. import mcl
+import io
+import numpy as np
+import pandas as pd
+import scipy.sparse as sparse
+
+F = {} # Fixtures
+def setup_module():
+    F["contigs"] = pd.DataFrame({"contig_id": list("abcdef"),
+                                 "proteins": [5] * 6,
+                                 "pos": np.arange(6)})
+    F["network"] = sparse.csr_matrix((6, 6))
+    F["one"] = "Cluster,Size,Members\n1,3,a b c\n2,3,c d e\n"
+
+def loaded(mode):
+    cc = contig_clusters.ContigCluster.__new__(contig_clusters.ContigCluster)
+    cc.mode = mode
+    cc.contigs = F["contigs"].copy()
+    cc.network = F["network"]
+    cc.members = None
+    return cc
+
+def test_load_mcl_clusters():
+    cc = loaded("MCL")
+    # The singletons are dropped
+    clusters_df, c = cc.load_mcl_clusters([["a", "b", "c"], ["f"], ["d", "e"]])
+    assert c == [["a", "b", "c"], ["d", "e"]]
+    assert clusters_df["size"].tolist() == [3, 2]
+    assert cc.contigs["pos_cluster"].dtype == "Int64"
+    assert cc.contigs["pos_cluster"].fillna(-1).tolist() == [0, 0, 0, 1, 1, -1]
+    assert cc.contigs.columns.tolist() == ["contig_id", "index", "proteins", "pos", "pos_cluster"]
+    assert cc.df is None
+
+def test_load_one_clusters():
+    cc = loaded("ClusterONE")
+    cc.load_one_clusters(io.StringIO(F["one"]))
+    # The overlapping contig c is not assigned
+    assert cc.contigs["pos_cluster"].dtype == "Int64"
+    assert cc.contigs["pos_cluster"].fillna(-1).tolist() == [0, 0, -1, 1, 1, -1]
+    assert cc.contigs.columns.tolist() == ["contig_id", "index", "proteins", "pos", "pos_cluster"]
+    df = cc.df
+    assert df.loc["c", "pos_cluster"] == 0
+    assert df.loc["c", "pos_clusters"] == "0;1"
+    assert df["pos_clusters"].notnull().sum() == 1
+    assert pd.isnull(df.loc["f", "pos_cluster"])
+
+def synthetic_cluster(tmp_dir, **kwargs):
+    # Six cliques of ten contigs, two of them linked. Most contigs of a
+    # clique share a family, some are misplaced and a third of the contigs
+    # have no reference taxonomy.
+    rng = np.random.RandomState(0)
+    nb = 60
+    family = np.repeat(["f{}".format(i) for i in range(6)], 10).astype(object)
+    misplaced = rng.rand(nb) < 0.2
+    family[misplaced] = ["f{}".format(i) for i in rng.randint(0, 6, misplaced.sum())]
+    family[rng.rand(nb) < 0.3] = np.nan
+    contigs = pd.DataFrame({"contig_id": ["c{}".format(i) for i in range(nb)],
+                            "proteins": 10,
+                            "pos": np.arange(nb),
+                            "family": family})
+    network = np.zeros((nb, nb))
+    for start in range(0, nb, 10):
+        network[start:start + 10, start:start + 10] = rng.uniform(1, 10, (10, 10))
+    network[9, 10] = 1
+    network = np.triu(network, 1)
+    network = sparse.csr_matrix(network + network.T)
+    kwargs.setdefault("mcl_backend", "native")
+    return contig_clusters.ContigCluster(
+        (pd.DataFrame(), contigs, network), tmp_dir, None, {}, **kwargs
+    )
+
+def test_cross_validation_affiliation(tmp_path):
+    cc = synthetic_cluster(str(tmp_path))
+    contigs = cc.contigs.copy()
+    serial = cc.cross_validation_affiliation("family", folds=3)
+    # The folds are not added to the contigs of the object
+    pd.testing.assert_frame_equal(cc.contigs, contigs)
+    pooled = cc.cross_validation_affiliation("family", folds=3, threads=2)
+    assert sorted(serial) == ["cv_set", "test_set", "train_set"]
+    assert len(serial["cv_set"]) == 3
+    for set_ in serial:
+        pd.testing.assert_frame_equal(serial[set_], pooled[set_])
+
+def test_learning_curve_affiliation(tmp_path):
+    cc = synthetic_cluster(str(tmp_path))
+    serial = cc.learning_curve_affiliation("family", folds=3, threads=1)
+    cc.threads = 2
+    pooled = cc.learning_curve_affiliation("family", folds=3)
+    assert "cvset_family" not in cc.contigs
+    assert len(serial["train_set"]) > 0
+    for set_ in serial:
+        pd.testing.assert_frame_equal(serial[set_], pooled[set_])
+
+def test_by_component(tmp_path, monkeypatch):
+    calls = []
+    def record(function, name):
+        def wrapper(*args, **kwargs):
+            calls.append(name)
+            return function(*args, **kwargs)
+        return wrapper
+    cluster_components = components.cluster_components
+    monkeypatch.setattr(components, "cluster_components", record(cluster_components, "components"))
+    # The mcl binary is replaced by the native backend
+    native = lambda matrix, names, inflation, **kwargs: mcl.run_native(matrix, names, inflation)
+    monkeypatch.setattr(mcl, "cluster", record(native, "mcl"))
+
+    for name in ("native", "mcl", "forced"):
+        (tmp_path / name).mkdir()
+    # By default, only the native backend clusters by component
+    reference = synthetic_cluster(str(tmp_path / "native"))
+    # One run by connected component
+    assert calls == ["components"] + ["mcl"] * 5
+    calls.clear()
+    external = synthetic_cluster(str(tmp_path / "mcl"), mcl_backend="mcl")
+    assert calls == ["mcl"]
+    calls.clear()
+    synthetic_cluster(str(tmp_path / "forced"), mcl_backend="mcl", by_component=True)
+    assert calls == ["components"] + ["mcl"] * 5
+    assert external.contigs["pos_cluster"].equals(reference.contigs["pos_cluster"])
@@ -1,9 +1,10 @@
 import numpy as np
+import pandas as pd
 import scipy.sparse as sparse
 
 from .. import matrices
 F= {}
-def setup():
+def setup_module():
     F["network_hypergeom"] = sparse.lil_matrix(np.matrix([[0,0,1,1,0,0],
                                                           [0,0,0,0,0,1],
                                                           [1,0,0,1,0,0],
@@ -64,4 +65,20 @@ def test_correspondence():
             print(m)
             print("Obtained: \n {}".format(obtained[i]))
             print("Wanted: \n {}".format(wanted[i]))
-            np.testing.assert_array_equal(obtained[i],wanted[i])
+            assert sparse.issparse(obtained[i])
+            np.testing.assert_array_equal(obtained[i].toarray(),wanted[i])
+        Q, R, P, F_ = matrices.correspondence(F["K_{}".format(level)], F["B"], full=False)
+        assert Q is None and F_ is None
+        np.testing.assert_array_equal(R.toarray(), F["R_{}".format(level)])
+
+def test_membership():
+    nodes = pd.DataFrame({"contig_id": ["c{}".format(i) for i in range(6)], "pos": range(6)})
+    clusters = [["c0", "c2", "c3"], ["c1", "c5"]]
+    B = matrices.membership(clusters, F["network_hypergeom"], nodes)
+    assert sparse.issparse(B)
+    np.testing.assert_array_equal(B.toarray(), F["B"])
+
+    nodes["pos_cluster"] = [0, 1, 0, 0, np.nan, 1]
+    B = matrices.bool_membership(nodes)
+    assert sparse.issparse(B)
+    np.testing.assert_array_equal(B.toarray(), F["B"])
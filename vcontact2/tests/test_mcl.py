@@ -0,0 +1,68 @@
+""" Unit test for the native MCL backend"""
+from .. import mcl
+from .. import protein_clusters
+import os
+import sys
+import numpy as np
+import pandas as pd
+import scipy.sparse as sparse
+
+F = {} # Fixtures
+def setup_module():
+    # Three cliques of 5, 4 and 3 nodes, linked by light edges, and an isolated node
+    network = np.zeros((13, 13))
+    for start, end in ((0, 5), (5, 9), (9, 12)):
+        network[start:end, start:end] = 5
+    network[4, 5] = network[5, 4] = 1
+    network[8, 9] = network[9, 8] = 1
+    np.fill_diagonal(network, 0)
+    F["network"] = sparse.csr_matrix(network)
+    F["expected"] = [0] * 5 + [1] * 4 + [2] * 3 + [3]
+
+def test_markov_clustering():
+    for threads, block_rows in ((1, 1000), (3, 2)):
+        labels = mcl.markov_clustering(F["network"], 2.0, threads=threads, block_rows=block_rows)
+        assert labels.tolist() == F["expected"]
+
+def test_run_native():
+    names = pd.Series(["n{}".format(i) for i in range(13)])
+    clusters = mcl.run_native(F["network"], names, 2.0)
+    assert [len(x) for x in clusters] == [5, 4, 3, 1]
+    assert clusters[2] == ["n9", "n10", "n11"]
+
+FAKE_MCXLOAD = """import sys
+args = sys.argv[1:]
+open(args[args.index("-o") + 1], "w").write(sys.stdin.read())
+open(args[args.index("-write-tab") + 1], "w").write("tab")
+open(sys.argv[0] + ".args", "w").write(" ".join(args))
+"""
+
+FAKE_MCL = """import sys
+open(sys.argv[0] + ".args", "w").write(" ".join(sys.argv[1:]))
+for line in open(sys.argv[1]):
+    print("\\t".join(line.split()[:2]))
+"""
+
+def test_protein_clusters_mcl(tmp_path, monkeypatch):
+    # mcxload and mcl replaced by scripts recording their arguments
+    for name, script in (("mcxload", FAKE_MCXLOAD), ("mcl", FAKE_MCL)):
+        path = tmp_path / name
+        path.write_text("#!{}\n{}".format(sys.executable, script))
+        path.chmod(0o755)
+    monkeypatch.setenv("PATH", "{}{}{}".format(tmp_path, os.pathsep, os.environ["PATH"]))
+
+    hits = [("p1", "p1", "0"), ("p1", "p2", "1e-30"), ("p2", "p1", "1e-20"), ("p3", "p2", "1e-5")]
+    blast_fp = tmp_path / "blast.tsv"
+    blast_fp.write_text("".join("\t".join([q, h] + ["0"] * 8 + [e, "1"]) + "\n" for q, h, e in hits))
+
+    clusters_fp = protein_clusters.make_protein_clusters_mcl(
+        str(blast_fp), str(tmp_path), inflation=2, threads=3, save_network=True)
+    # The self-hits are dropped, mcxload mirrors and transforms the edges
+    abc = "p1 p2 1e-30\np2 p1 1e-20\np3 p2 1e-5\n"
+    assert (tmp_path / "blast.tsv.abc").read_text() == abc
+    assert (tmp_path / "blast.tsv.mci").read_text() == abc
+    mci, tab = (str(tmp_path / x) for x in ("blast.tsv.mci", "blast.tsv_mcxload.tab"))
+    assert (tmp_path / "mcxload.args").read_text() == (
+        "-abc - -o {} -write-tab {} --stream-mirror --stream-neg-log10 -stream-tf ceil(200)".format(mci, tab))
+    assert (tmp_path / "mcl.args").read_text() == "{} -I 2 -use-tab {} -o - -te 3".format(mci, tab)
+    assert open(clusters_fp).read() == "p1\tp2\np2\tp1\np3\tp2\n"
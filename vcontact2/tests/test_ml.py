@@ -5,7 +5,7 @@ import numpy as np
 import pandas 
 
 F = {} # Fixtures 
-def setup():
+def setup_module():
     F["classification"] = pandas.DataFrame({"reference":[1     ,1     ,1,1,1,np.nan,2,3,2,8,np.nan],
                                             "predicted":[np.nan,np.nan,2,1,1,3     ,2,1,2,3,np.nan]})
     F["metrics"] = {"entries": 11,
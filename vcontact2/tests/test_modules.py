@@ -0,0 +1,131 @@
+""" Unit test for the modules module"""
+from .. import modules
+import os
+import numpy as np
+import pandas as pd
+import scipy.sparse as sparse
+import scipy.stats as stats
+
+F = {} # Fixtures
+def setup_module():
+    rng = np.random.default_rng(0)
+    nb_contigs, nb_pcs = 40, 60
+    nb_proteins = rng.integers(1, 20, nb_pcs)
+    F["pcs"] = pd.DataFrame({"pos": range(nb_pcs),
+                             "pc_id": ["PC_{:03}".format(i) for i in range(nb_pcs)],
+                             "nb_proteins": nb_proteins,
+                             "annotated": rng.integers(0, nb_proteins + 1)})
+    F["matrix"] = sparse.csr_matrix(rng.random((nb_contigs, nb_pcs)) < 0.2)
+
+    # MCL output: modules of PCs in random order, a singleton, and PCs in
+    # no module
+    order = rng.permutation(nb_pcs)
+    F["mcl"] = [list(F["pcs"]["pc_id"].values[order[start:end]])
+                for start, end in ((0, 12), (12, 20), (20, 21), (21, 35), (35, 38), (38, 50))]
+
+def loaded(tmp_path):
+    with open(os.path.join(str(tmp_path), "modules_mcl_2.clusters"), "w") as f:
+        f.write("".join("\t".join(x) + "\n" for x in F["mcl"]))
+    mod = modules.Modules.__new__(modules.Modules)
+    mod.pcs = F["pcs"].copy()
+    mod.matrix = F["matrix"]
+    mod.modules = mod.define_modules(None, str(tmp_path), 2)
+    return mod
+
+def former_define_modules(pcs, clusters):
+    """Former module assignment loop of Modules.define_modules."""
+    clusters = [x for x in clusters if len(x) > 1]
+    nb_modules = len(clusters)
+    proteins = np.zeros(nb_modules)
+    annotated_proteins = np.zeros(nb_modules)
+    pcs = pcs.reset_index().set_index("pc_id")
+    pcs["module"] = np.nan
+    for i, cluster in enumerate(clusters):
+        for n in cluster:
+            pcs.loc[n, "module"] = i
+            proteins[i] += pcs.loc[n, "nb_proteins"]
+            annotated_proteins[i] += pcs.loc[n, "annotated"]
+    pcs.dropna(subset=["module"], inplace=True)
+    return pcs, proteins, annotated_proteins
+
+def test_define_modules(tmp_path):
+    mod = loaded(tmp_path)
+    pcs, proteins, annotated_proteins = former_define_modules(F["pcs"], F["mcl"])
+    pd.testing.assert_frame_equal(mod.pcs, pcs)
+    np.testing.assert_array_equal(mod.modules["proteins"], proteins)
+    np.testing.assert_array_equal(mod.modules["annotated_proteins"], annotated_proteins)
+    assert mod.modules["size"].tolist() == [12, 8, 14, 3, 12]
+    assert mod.modules["id"].tolist() == ["MD_{:02}".format(i) for i in range(5)]
+
+    # Read back from the saved tables
+    saved = loaded(tmp_path)
+    pd.testing.assert_frame_equal(saved.pcs, pcs)
+    pd.testing.assert_frame_equal(saved.modules, mod.modules)
+
+def former_module_in_contigs(matrix, pcs, nb_contigs, sizes):
+    """Former loop of Modules.module_in_contigs."""
+    matrix = matrix.tocsc()
+    N = sparse.lil_matrix((nb_contigs, len(sizes)))
+    for m, data in pcs.reset_index().groupby("module"):
+        N[:, int(m)] = matrix[:, data["pos"].values].sum(1)
+    return sparse.csc_matrix(N.todense() / np.matrix([sizes] * N.shape[0]))
+
+def test_module_in_contigs(tmp_path):
+    mod = loaded(tmp_path)
+    expected = former_module_in_contigs(
+        F["matrix"], mod.pcs, F["matrix"].shape[0], mod.modules["size"].values
+    )
+    obtained = mod.module_in_contigs()
+    assert sparse.isspmatrix_csc(obtained)
+    assert obtained.shape == expected.shape
+    assert obtained.nnz > 0
+    np.testing.assert_allclose(obtained.toarray(), expected.toarray())
+
+def former_link_modules_and_clusters(clusters, contigs, matrix_module, thres, own_threshold):
+    """Former loop of Modules.link_modules_and_clusters."""
+    matrix_module = (matrix_module >= own_threshold).tocsc()
+    nb_contigs, nb_modules = matrix_module.shape
+    nb_clusters = len(clusters)
+    a_values = clusters.sort_values(by="pos")["size"].values
+    b_values = matrix_module.sum(0).A1
+    xy = (contigs.reset_index(drop=True).loc[:, ["pos_cluster", "pos"]]
+          .dropna(subset=["pos_cluster"]).sort_values(by="pos").values)
+    pa_matrix = sparse.coo_matrix(([1] * len(xy), list(zip(*xy))), shape=(nb_clusters, nb_contigs))
+    c_values = pa_matrix.dot(matrix_module)
+    logT = np.log10(nb_clusters * nb_modules)
+    S = sparse.lil_matrix((nb_clusters, nb_modules))
+    for A, B in zip(*c_values.nonzero()):
+        pval = stats.hypergeom.sf(c_values[A, B] - 1, nb_contigs, a_values[A], b_values[B])
+        sig = np.nan_to_num(-np.log10(pval) - logT)
+        if sig > thres:
+            S[A, B] = min(300, sig)
+    return S
+
+def test_link_modules_and_clusters(tmp_path):
+    mod = loaded(tmp_path)
+    # Contigs of cluster i mostly owning module i, some in no cluster
+    rng = np.random.default_rng(1)
+    nb_contigs = F["matrix"].shape[0]
+    pos_cluster = np.repeat(np.arange(5), 8).astype(float)
+    proportions = rng.random((nb_contigs, 5)) * (rng.random((nb_contigs, 5)) < 0.3)
+    proportions[np.arange(nb_contigs), pos_cluster.astype(int)] = rng.uniform(0.4, 1, nb_contigs)
+    matrix_module = sparse.csc_matrix(proportions)
+    pos_cluster[::7] = np.nan
+    contigs = pd.DataFrame({"pos": np.arange(nb_contigs)[::-1],
+                            "pos_cluster": pd.array(pos_cluster[::-1], dtype="Int64")})
+    clusters = pd.DataFrame({"pos": range(5),
+                             "size": [(pos_cluster == i).sum() for i in range(5)]})
+
+    for thres, own_threshold in ((1.0, 0.5), (0.0, 0.2)):
+        expected = former_link_modules_and_clusters(
+            clusters, contigs.astype({"pos_cluster": float}), matrix_module, thres, own_threshold
+        )
+        obtained = mod.link_modules_and_clusters(clusters, contigs, matrix_module, thres, own_threshold)
+        assert expected.nnz > 0
+        assert ((obtained != 0) != (expected != 0)).nnz == 0
+        np.testing.assert_allclose(obtained.toarray(), expected.toarray())
+
+    mod.matrix_module = matrix_module
+    df = mod.link_modules_and_clusters_df(clusters, contigs, thres=0.0, own_threshold=0.2)
+    assert len(df) == expected.nnz
+    np.testing.assert_allclose(df["sig"], expected.tocsr()[df["pos_cluster"], df["pos_module"]].A1)
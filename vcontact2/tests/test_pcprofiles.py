@@ -0,0 +1,165 @@
+""" Unit test for the pcprofiles module"""
+from .. import pcprofiles
+import numpy as np
+import pandas as pd
+import scipy.sparse as sparse
+import scipy.stats as stats
+
+F = {} # Fixtures
+def setup_module():
+    pcp = pcprofiles.PCProfiles.__new__(pcprofiles.PCProfiles)
+    pcp.__dict__.update(name="test", threads=1, sig=1.0, sig_mod=1.0, mod_shared_min=3, max_memory=None)
+    pcp.contigs = pd.DataFrame({"contig_id": ["a", "b", "c"], "pos": range(3), "proteins": [3, 2, 2]})
+    pcp.pcs = pd.DataFrame({"pc_id": ["PC_0", "PC_1"], "pos": range(2)})
+    pcp.matrix = sparse.csr_matrix(np.array([[1, 1], [1, 0], [0, 1]]))
+    pcp.singletons = sparse.csr_matrix(np.array([[1], [1], [1]]))
+    pcp.ntw = sparse.csr_matrix(np.array([[0, 2.0, 0], [2.0, 0, 0], [0, 0, 0]]))
+    F["pcp"] = pcp
+
+    # Random profiles: contigs drawing their PCs around one of six groups
+    rng = np.random.default_rng(0)
+    n, p = 80, 200
+    dense = np.zeros((n, p), dtype=bool)
+    for i, group in enumerate(rng.integers(0, 6, n)):
+        dense[i, (group * 30 + rng.integers(0, 36, rng.integers(5, 20))) % p] = True
+    F["matrix"] = sparse.csr_matrix(dense)
+    F["singletons"] = sparse.csr_matrix(rng.integers(0, 4, (n, 1)).astype(float))
+    F["contigs"] = pd.DataFrame({"pos": range(n), "contig_id": ["contig_{}".format(i) for i in range(n)]})
+    F["pcs"] = pd.DataFrame({"pos": range(p), "pc_id": ["PC_{}".format(i) for i in range(p)]})
+
+def reference_network(commons, sizes, total, logT, thres, max_sig):
+    """Former per-pair loop of PCProfiles.network and network_modules."""
+    S = sparse.lil_matrix(commons.shape)
+    for A, B in zip(*commons.nonzero()):
+        if A < B:
+            a, b = sorted([sizes[A], sizes[B]])
+            pval = stats.hypergeom.sf(commons[A, B] - 1, total, a, b)
+            sig = np.nan_to_num(-np.log10(pval) - logT)
+            if sig > thres:
+                S[A, B] = min(max_sig, sig)
+    return (S + S.T).tocsr()
+
+def profiles(**kwargs):
+    return pcprofiles.PCProfiles(F["contigs"], F["pcs"], (F["matrix"], F["singletons"]), **kwargs)
+
+def test_store(tmp_path, monkeypatch):
+    def network_modules(*args, **kwargs):
+        calls.append(1)
+        return sparse.csr_matrix((2, 2))
+    calls = []
+    monkeypatch.setattr(pcprofiles.PCProfiles, "network_modules", network_modules)
+
+    path = str(tmp_path / "test.pcp")
+    F["pcp"].to_store(path)
+    pcp = pcprofiles.read_store(path)
+    # The pc network was not stored and is not computed by an attribute lookup
+    assert not hasattr(pcp, "ntw_modules")
+    assert calls == []
+    assert (pcp.ntw != F["pcp"].ntw).nnz == 0
+
+    # The memory-mapped matrices accept the in-place operations of scipy,
+    # without modifying the store
+    pcp.ntw.data[0] = 0
+    pcp.ntw.eliminate_zeros()
+    pcp.ntw.sort_indices()
+    assert pcp.ntw.nnz == 1
+    assert pcprofiles.read_store(path).ntw.nnz == 2
+
+    assert pcp.get_ntw_modules().shape == (2, 2)
+    assert pcp.get_ntw_modules() is pcp.ntw_modules
+    assert calls == [1]
+
+    # The pc network was added to the store, it is read by the next runs
+    pcp = pcprofiles.read_store(path)
+    assert pcp.get_ntw_modules().shape == (2, 2)
+    assert calls == [1]
+
+def test_network_reference():
+    matrix, singletons = F["matrix"], F["singletons"]
+    n = matrix.shape[0]
+    sizes = (matrix.sum(1) + singletons).A1
+    expected = reference_network(
+        matrix.dot(sparse.csr_matrix(matrix.transpose(), dtype=int)),
+        sizes, matrix.shape[1] + singletons.sum(), np.log10(0.5 * n * (n - 1)), 1, 300,
+    )
+    obtained = profiles(threads=1).ntw
+    assert expected.nnz > 0
+    assert ((obtained != 0) != (expected != 0)).nnz == 0
+    np.testing.assert_allclose(obtained[expected.nonzero()].A1, expected[expected.nonzero()].A1)
+
+def test_network_modules_reference():
+    matrix = F["matrix"]
+    number_of_contigs = matrix.sum(0).A1
+    kept = number_of_contigs >= 3
+    T = 0.5 * kept.sum() * (kept.sum() - 1)
+    filtered = matrix[:, np.flatnonzero(kept)]
+    expected = reference_network(
+        sparse.csr_matrix(filtered, dtype=int).transpose().dot(filtered),
+        number_of_contigs[kept], matrix.shape[0], np.log10(T), 1, 300,
+    )
+    obtained = F["pcp"].network_modules(matrix, thres=1, mod_shared_min=3)
+    assert expected.nnz > 0
+    assert ((obtained != 0) != (expected != 0)).nnz == 0
+    np.testing.assert_allclose(obtained[expected.nonzero()].A1, expected[expected.nonzero()].A1)
+
+def test_row_blocks():
+    matrix = F["matrix"]
+    n = matrix.shape[0]
+    assert pcprofiles.row_blocks(matrix) == [(0, n)]
+
+    for kwargs in ({"max_memory": 2000}, {"min_blocks": 8}, {"max_memory": 2000, "min_blocks": 8, "rows": 50}):
+        blocks = pcprofiles.row_blocks(matrix, **kwargs)
+        # Contiguous blocks covering the rows
+        assert blocks[0][0] == 0 and blocks[-1][1] == kwargs.get("rows", n)
+        assert all(end == start for (_, end), (start, _) in zip(blocks, blocks[1:]))
+        assert len(blocks) >= kwargs.get("min_blocks", 1)
+        for start, end in blocks:
+            pairs = len(pcprofiles.shared_features(matrix, start, end)[0])
+            # A block only goes over the budget when it is a single row
+            assert end - start == 1 or pairs * pcprofiles.BYTES_PER_PAIR <= kwargs.get("max_memory", np.inf)
+
+def test_network_max_memory():
+    expected = profiles(threads=1).ntw
+    obtained = profiles(threads=1, max_memory=2000).ntw
+    assert len(pcprofiles.row_blocks(F["matrix"], 2000)) > 10
+    assert (obtained != expected).nnz == 0
+
+    expected = F["pcp"].network_modules(F["matrix"])
+    obtained = F["pcp"].network_modules(F["matrix"], max_memory=500)
+    assert (obtained != expected).nnz == 0
+
+def test_network_threads(monkeypatch):
+    expected = profiles(threads=1).ntw
+    expected_modules = F["pcp"].network_modules(F["matrix"])
+
+    # Many small tasks taken by the workers as they become idle
+    tasks = []
+    row_blocks = pcprofiles.row_blocks
+    def recorded_blocks(*args, **kwargs):
+        tasks.append(row_blocks(*args, **kwargs))
+        return tasks[-1]
+    monkeypatch.setattr(pcprofiles, "row_blocks", recorded_blocks)
+
+    for max_memory in (None, 2000):
+        tasks.clear()
+        obtained = profiles(threads=2, max_memory=max_memory).ntw
+        assert (obtained != expected).nnz == 0
+        assert len(tasks[0]) >= 2 * pcprofiles.TASKS_BY_WORKER
+
+        obtained = F["pcp"].network_modules(F["matrix"], threads=2, max_memory=max_memory)
+        assert (obtained != expected_modules).nnz == 0
+
+def test_pickle(tmp_path):
+    # Objects pickled before the memory budget have no max_memory
+    pcp = pcprofiles.PCProfiles.__new__(pcprofiles.PCProfiles)
+    pcp.__dict__.update({k: v for k, v in F["pcp"].__dict__.items() if k not in ("max_memory", "_store")})
+    pcp.matrix = F["matrix"]
+    pcp.to_pickle(str(tmp_path / "test.pkle"))
+    pcp = pcprofiles.read_pickle(str(tmp_path / "test.pkle"))
+
+    expected = F["pcp"].network_modules(F["matrix"])
+    assert (pcp.get_ntw_modules() != expected).nnz == 0
+    pcp.to_store(str(tmp_path / "test.pcp"))
+    stored = pcprofiles.read_store(str(tmp_path / "test.pcp"))
+    assert stored.max_memory is None
+    assert (stored.get_ntw_modules() != expected).nnz == 0
@@ -0,0 +1,60 @@
+""" Unit test for the refcache module"""
+from .. import pcprofiles
+from .. import refcache
+import os
+import tempfile
+import numpy as np
+import pandas as pd
+import scipy.sparse as sparse
+
+F = {} # Fixtures
+def setup_module():
+    rng = np.random.default_rng(0)
+    n, p = 120, 300
+    dense = np.zeros((n, p), dtype=bool)
+    for i, group in enumerate(rng.integers(0, 6, n)):
+        dense[i, (group * 50 + rng.integers(0, 60, 12)) % p] = True
+    F["matrix"] = sparse.csr_matrix(dense)
+    F["singletons"] = sparse.csr_matrix(rng.integers(0, 3, (n, 1)).astype(float))
+    # As the RefSeq ids, with spaces in the protein2contig files and ~ in
+    # the tables of a run (see read_dfs)
+    F["ids"] = ["Contig virus {}".format(i) for i in range(n)]
+    F["contigs"] = pd.DataFrame({"pos": range(n), "contig_id": [x.replace(" ", "~") for x in F["ids"]]})
+    F["pcs"] = pd.DataFrame({"pos": range(p), "pc_id": ["PC_{}".format(i) for i in range(p)]})
+    F["protein2contig"] = pd.DataFrame({
+        "protein_id": ["protein_{}".format(i) for i in range(0, n, 3) for _ in range(2)],
+        "contig_id": [F["ids"][i] for i in range(0, n, 3) for _ in range(2)],
+    })
+
+def profiles(references=None, threads=1):
+    return pcprofiles.PCProfiles(F["contigs"], F["pcs"], (F["matrix"], F["singletons"]), threads, references=references)
+
+def test_network():
+    expected = profiles().ntw
+    with tempfile.TemporaryDirectory() as folder:
+        ref_fp = os.path.join(folder, "refs.protein2contig.csv")
+        F["protein2contig"].to_csv(ref_fp, index=False)
+        path = os.path.join(folder, "refs.npz")
+        # Computed then read from the cache
+        for threads in (1, 2):
+            cache = refcache.ReferenceCache(path, refcache.read_reference_ids(ref_fp))
+            assert (cache.positions(F["contigs"]["contig_id"]) >= 0).all()
+            obtained = profiles(cache, threads).ntw
+            assert len(cache.shared) > 0
+            assert (obtained != expected).nnz == 0
+        assert os.path.exists(path)
+
+def test_reference_ids():
+    data_dir = os.path.join(os.path.dirname(refcache.__file__), "data")
+    ref_fp = os.path.join(data_dir, "ViralRefSeq-archaea-v211.protein2contig.csv")
+    contig_ids = pd.read_csv(ref_fp)["contig_id"].str.replace(" ", "~")
+    cache = refcache.ReferenceCache("refs.npz", refcache.read_reference_ids(ref_fp))
+    assert len(cache.contig_ids) == contig_ids.nunique()
+    assert (cache.positions(contig_ids.unique()) >= 0).all()
+
+def test_digest():
+    refs = F["matrix"][:10]
+    ids = F["contigs"]["contig_id"].values[:10]
+    permuted = refs[:, np.random.default_rng(1).permutation(refs.shape[1])]
+    assert refcache.profiles_digest(refs, ids) == refcache.profiles_digest(permuted, ids)
+    assert refcache.profiles_digest(refs, ids) != refcache.profiles_digest(F["matrix"][1:11], ids)
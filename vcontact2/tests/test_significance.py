@@ -0,0 +1,69 @@
+""" Unit test for the significance module"""
+from .. import significance
+import numpy.testing
+import numpy as np
+import scipy.stats as stats
+
+F = {} # Fixtures
+def setup_module():
+    F["shared"] = np.array([1, 2, 5, 10, 3, 40, 400])
+    F["a"] = np.array([10, 12, 30, 15, 3, 60, 450])
+    F["b"] = np.array([8, 20, 25, 40, 9, 45, 400])
+    F["total"] = 3000
+    F["logT"] = np.log10(0.5 * 500 * 499)
+
+def test_pairwise_sig():
+    expected = []
+    for k, a, b in zip(F["shared"], F["a"], F["b"]):
+        a, b = sorted([a, b])
+        pval = stats.hypergeom.sf(k - 1, F["total"], a, b)
+        expected.append(np.nan_to_num(-np.log10(pval) - F["logT"]))
+
+    # Chunks smaller than the input exercise the chunked path.
+    obtained = significance.pairwise_sig(F["shared"], F["a"], F["b"], F["total"], F["logT"], chunk_size=3)
+
+    # The last pair underflows the double precision, it is computed in log space.
+    numpy.testing.assert_allclose(obtained[:-1], expected[:-1])
+    assert np.isfinite(obtained[-1]) and obtained[-1] > 300
+
+def test_threshold_table():
+    sizes = np.array([3, 9, 10, 25, 40, 60, 400, 450])
+    table = significance.ThresholdTable(sizes, F["total"], F["logT"], 1)
+    a, b = [x.ravel() for x in np.meshgrid(sizes, sizes)]
+    obtained = table.min_shared(a, b)
+    for k_star, x, y in zip(obtained, a, b):
+        k = np.arange(1, min(x, y) + 1)
+        passing = k[significance.pairwise_sig(k, np.full(len(k), x), np.full(len(k), y), F["total"], F["logT"]) > 1]
+        assert k_star == (passing.min() if len(passing) else min(x, y) + 1)
+
+def test_cache():
+    cache = significance.SignificanceCache(maxsize=4)
+    shared = np.tile(F["shared"][:3], 2)
+    a = np.tile(F["a"][:3], 2)
+    b = np.tile(F["b"][:3], 2)
+    expected = significance.pairwise_sig(shared, a, b, F["total"], F["logT"], cache=None)
+    obtained = significance.pairwise_sig(shared, b, a, F["total"], F["logT"], cache=cache)
+    numpy.testing.assert_allclose(obtained, expected)
+    assert (cache.hits, cache.misses) == (3, 3)
+
+    # Bounded eviction
+    significance.pairwise_sig(F["shared"], F["a"], F["b"], F["total"], F["logT"], cache=cache)
+    assert len(cache) == 4
+
+def test_min_shared_uncached():
+    # The bisection mid-points do not go through the shared cache
+    before = (len(significance.CACHE), significance.CACHE.hits, significance.CACHE.misses)
+    significance.min_shared(F["a"], F["b"], F["total"], F["logT"], 1)
+    assert (len(significance.CACHE), significance.CACHE.hits, significance.CACHE.misses) == before
+
+def test_threshold_table_pairs():
+    # Only the (a, b) pairs met are computed and stored
+    sizes = np.arange(1, 2001)
+    table = significance.ThresholdTable(sizes, F["total"], F["logT"], 1)
+    a, b = np.array([3, 9, 400, 9]), np.array([10, 3, 450, 3])
+    obtained = table.min_shared(a, b)
+    assert len(table.keys) == 3
+    assert (table.min_shared(b[:2], a[:2]) == obtained[:2]).all()
+    assert len(table.keys) == 3
+    expected = significance.min_shared(a, b, F["total"], F["logT"], 1)
+    assert (obtained == expected).all()
@@ -0,0 +1,57 @@
+""" Unit test for the tools module"""
+from .. import tools
+import gzip
+import numpy as np
+import pandas as pd
+import scipy.sparse as sparse
+
+F = {} # Fixtures
+def setup_module():
+    rng = np.random.default_rng(0)
+    n = 50
+    upper = sparse.random(n, n, density=0.1, random_state=1, format="csr")
+    upper.data = np.concatenate([
+        rng.uniform(1, 300, upper.nnz - 4), [300.0, 1e-05, 1.0 / 3, 123456789.5]
+    ])
+    upper = sparse.triu(upper, k=1)
+    F["matrix"] = (upper + upper.T).tocsr()
+    F["names"] = pd.Series(["contig~{}".format(i) for i in range(n)], index=rng.permutation(n))
+
+def former_writer(fi, matrix, names):
+    """Former writer of ContigCluster.to_clusterer and Modules.define_modules."""
+    with open(fi, "wt") as f:
+        matrix = sparse.dok_matrix(matrix)
+        for r, c in zip(*matrix.nonzero()):
+            f.write(" ".join([str(x) for x in (names[r], names[c], matrix[r, c])]))
+            f.write("\n")
+
+def test_write_edges(tmp_path):
+    expected_fp, obtained_fp = str(tmp_path / "expected.ntw"), str(tmp_path / "obtained.ntw")
+    former_writer(expected_fp, F["matrix"], F["names"])
+    # Chunks smaller than the network exercise the chunked path.
+    lines = tools.write_edges(obtained_fp, F["matrix"], F["names"], chunk_size=7)
+    with open(expected_fp, "rb") as f:
+        expected = f.read()
+    with open(obtained_fp, "rb") as f:
+        assert f.read() == expected
+    assert lines == F["matrix"].nnz
+
+def test_write_edges_upper(tmp_path):
+    fi = str(tmp_path / "upper.ntw.gz")
+    lines = tools.write_edges(fi, F["matrix"], F["names"], upper=True, compress=True)
+    with gzip.open(fi, "rt") as f:
+        edges = pd.read_csv(f, sep=" ", header=None, names=["a", "b", "weight"], float_precision="round_trip")
+    assert lines == len(edges) == F["matrix"].nnz // 2
+
+    # Each edge written once, mirroring them gives back the network
+    positions = pd.Series(F["names"].index, index=F["names"].values)
+    a, b = positions[edges["a"]].values, positions[edges["b"]].values
+    assert (a < b).all()
+    upper = sparse.coo_matrix((edges["weight"], (a, b)), shape=F["matrix"].shape)
+    assert abs(upper + upper.T - F["matrix"]).max() == 0
+
+def test_format_edges():
+    lines = "".join(tools.format_edges(F["matrix"], F["names"], chunk_size=3)).splitlines()
+    expected = "".join(tools.format_edges(F["matrix"], F["names"])).splitlines()
+    assert lines == expected and len(lines) == F["matrix"].nnz
+    assert "".join(tools.format_edges(sparse.csr_matrix((3, 3)), F["names"])) == ""
@@ -1,6 +1,19 @@
 """ Useful functions and snippets """
+import csv
+import gzip
+import logging
+
 import networkx
 import numpy as np
+import pandas as pd
+import scipy.sparse as sparse
+
+logger = logging.getLogger(__name__)
+
+# Number of edges formatted at once by write_edges
+EDGES_CHUNK_SIZE = 1000000
+# Write buffer of the edges files (bytes)
+EDGES_BUFFER_SIZE = 16 * 1024**2
 
 
 def summary(matrix, nodeinfo, criterion="origin"):
@@ -90,3 +103,67 @@ def summary_assoc(matrix, info, criterion=None, lines=True, thres=0, name_thres=
         report["most_associated_{}".format(criterion)] = info.loc[np.argmax(assoc_by_element),criterion]
 
     return report
+
+
+def format_edges(matrix, names, upper=False, chunk_size=EDGES_CHUNK_SIZE):
+    """Format a network as an edge list ("name name weight" lines), the
+    input format of MCL (--abc) and ClusterONE (edge_list).
+
+    Args:
+        matrix (scipy.sparse_matrix): network.
+        names (pandas.Series): name of the nodes, indexed by their position
+            in the matrix.
+        upper (bool): Only keep the upper triangle (and diagonal) of the
+            matrix, for a symmetric network read by a tool mirroring the edges.
+        chunk_size (int): Number of lines formatted at once.
+
+    Yields:
+        str: chunks of lines.
+    """
+    matrix = sparse.coo_matrix(matrix)
+    keep = matrix.data != 0
+    if upper:
+        keep &= matrix.row <= matrix.col
+    rows, cols, weights = matrix.row[keep], matrix.col[keep], matrix.data[keep]
+
+    # Node position -> name, then a single take by chunk
+    names = names.reindex(np.arange(matrix.shape[0])).to_numpy(dtype=object)
+
+    for start in range(0, len(rows), chunk_size):
+        chunk = slice(start, start + chunk_size)
+        yield pd.DataFrame(
+            {
+                "a": names.take(rows[chunk]),
+                "b": names.take(cols[chunk]),
+                "weight": weights[chunk],
+            }
+        ).to_csv(sep=" ", header=False, index=False, quoting=csv.QUOTE_NONE)
+
+
+def write_edges(fi, matrix, names, upper=False, compress=False, chunk_size=EDGES_CHUNK_SIZE):
+    """Write a network as an edge list, see format_edges.
+
+    Args:
+        fi (str): filename.
+        matrix (scipy.sparse_matrix): network.
+        names (pandas.Series): name of the nodes, indexed by their position
+            in the matrix.
+        upper (bool): Only write the upper triangle (and diagonal).
+        compress (bool): gzip the file.
+        chunk_size (int): Number of lines formatted and written at once.
+
+    Returns:
+        int: Number of lines written.
+    """
+    if compress:
+        f = gzip.open(fi, "wt")
+    else:
+        f = open(fi, "wt", buffering=EDGES_BUFFER_SIZE)
+    lines = 0
+    with f:
+        for chunk in format_edges(matrix, names, upper, chunk_size):
+            f.write(chunk)
+            lines += chunk.count("\n")
+
+    logger.debug("Saving network in file {0} ({1} lines).".format(fi, lines))
+    return lines